@@ -0,0 +1,164 @@
+"""
+Time alignment of base and rover observations for differencing.
+"""
+
+import numpy as np
+import binr
+
+RECEIVERS = ("rover", "base")
+WEEK = 604800 # GPS week [s]
+
+
+def gps_time(raw):
+    """
+    GPS time of week of a raw data epoch [s].
+    """
+    return (raw["Time"] + raw["GPS time shift"])/1000
+
+
+class EpochAligner:
+    """
+    Pairs base and rover raw data epochs that were measured at the same
+    GPS time.
+
+    Every receiver gets a ring of preallocated epoch slots. An epoch
+    waits in its ring until an epoch of the other receiver within the
+    tolerance arrives, or until it is more than max_wait older than the
+    newest epoch seen, so late or missing epochs never hold on to memory.
+    """
+
+    def __init__(self, tolerance=0.005, max_wait=2.0, capacity=32, max_channels=32):
+        """
+        arguments:
+            tolerance - largest time difference of a pair [s]
+            max_wait - how long an epoch waits for its partner [s]
+            capacity - epochs kept per receiver
+            max_channels - largest number of channels in an epoch
+        """
+        self.tolerance = tolerance
+        self.max_wait = max_wait
+        self.capacity = capacity
+        self.max_channels = max_channels
+        self._header = dict([(name, np.zeros(capacity, dtype=binr.RAW_HEADER_DTYPE))
+                             for name in RECEIVERS])
+        self._channels = dict([(name, np.zeros((capacity, max_channels),
+                                               dtype=binr.RAW_CHANNEL_DTYPE))
+                               for name in RECEIVERS])
+        self._count = dict([(name, np.zeros(capacity, dtype=np.int64)) for name in RECEIVERS])
+        self._time = dict([(name, np.full(capacity, np.nan)) for name in RECEIVERS]) # NaN when free
+        self.latest = np.nan # Newest epoch of either receiver [s]
+        self.last_base = np.nan # Base time of the latest pair [s]
+        self.last_rover = np.nan # Newest rover epoch [s]
+        self.pairs = 0
+        self.unmatched = dict([(name, 0) for name in RECEIVERS]) # Epochs that expired
+        self.late = dict([(name, 0) for name in RECEIVERS]) # Epochs that arrived too late
+
+    @staticmethod
+    def _dt(a, b):
+        """
+        a - b across the week rollover [s].
+        """
+        d = a - b
+        return d - WEEK*np.round(d/WEEK)
+
+    def _epoch(self, name, slot):
+        """
+        Copy of a stored epoch as a raw data dictionary.
+        """
+        header = self._header[name][slot]
+        channels = self._channels[name][slot, :self._count[name][slot]]
+        raw = dict([(field, header[field].item()) for field in binr.RAW_HEADER_DTYPE.names])
+        for field in binr.RAW_CHANNEL_DTYPE.names[:-1]:
+            raw[field] = channels[field].copy()
+        return raw
+
+    def _expire(self):
+        """
+        Free the epochs that waited longer than max_wait.
+        """
+        for name in RECEIVERS:
+            times = self._time[name]
+            stale = self._dt(self.latest, times) > self.max_wait # False for free slots
+            if np.any(stale):
+                self.unmatched[name] += int(np.sum(stale))
+                times[stale] = np.nan
+
+    def add(self, name, raw):
+        """
+        Add an epoch of a receiver.
+
+        arguments:
+            name - "rover" or "base"
+            raw - raw data dictionary from binr.process_raw_data_arrays
+        returns:
+            list of pairs, each a dictionary with
+                "Time" - rover GPS time of week [s]
+                "Age" - rover minus base time [s]
+                "Rover" - rover raw data dictionary
+                "Base" - base raw data dictionary
+        raises:
+            ValueError - for an unknown receiver or too many channels
+        """
+        if name not in self._time:
+            raise ValueError("Unknown receiver: "+str(name))
+        n = len(raw["Signal Type"])
+        if n > self.max_channels:
+            raise ValueError("Too many channels: "+str(n))
+        t = gps_time(raw)
+        if name == "rover" and not self._dt(t, self.last_rover) <= 0:
+            self.last_rover = t
+        if np.isnan(self.latest) or self._dt(t, self.latest) > 0:
+            self.latest = t
+        elif self._dt(self.latest, t) > self.max_wait:
+            self.late[name] += 1
+            return []
+        self._expire()
+
+        # Pair with the closest waiting epoch of the other receiver
+        other = "base" if name == "rover" else "rover"
+        dt = np.abs(self._dt(self._time[other], t))
+        if np.any(dt <= self.tolerance):
+            match = int(np.nanargmin(dt))
+            self._time[other][match] = np.nan
+            partner = self._epoch(other, match)
+            epoch = dict(raw)
+            if name == "rover":
+                rover, base = epoch, partner
+            else:
+                rover, base = partner, epoch
+            t_rover = gps_time(rover)
+            self.last_base = gps_time(base)
+            self.pairs += 1
+            return [{"Time":t_rover, "Age":self._dt(t_rover, self.last_base),
+                     "Rover":rover, "Base":base}]
+
+        # Wait for the partner in a free slot, or in place of the oldest epoch
+        times = self._time[name]
+        free = np.flatnonzero(np.isnan(times))
+        if len(free) > 0:
+            slot = int(free[0])
+        else:
+            slot = int(np.argmax(self._dt(t, times)))
+            self.unmatched[name] += 1
+        self._time[name][slot] = t
+        self._count[name][slot] = n
+        header = self._header[name][slot]
+        for field in binr.RAW_HEADER_DTYPE.names:
+            header[field] = raw[field]
+        channels = self._channels[name][slot]
+        for field in binr.RAW_CHANNEL_DTYPE.names[:-1]:
+            channels[field][:n] = raw[field]
+        return []
+
+    def age(self):
+        """
+        Age of the differential data, the newest rover time minus the
+        base time of the latest pair [s]. NaN before the first pair.
+        """
+        return self._dt(self.last_rover, self.last_base)
+
+    def waiting(self, name):
+        """
+        Number of epochs of a receiver waiting for a partner.
+        """
+        return int(np.sum(~np.isnan(self._time[name])))
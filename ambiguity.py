@@ -0,0 +1,229 @@
+"""
+Integer ambiguity resolution with the LAMBDA method.
+
+The float double difference ambiguities are decorrelated with an
+integer Z-transform and the integer least squares problem is solved with
+a depth first search that shrinks its ellipsoid as candidates are found
+(MLAMBDA). The search stops at a node limit or time budget so a bad
+epoch cannot stall the real-time loop.
+"""
+
+import time
+import numpy as np
+
+MAX_NODES = 100000 # Largest number of search nodes per epoch
+TIME_BUDGET = 0.05 # Largest search time per epoch [s]
+RATIO_THRESHOLD = 3.0 # Smallest ratio of second best to best residual to fix
+
+
+def ld_factorize(Q):
+    """
+    LtDL factorization of a covariance matrix, Q = L'*diag(D)*L.
+
+    arguments:
+        Q - (n, n) symmetric positive definite matrix
+    returns:
+        L - (n, n) unit lower triangular matrix
+        D - (n,) diagonal
+    raises:
+        ValueError - if Q is not positive definite
+    """
+    A = np.array(Q, dtype=np.float64)
+    n = len(A)
+    L = np.zeros((n, n))
+    D = np.zeros(n)
+    for i in range(n-1, -1, -1):
+        D[i] = A[i, i]
+        if D[i] <= 0:
+            raise ValueError("Covariance is not positive definite")
+        L[i, :i+1] = A[i, :i+1]/np.sqrt(D[i])
+        for j in range(i):
+            A[j, :j+1] -= L[i, :j+1]*L[i, j]
+        L[i, :i+1] /= L[i, i]
+    return L, D
+
+
+def _gauss(L, Z, i, j):
+    """
+    Integer Gauss transformation of column j with row i.
+    """
+    mu = np.round(L[i, j])
+    if mu != 0:
+        L[i:, j] -= mu*L[i:, i]
+        Z[:, j] -= mu*Z[:, i]
+
+
+def _permute(L, D, j, delta, Z):
+    """
+    Swap ambiguities j and j+1.
+    """
+    eta = D[j]/delta
+    lam = D[j+1]*L[j+1, j]/delta
+    D[j] = eta*D[j+1]
+    D[j+1] = delta
+    L[j:j+2, :j] = np.array([[-L[j+1, j], 1.0], [eta, lam]]) @ L[j:j+2, :j]
+    L[j+1, j] = lam
+    L[j+2:, [j, j+1]] = L[j+2:, [j+1, j]]
+    Z[:, [j, j+1]] = Z[:, [j+1, j]]
+
+
+def decorrelate(L, D):
+    """
+    Reduce the correlation of the ambiguities with an integer Z-transform,
+    in place.
+
+    arguments:
+        L, D - factorization of the ambiguity covariance
+    returns:
+        Z - (n, n) unimodular transform, z = Z'*a
+    """
+    n = len(D)
+    Z = np.eye(n)
+    j = n - 2
+    k = n - 2
+    while j >= 0:
+        if j <= k:
+            for i in range(j+1, n):
+                _gauss(L, Z, i, j)
+        delta = D[j] + L[j+1, j]**2*D[j+1]
+        if delta + 1E-6 < D[j+1]:
+            _permute(L, D, j, delta, Z)
+            k = j
+            j = n - 2
+        else:
+            j -= 1
+    return Z
+
+
+def search(zs, L, D, candidates=2, max_nodes=MAX_NODES, time_budget=TIME_BUDGET):
+    """
+    Integer least squares search of the decorrelated ambiguities.
+
+    arguments:
+        zs - (n,) float decorrelated ambiguities
+        L, D - factorization of their covariance
+        candidates - number of best candidates to keep
+        max_nodes - node limit
+        time_budget - time limit [s]
+    returns:
+        zn - (candidates, n) candidates sorted by residual
+        s - (candidates,) squared residuals
+        nodes - number of nodes visited
+        complete - False if the search stopped at a limit
+    """
+    n = len(zs)
+    start = time.perf_counter()
+    S = np.zeros((n, n))
+    dist = np.zeros(n)
+    zb = np.zeros(n)
+    z = np.zeros(n)
+    step = np.zeros(n)
+    zn = np.zeros((candidates, n))
+    s = np.full(candidates, np.inf)
+    found = 0
+    imax = 0
+    maxdist = np.inf
+    nodes = 0
+    complete = True
+
+    k = n - 1
+    zb[k] = zs[k]
+    z[k] = round(zb[k])
+    y = zb[k] - z[k]
+    step[k] = 1.0 if y > 0 else -1.0
+    while True:
+        nodes += 1
+        if nodes > max_nodes or (nodes % 256 == 0 and
+                                 time.perf_counter() - start > time_budget):
+            complete = False
+            break
+        newdist = dist[k] + y*y/D[k]
+        if newdist < maxdist:
+            if k != 0:
+                # Move down a level
+                k -= 1
+                dist[k] = newdist
+                S[k, :k+1] = S[k+1, :k+1] + (z[k+1] - zb[k+1])*L[k+1, :k+1]
+                zb[k] = zs[k] + S[k, k]
+                z[k] = round(zb[k])
+                y = zb[k] - z[k]
+                step[k] = 1.0 if y > 0 else -1.0
+            else:
+                # Store the candidate and shrink the ellipsoid when full
+                if found < candidates:
+                    if found == 0 or newdist > s[imax]:
+                        imax = found
+                    zn[found] = z
+                    s[found] = newdist
+                    found += 1
+                else:
+                    if newdist < s[imax]:
+                        zn[imax] = z
+                        s[imax] = newdist
+                        imax = int(np.argmax(s))
+                    maxdist = s[imax]
+                z[0] += step[0]
+                y = zb[0] - z[0]
+                step[0] = -step[0] - (1.0 if step[0] > 0 else -1.0)
+        else:
+            # Move up a level
+            if k == n - 1:
+                break
+            k += 1
+            z[k] += step[k]
+            y = zb[k] - z[k]
+            step[k] = -step[k] - (1.0 if step[k] > 0 else -1.0)
+
+    order = np.argsort(s)
+    return zn[order], s[order], nodes, complete
+
+
+def resolve(a, Q, ratio_threshold=RATIO_THRESHOLD, max_nodes=MAX_NODES,
+            time_budget=TIME_BUDGET):
+    """
+    Resolve float double difference ambiguities to integers.
+
+    arguments:
+        a - (n,) float ambiguities [cycles]
+        Q - (n, n) covariance of the float ambiguities [cycles^2]
+        ratio_threshold - smallest runner-up to best residual ratio to fix
+        max_nodes - search node limit
+        time_budget - search time limit [s]
+    returns:
+        dictionary with
+            "Fixed" - (n,) best integer ambiguities
+            "Runner Up" - (n,) second best integer ambiguities
+            "Residuals" - squared residuals of the best and runner-up
+            "Ratio" - runner-up over best residual
+            "Accepted" - True if the search completed and passed the ratio test
+            "Nodes" - number of search nodes visited
+            "Complete" - False if the search stopped at a limit
+    raises:
+        ValueError - if Q is not positive definite or the sizes differ
+    """
+    a = np.asarray(a, dtype=np.float64)
+    Q = np.asarray(Q, dtype=np.float64)
+    n = len(a)
+    if Q.shape != (n, n) or n == 0:
+        raise ValueError("Ambiguity and covariance sizes do not match")
+
+    # Decorrelate, search and transform back, a = Z'^-1 z
+    L, D = ld_factorize(Q)
+    Z = decorrelate(L, D)
+    zs = Z.T @ a
+    zn, s, nodes, complete = search(zs, L, D, 2, max_nodes, time_budget)
+    found = np.isfinite(s)
+    fixed = np.full((2, n), np.nan)
+    if np.any(found):
+        fixed[found] = np.round(np.linalg.solve(Z.T, zn[found].T).T)
+
+    ratio = np.nan
+    if np.all(found):
+        ratio = s[1]/s[0] if s[0] > 0 else np.inf
+    return {"Fixed":fixed[0],
+            "Runner Up":fixed[1],
+            "Residuals":s,
+            "Ratio":ratio,
+            "Accepted":bool(complete and ratio >= ratio_threshold),
+            "Nodes":nodes,
+            "Complete":complete}
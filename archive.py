@@ -0,0 +1,403 @@
+"""
+Compact archive of decoded raw data (F5h) observations.
+
+Observations are grouped into arcs, runs of consecutive epochs of one
+satellite signal. Along an arc every observable is quantized to a fixed
+resolution and stored as integer differences, second differences for
+carrier phase and pseudo range and first differences for Doppler and
+SNR, which are small. The differences are bit packed in chunks, each
+chunk with its own bit width and the rare values that do not fit, like
+cycle slips, packed separately as exceptions. Flags only change now and
+then along an arc and are stored as runs.
+
+The archive is one file, a JSON header followed by aligned blocks.
+Opening it memory maps the file without reading the blocks, and arcs or
+columns are only decoded when they are asked for. Only the arc table is
+a zero copy view of the file. Bit packed differences cannot be viewed
+as float arrays, so the observables are always decoded into memory, the
+price of an archive about 5 times smaller than float columns. Decode
+single arcs with ObservationArchive.arc to touch only the chunks that
+hold them.
+"""
+
+import json
+import struct
+import numpy as np
+import binr
+
+MAGIC = b"NVSOBS01"
+PREAMBLE = struct.Struct('<8sQ') # Magic, header length
+ALIGNMENT = 8 # Alignment of the blocks [bytes]
+CHUNK_SIZE = 1024 # Values per chunk
+
+# Quantization of the observables, the largest error is half of it
+RESOLUTION = {"Carrier Phase":1E-3, # [cycles]
+              "Pseudo Range":1E-2/299792458.0*1000, # 1 cm [ms]
+              "Doppler Freq":1E-2, # [Hz]
+              "SNR":1.0} # [dB-Hz]
+# Order of the stored differences
+ORDER = {"Carrier Phase":2,
+         "Pseudo Range":2,
+         "Doppler Freq":1,
+         "SNR":1}
+COLUMNS = list(RESOLUTION)
+
+# Arc table record
+ARC_DTYPE = np.dtype([("Signal Type", 'u1'),
+                      ("Sat Number", 'u1'),
+                      ("Carrier Number", 'i1'),
+                      ("First Epoch", '<i8'), # Index of the first epoch
+                      ("Length", '<i8'), # Number of epochs
+                      ("Start", '<i8')] + # Index of the first observation in the columns
+                     [(name+" First", '<i8') for name in COLUMNS] + # Quantized first value
+                     [(name+" Step", '<i8') for name in COLUMNS]) # Quantized first difference
+
+
+def _pack_bits(values, bits):
+    """
+    Bit planes of unsigned values, least significant bit first.
+    """
+    return ((values[:, None] >> np.arange(bits, dtype=np.uint64)) & np.uint64(1)).astype(np.uint8)
+
+
+def _unpack_bits(planes, count, bits):
+    """
+    Inverse of _pack_bits.
+    """
+    planes = planes.reshape(count, bits).astype(np.uint64)
+    return (planes << np.arange(bits, dtype=np.uint64)).sum(axis=1, dtype=np.uint64)
+
+
+def _bit_lengths(values):
+    lengths = np.zeros(len(values), dtype=np.int64)
+    nonzero = values > 0
+    lengths[nonzero] = np.floor(np.log2(values[nonzero].astype(np.float64))).astype(np.int64) + 1
+    return np.minimum(lengths, 64)
+
+
+def pack_ints(values):
+    """
+    Bit pack signed integers with the bit width that gives the smallest
+    size. Values that do not fit are exceptions, packed after the others
+    with their positions and the width of the largest one.
+
+    arguments:
+        values - (n,) int64 array
+    returns:
+        bits - bit width
+        exception_bits - bit width of the exceptions
+        exception_count - number of exceptions
+        packed - uint8 array
+    """
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+    lengths = _bit_lengths(zigzag)
+    position_bits = int(_bit_lengths(np.array([max(len(values) - 1, 0)], dtype=np.uint64))[0])
+    exception_bits = int(lengths.max()) if len(values) > 0 else 0
+
+    larger = len(values) - np.cumsum(np.bincount(lengths, minlength=65))
+    bits = int(np.argmin(len(values)*np.arange(65) + (position_bits + exception_bits)*larger))
+
+    outside = np.flatnonzero(lengths > bits)
+    if len(outside) == 0:
+        exception_bits = 0
+    planes = [_pack_bits(np.where(lengths > bits, 0, zigzag), bits).ravel(),
+              _pack_bits(outside.astype(np.uint64), position_bits).ravel(),
+              _pack_bits(zigzag[outside], exception_bits).ravel()]
+    return bits, exception_bits, len(outside), np.packbits(np.concatenate(planes), bitorder='little')
+
+
+def unpack_ints(packed, count, bits, exception_bits, exception_count):
+    """
+    Inverse of pack_ints.
+    """
+    position_bits = int(_bit_lengths(np.array([max(count - 1, 0)], dtype=np.uint64))[0])
+    sizes = np.cumsum([count*bits, exception_count*position_bits, exception_count*exception_bits])
+    planes = np.unpackbits(packed, count=int(sizes[-1]), bitorder='little')
+    zigzag = _unpack_bits(planes[:sizes[0]], count, bits)
+    positions = _unpack_bits(planes[sizes[0]:sizes[1]], exception_count, position_bits)
+    zigzag[positions.astype(np.int64)] = _unpack_bits(planes[sizes[1]:], exception_count,
+                                                      exception_bits)
+    return (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+
+
+def find_arcs(obs, epoch_index):
+    """
+    Sort observations into arcs.
+
+    arguments:
+        obs - RAW_CHANNEL_DTYPE array
+        epoch_index - epoch of every observation
+    returns:
+        order - observation order, arc by arc
+        starts - index into order where every arc starts
+    """
+    key = (obs["Signal Type"].astype(np.int64)*65536 + obs["Sat Number"].astype(np.int64)*256 +
+           obs["Carrier Number"].astype(np.int64) + 128)
+    order = np.lexsort((epoch_index, key))
+    key = key[order]
+    epochs = epoch_index[order]
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (key[1:] != key[:-1]) | (epochs[1:] != epochs[:-1] + 1)
+    return order, np.flatnonzero(new)
+
+
+def _arc_positions(starts, lengths):
+    """
+    Arc and position in the arc of every observation.
+    """
+    arc_of = np.repeat(np.arange(len(starts)), lengths)
+    if len(starts) == 0:
+        return arc_of, arc_of
+    return arc_of, np.arange(len(arc_of)) - (starts - starts[0])[arc_of]
+
+
+def _differences(values, local, skip):
+    """
+    Differences along the arcs, zero for the first skip + 1 observations
+    of every arc.
+    """
+    diff = np.zeros(len(values), dtype=np.int64)
+    diff[1:] = np.diff(values)
+    diff[local <= skip] = 0
+    return diff
+
+
+def _integrate(diff, first, arc_of, local):
+    """
+    Values along the arcs from their first values and differences.
+    """
+    total = np.cumsum(np.where(local == 0, 0, diff))
+    return first[arc_of] + total - total[local == 0][arc_of]
+
+
+def _second_differences(values):
+    """
+    Second differences that cumsum twice back to the values, wrapping
+    like the int64 arithmetic does.
+    """
+    return np.diff(np.diff(values, prepend=0), prepend=0)
+
+
+class _Writer:
+    """
+    Collects the aligned blocks of an archive.
+    """
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.blocks = []
+        self.size = 0
+
+    def add(self, array):
+        """
+        Add a block.
+
+        returns:
+            offset of the block after the header [bytes]
+        """
+        data = np.ascontiguousarray(array).tobytes()
+        offset = self.size
+        self.blocks.append(data)
+        self.size += len(data)
+        padding = -self.size % ALIGNMENT
+        if padding:
+            self.blocks.append(b'\0'*padding)
+            self.size += padding
+        return offset
+
+    def add_ints(self, values):
+        """
+        Bit pack an int64 column chunk by chunk.
+
+        returns:
+            list of chunk descriptions [count, bits, exception bits,
+            exceptions, offset, length]
+        """
+        chunks = []
+        for start in range(0, len(values), self.chunk_size):
+            chunk = values[start:start+self.chunk_size]
+            bits, exception_bits, exception_count, packed = pack_ints(chunk)
+            chunks.append([len(chunk), bits, exception_bits, exception_count,
+                           self.add(packed), len(packed)])
+        return chunks
+
+
+def write_archive(filename, recording, chunk_size=CHUNK_SIZE):
+    """
+    Write the observations of a decoded recording to an archive.
+
+    arguments:
+        filename - archive to create
+        recording - dictionary from binr.load_recording
+        chunk_size - values per chunk
+    raises:
+        ValueError - if an observable is not finite
+    """
+    epochs = recording["Epochs"]
+    obs = recording["Observations"]
+    epoch_index = np.asarray(recording["Epoch Index"], dtype=np.int64)
+    order, starts = find_arcs(obs, epoch_index)
+    obs = obs[order]
+    lengths = np.diff(np.append(starts, len(obs)))
+    arc_of, local = _arc_positions(starts, lengths)
+
+    arcs = np.zeros(len(starts), dtype=ARC_DTYPE)
+    for name in ["Signal Type", "Sat Number", "Carrier Number"]:
+        arcs[name] = obs[name][starts]
+    arcs["First Epoch"] = epoch_index[order][starts]
+    arcs["Length"] = lengths
+    arcs["Start"] = starts
+
+    writer = _Writer(chunk_size)
+    header = {"Observations":len(obs), "Chunk Size":chunk_size,
+              "Resolution":RESOLUTION, "Order":ORDER,
+              "Epochs":{"count":len(epochs)}, "Columns":{}}
+
+    # Epoch table without loss, floats as their bit patterns
+    for name in epochs.dtype.names:
+        values = epochs[name]
+        if values.dtype.kind == 'f':
+            values = values.astype('<f8').view('<i8')
+        header["Epochs"][name] = writer.add_ints(_second_differences(values.astype(np.int64)))
+
+    # Differences along the arcs, the first value and step are in the arc table
+    for name in COLUMNS:
+        values = obs[name].astype(np.float64)
+        if not np.all(np.isfinite(values)):
+            raise ValueError("Observable is not finite: "+name)
+        diff = np.round(values/RESOLUTION[name]).astype(np.int64)
+        arcs[name+" First"] = diff[starts]
+        for skip in range(ORDER[name]):
+            diff = _differences(diff, local, skip)
+            if skip == 0:
+                arcs[name+" Step"] = diff[np.minimum(starts + 1, len(obs) - 1)]*(lengths > 1)
+        header["Columns"][name] = writer.add_ints(diff)
+
+    # Flags as runs, every arc starts a run
+    flags = obs["Flags"]
+    changed = np.append(True, flags[1:] != flags[:-1])
+    runs = np.flatnonzero((local == 0) | changed)
+    header["Flags"] = {"Starts":writer.add_ints(np.diff(runs, prepend=0)),
+                       "Values":writer.add(flags[runs]), "count":len(runs)}
+    header["Arcs"] = {"offset":writer.add(arcs), "count":len(arcs)}
+
+    # Header then blocks, the blocks start aligned
+    text = json.dumps(header).encode()
+    text += b' '*(-(PREAMBLE.size + len(text)) % ALIGNMENT)
+    with open(filename, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, len(text)))
+        f.write(text)
+        for block in writer.blocks:
+            f.write(block)
+
+
+class ObservationArchive:
+    """
+    Memory mapped observation archive. The arc table is a view into the
+    file, the packed columns are decoded into new arrays on request and
+    are never memory mapped themselves.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._map = np.memmap(filename, dtype=np.uint8, mode='r')
+        magic, length = PREAMBLE.unpack(self._map[:PREAMBLE.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError("Not an observation archive: "+str(filename))
+        self.header = json.loads(self._map[PREAMBLE.size:PREAMBLE.size+length].tobytes())
+        self._data = PREAMBLE.size + length
+        self.chunk_size = self.header["Chunk Size"]
+        self.arcs = self._view(self.header["Arcs"]["offset"], ARC_DTYPE,
+                               self.header["Arcs"]["count"])
+        self._epochs = None
+        self._runs = None
+
+    def __len__(self):
+        return self.header["Observations"]
+
+    def _view(self, offset, dtype, count):
+        start = self._data + offset
+        return self._map[start:start + count*np.dtype(dtype).itemsize].view(dtype)
+
+    def _ints(self, chunks, first=0, stop=None):
+        """
+        Decode the chunks of a packed column that hold values first to stop.
+        """
+        if stop is None:
+            stop = sum([chunk[0] for chunk in chunks])
+        if stop <= first:
+            return np.zeros(0, dtype=np.int64)
+        selected = range(first//self.chunk_size, (stop - 1)//self.chunk_size + 1)
+        out = []
+        for i in selected:
+            count, bits, exception_bits, exception_count, offset, length = chunks[i]
+            out.append(unpack_ints(self._view(offset, np.uint8, length), count,
+                                   bits, exception_bits, exception_count))
+        skip = first - selected.start*self.chunk_size
+        return np.concatenate(out)[skip:skip + stop - first]
+
+    @property
+    def epochs(self):
+        """
+        RAW_HEADER_DTYPE epoch table, decoded on first use.
+        """
+        if self._epochs is None:
+            self._epochs = np.zeros(self.header["Epochs"]["count"], dtype=binr.RAW_HEADER_DTYPE)
+            for name in self._epochs.dtype.names:
+                values = np.cumsum(np.cumsum(self._ints(self.header["Epochs"][name])))
+                if self._epochs.dtype[name].kind == 'f':
+                    values = values.view('<f8')
+                self._epochs[name] = values
+        return self._epochs
+
+    def _flags(self, first, stop):
+        if self._runs is None:
+            runs = self.header["Flags"]
+            self._runs = (np.cumsum(self._ints(runs["Starts"])),
+                          self._view(runs["Values"], np.uint8, runs["count"]))
+        starts, values = self._runs
+        return values[np.searchsorted(starts, np.arange(first, stop), side='right') - 1]
+
+    def _decode_arcs(self, arcs):
+        """
+        Observations of consecutive arcs.
+        """
+        first = int(arcs["Start"][0])
+        stop = int(arcs["Start"][-1] + arcs["Length"][-1])
+        arc_of, local = _arc_positions(arcs["Start"], arcs["Length"])
+        obs = np.zeros(stop - first, dtype=binr.RAW_CHANNEL_DTYPE)
+        for name in ["Signal Type", "Sat Number", "Carrier Number"]:
+            obs[name] = arcs[name][arc_of]
+        for name in COLUMNS:
+            values = self._ints(self.header["Columns"][name], first, stop)
+            if self.header["Order"][name] == 2:
+                values = _integrate(np.where(local == 1, 0, values), arcs[name+" Step"],
+                                    arc_of, local)
+            values = _integrate(values, arcs[name+" First"], arc_of, local)
+            obs[name] = values*self.header["Resolution"][name]
+        obs["Flags"] = self._flags(first, stop)
+        return obs, arcs["First Epoch"][arc_of] + local
+
+    def arc(self, i):
+        """
+        Decode one arc.
+
+        returns:
+            obs - RAW_CHANNEL_DTYPE array, one row per epoch of the arc
+            epoch_index - epoch of every observation
+        """
+        return self._decode_arcs(self.arcs[i:i+1])
+
+    def decode(self):
+        """
+        Decode every observation, in epoch order like binr.load_recording.
+
+        returns:
+            obs - RAW_CHANNEL_DTYPE array
+            epoch_index - epoch of every observation
+        """
+        if len(self.arcs) == 0:
+            return np.zeros(0, dtype=binr.RAW_CHANNEL_DTYPE), np.zeros(0, dtype=np.int64)
+        obs, epoch_index = self._decode_arcs(self.arcs)
+        order = np.argsort(epoch_index, kind='stable')
+        return obs[order], epoch_index[order]
@@ -7,6 +7,8 @@ Bosmans Crossing
 June 2018
 """
 
+import mmap
+import os
 import struct
 import numpy as np
 
@@ -20,10 +22,175 @@ GPS = 1
 GLONASS = 2
 
 
+# Framing bytes
+DLE = 0x10 # Data link escape, opens a frame and is doubled inside data
+ETX = 0x03 # End of text, closes a frame when preceded by DLE
+MAX_FRAME_LENGTH = 4096 # Longest frame accepted before resyncing [bytes]
+
+
+def unstuff(data):
+    """
+    Remove the DLE stuffing from the data portion of a frame. Every 
+    DLE inside the data is sent twice.
+
+    arguments:
+        data - stuffed data bytes
+    returns:
+        data bytes as the receiver generated them
+    """
+    return bytes(data).replace(b'\x10\x10', b'\x10')
+
+
+def stuff(data):
+    """
+    Double every DLE in the data portion of a frame, the inverse of
+    unstuff.
+    """
+    return bytes(data).replace(b'\x10', b'\x10\x10')
+
+
+def build_frame(message_id, data):
+    """
+    Frame a message the way the receiver sends it.
+
+    arguments:
+        message_id - BINR message ID
+        data - unstuffed data bytes
+    returns:
+        frame bytes from the opening DLE to the closing DLE ETX
+    """
+    return bytes([DLE, message_id]) + stuff(data) + bytes([DLE, ETX])
+
+
+def _next_frame(buffer, pos, start):
+    """
+    Scan a byte buffer for the next complete BINR frame.
+
+    <DLE><ID>[data]<DLE><ETX> with every DLE inside [data] doubled.
+
+    arguments:
+        buffer - bytes/bytearray/mmap to scan
+        pos - index to resume scanning from
+        start - index of the DLE opening a partial frame, -1 if hunting
+    returns:
+        frame - {ID, data} or None if more bytes are needed, data is
+                unstuffed
+        pos - index to resume scanning from, just past the frame
+        start - index of the DLE opening the returned frame, or of a 
+                partial frame, -1 if hunting
+    """
+    length = len(buffer)
+    while True:
+        i = buffer.find(b'\x10', pos)
+        if i < 0:
+            return None, length, start
+        if i + 1 >= length:
+            return None, i, start
+        next_byte = buffer[i+1]
+
+        if start < 0:
+            # Hunting for a frame, skip escaped data and stray endings
+            if next_byte == DLE or next_byte == ETX:
+                pos = i + 2
+            else:
+                start = i
+                pos = i + 2
+        elif next_byte == DLE:
+            pos = i + 2 # Escaped data byte
+        elif next_byte == ETX:
+            frame = {"ID":buffer[start+1], "data":unstuff(buffer[start+2:i])}
+            return frame, i + 2, start
+        else:
+            # Lone DLE inside a frame, the frame is corrupt so resync here
+            start = -1
+            pos = i
+
+
+class BinrFramer:
+    """
+    Incremental BINR framer. Bytes are fed in as they arrive and
+    complete frames are returned as soon as their <DLE><ETX> is seen.
+
+    The scan position is kept between calls so every byte is only
+    looked at once, and consumed bytes are released from the front of
+    the buffer.
+    """
+
+    def __init__(self, max_frame_length=MAX_FRAME_LENGTH):
+        """
+        arguments:
+            max_frame_length - partial frames longer than this are 
+                               dropped and the framer resyncs [bytes]
+        """
+        self.max_frame_length = max_frame_length
+        self._buffer = bytearray()
+        self._pos = 0 # Next index to scan
+        self._start = -1 # Index of the DLE opening a partial frame
+
+    def feed(self, chunk):
+        """
+        Add bytes to the framer and return the frames they completed.
+
+        arguments:
+            chunk - bytes, bytearray, memoryview or list of ints
+        returns:
+            list[{ID, data}] of completed frames in arrival order,
+            data is unstuffed
+        """
+        buffer = self._buffer
+        buffer += chunk
+        pos = self._pos
+        start = self._start
+
+        frames = []
+        while True:
+            frame, pos, start = _next_frame(buffer, pos, start)
+            if frame is None:
+                break
+            frames.append(frame)
+            start = -1
+
+        # Give up on frames that never end
+        if start >= 0 and pos - start > self.max_frame_length:
+            pos = start + 1
+            start = -1
+            while True:
+                frame, pos, start = _next_frame(buffer, pos, start)
+                if frame is None:
+                    break
+                frames.append(frame)
+
+        # Release everything before the partial frame or scan position
+        keep = start if start >= 0 else pos
+        if keep > 0:
+            del buffer[:keep]
+            pos = pos - keep
+            if start >= 0:
+                start = start - keep
+        self._pos = pos
+        self._start = start
+        return frames
+
+    def pending(self):
+        """
+        Number of buffered bytes not yet returned as a frame.
+        """
+        return len(self._buffer)
+
+    def reset(self):
+        """
+        Discard all buffered bytes.
+        """
+        del self._buffer[:]
+        self._pos = 0
+        self._start = -1
+
+
 def process_msg(buffer):
     """
     Process a BINR message and return a dictionary with 
-    # the message ID and data.
+    the message ID and data. Use BinrFramer for streams, this 
+    function copies the remaining buffer on every call.
 
     <DLE><ID>[data]<DLE><ETX>
     
@@ -31,34 +198,168 @@ def process_msg(buffer):
         buffer - byte buffer containing BINR data
     returns:
         {message_ID, data}
-            data - array of data bytes contained in the message
+            data - unstuffed data bytes contained in the message
         remaining_buffer - buffer with processed msg removed
     raises:
         ValueError - If no message could be found
     """
-    # Check that message has valid start and stop bytes
-    # and grab the message string from the buffer
-    try:
-        start_id = buffer.index(0x10)
-        searching = True
-        stop_id_offset = 0
-        while searching:
-            stop_id = buffer[start_id+1+stop_id_offset:].index(0x10)+start_id+1+stop_id_offset
-            if len(buffer) >= stop_id + 2 and buffer[stop_id + 1]== 0x03:
-                searching = False
-            else:
-                stop_id_offset = stop_id+1
-        msg = buffer[start_id:stop_id+2]
-    except ValueError:
+    # Scan for the first complete frame. The buffer is copied once so
+    # lists of ints can be searched at C speed.
+    frame, pos, start = _next_frame(bytes(buffer), 0, -1)
+    if frame is None:
         raise ValueError("Buffer did not contain message")
 
-    # Grab the message id and data segments
-    message_id = struct.unpack('<B',bytearray(msg[1:1+1]))[0] # Flag of user dynamic 0 - static, 1 - kinematic
+    # Return the message and rest of the buffer
+    return frame, buffer[pos:]
+
+# Message layouts. Every fixed length message is described once as a list 
+# of (field name, struct format) in transmission order and keyed by 
+# (message ID, system byte). Messages without a system byte use None.
+GPS_EPHEMERIS_FIELDS = [
+    ("System", 'B'), # 1 - GPS
+    ("PRN", 'B'), # On-board number
+    ("C_rs", 'f'), # Orbit Radius Sine Correction [m]
+    ("dn", 'f'), # Difference between principle motion and defined motion [rad/ms]
+    ("M_0", 'd'), # Mean Anomaly[rad]
+    ("C_uc", 'f'), # Longitude Argument Cosine Correction [rad]
+    ("e", 'd'), # Eccentricity
+    ("C_us", 'f'), # Latitude Argument Sine Correction [rad]
+    ("sqrtA", 'd'), # Square root of the major semi-axis [sqrt_m]
+    ("t_0e", 'd'), # Ephemerides reference time [ms]
+    ("C_ic", 'f'), # Cosine correction to the inclination angle [rad]
+    ("Omega_0", 'd'), # Orbital Plane Ascending Node Longitude [rad]
+    ("C_is", 'f'), # Sine correction to the inclination angle [rad]
+    ("I_0", 'd'), # Inclination angle [rad]
+    ("C_rc", 'f'), # Orbit Radius Cosine Correction [m]
+    ("w", 'd'), # Ascending node-perigee angle [rad]
+    ("Omega_dot", 'd'), # Direct Descending Change Speed [rad/ms]
+    ("IDOT", 'd'), # Inclination angle change speed [rad/ms]
+    ("T_GD", 'f'), # Group Differential Delay Estimation [ms]
+    ("t_0c", 'd'), # Time correction [ms]
+    ("a_f2", 'f'), # Time correction [ms/ms^2]
+    ("a_f1", 'f'), # Time correction [ms/ms]
+    ("a_f0", 'f'), # Time correction [ms]
+    ("URA", 'H'), # User measurement accuracy
+    ("IODE", 'H')] # An identifier of a set of ephemerides
+
+GLONASS_EPHEMERIS_FIELDS = [
+    ("H_n^A", 'b'), # Carrier frequency number
+    ("x_n", 'd'), # Coordinates [m]
+    ("y_n", 'd'), # Coordinates [m]
+    ("z_n", 'd'), # Coordinates [m]
+    ("x_nv", 'd'), # Speed [m/ms]
+    ("y_nv", 'd'), # Speed [m/ms]
+    ("z_nv", 'd'), # Speed [m/ms]
+    ("x_na", 'd'), # acceleration [m/ms^2]
+    ("y_na", 'd'), # acceleration [m/ms^2]
+    ("z_na", 'd'), # acceleration [m/ms^2]
+    ("t_b", 'd'), # Time interval inside the current day [msec]
+    ("gamma_n", 'f'), # Signal-carrier frequency value relative deviation
+    ("tau_n", 'f'), # Satellite time scale offset value in relation to the GLONASS scale [ms]
+    ("E_n", 'H')] # Age of the operative information [days]
+
+MESSAGE_SCHEMAS = {
+    # SV ephemeris (49h)
+    (0x49, GPS): GPS_EPHEMERIS_FIELDS,
+    (0x49, GLONASS): [("System", 'B'), ("n^A", 'B')] + GLONASS_EPHEMERIS_FIELDS,
+    # Ionosphere parameters (4Ah)
+    (0x4A, None): [
+        ("alpha_0", 'f'), # sec
+        ("alpha_1", 'f'), # sec/semicycle
+        ("alpha_2", 'f'), # sec/(semicycle)^2
+        ("alpha_3", 'f'), # sec/(semicycle)^3
+        ("beta_0", 'f'), # sec
+        ("beta_1", 'f'), # sec/semicycle
+        ("beta_2", 'f'), # sec/(semicycle)^2
+        ("beta_3", 'f'), # sec/(semicycle)^3
+        ("Reliability", 'B')], # 255 - data is reliable
+    # GPS, GLONASS and UTC time scale parameters (4Bh)
+    (0x4B, None): [
+        ("A_1", 'd'), # Sec/sec
+        ("A_0", 'd'), # Sec
+        ("t_ot", 'f'), # Sec
+        ("WN_t", 'H'), # Weeks
+        ("dt_LS", 'h'), # Sec
+        ("WN_LSF", 'H'), # Weeks
+        ("DN", 'H'), # Days
+        ("dt_LSF", 'h'), # Sec
+        ("GPS Reliability", 'B'), # 255 - data is reliable
+        ("N^A", 'H'), # Number of the day to which the tau_c time stamp refers
+        ("tau_c", 'd'), # Sec
+        ("GLONASS Reliability", 'B')], # 255 - data is reliable
+    # Geocentric coordinates of antenna (F6h)
+    (0xF6, None): [
+        ("X", 'd'), # [m]
+        ("Y", 'd'), # [m]
+        ("Z", 'd'), # [m]
+        ("X error", 'd'), # [m] rms error
+        ("Y error", 'd'), # [m] rms error
+        ("Z error", 'd'), # [m] rms error
+        ("Flag", 'B')], # Flag of user dynamic 0 - static, 1 - kinematic
+    # Extended ephemeris of satellites (F7h)
+    (0xF7, GPS): GPS_EPHEMERIS_FIELDS + [
+        ("IODC", 'H'),
+        ("CODEL2", 'H'),
+        ("L2 P Data Flag", 'H'),
+        ("WN", 'H')],
+    (0xF7, GLONASS): [("System", 'B'), ("PRN", 'B')] + GLONASS_EPHEMERIS_FIELDS,
+}
+
+
+class MessageLayout:
+    """
+    Fixed length message layout compiled into a single struct.
+    """
+
+    def __init__(self, fields):
+        """
+        arguments:
+            fields - list of (field name, struct format) in message order
+        """
+        self.names = tuple([name for name, fmt in fields])
+        self.struct = struct.Struct('<'+''.join([fmt for name, fmt in fields]))
+        self.size = self.struct.size
+        # Same layout as a NumPy record for decoding many messages at once
+        self.dtype = np.dtype([(name, '<'+fmt) for name, fmt in fields])
 
-    data = msg[2:-2]
+    def decode(self, data, offset=0):
+        """
+        Decode the message with a single unpack, without copying data.
 
-    # Return the message and rest of the buffer
-    return {"ID":message_id,"data":data}, buffer[stop_id+2:]
+        arguments:
+            data - bytes, bytearray, memoryview or mmap with the message
+            offset - index of the first byte of the message
+        returns:
+            dictionary of field name to value
+        """
+        return dict(zip(self.names, self.struct.unpack_from(data, offset)))
+
+
+LAYOUTS = dict([(key, MessageLayout(fields)) 
+                for key, fields in MESSAGE_SCHEMAS.items()])
+
+
+def decode_message(message_id, data):
+    """
+    Decode a fixed length message using the layout registry.
+
+    arguments:
+        message_id - BINR message ID
+        data - unstuffed data portion of the message
+    returns:
+        dictionary of field name to value
+    raises:
+        ValueError - If no layout is registered for the message
+    """
+    if isinstance(data, list):
+        data = bytes(data)
+    layout = LAYOUTS.get((message_id, None))
+    if layout is None:
+        layout = LAYOUTS.get((message_id, data[0]))
+        if layout is None:
+            raise ValueError("No layout for message "+hex(message_id)+
+                             " system "+str(data[0]))
+    return layout.decode(data)
 
 def reboot(erase=False):
     """
@@ -362,64 +663,7 @@ def process_sv_ephemeris(data):
         A dictionary is returned with the format shown in the BINR 
         Protocol specification ver 1.3 page 46.
     """
-
-    # Grab and unpack data
-    sat_system = data[0]
-    if sat_system == GPS:
-        prn = data[1] # On-booard number
-        c_rs = struct.unpack('<f',bytearray(data[2:2+4]))[0] # Orbit Radius Sine Correction [m]
-        dn = struct.unpack('<f',bytearray(data[6:6+4]))[0] # Difference between principle motion and defined motion [rad/ms]
-        m_0 = struct.unpack('<d',bytearray(data[10:10+8]))[0] # Mean Anomaly[rad]
-        c_uc = struct.unpack('<f',bytearray(data[18:18+4]))[0] # Longitude Argument Cosine Correction [rad]
-        e = struct.unpack('<d',bytearray(data[22:22+8]))[0] # Eccentricity
-        c_us = struct.unpack('<f',bytearray(data[30:30+4]))[0] # Latitude Argument Sine Correction [rad]
-        sqrtA = struct.unpack('<d',bytearray(data[34:34+8]))[0] # Square root of the major semi-axis [sqrt_m]
-        t_0e = struct.unpack('<d',bytearray(data[42:42+8]))[0] # Ephemerides reference time [ms]
-        c_ic = struct.unpack('<f',bytearray(data[50:50+4]))[0] # Cosine correction to the inclination angle [rad]
-        omega_0 = struct.unpack('<d',bytearray(data[54:54+8]))[0] # Orbital Plane Ascending Node Longitude [rad]
-        c_is = struct.unpack('<f',bytearray(data[62:62+4]))[0] # Sine correction to the inclination angle [rad]
-        i_0 = struct.unpack('<d',bytearray(data[66:66+8]))[0] # Inclination angle [rad]
-        c_rc = struct.unpack('<f',bytearray(data[74:74+4]))[0] # Orbit Radius Cosine Correction [m]
-        w = struct.unpack('<d',bytearray(data[78:78+8]))[0] # Ascending node-perigee angle [rad]
-        omega_dot = struct.unpack('<d',bytearray(data[86:86+8]))[0] # Direct Descending Change Speed [rad/ms]
-        idot = struct.unpack('<d',bytearray(data[94:94+8]))[0] # Inclination angle change speed [rad/ms]
-        t_gd = struct.unpack('<f',bytearray(data[102:102+4]))[0] # Group Differential Delay Estimation [ms]
-        t_0c = struct.unpack('<d',bytearray(data[106:106+8]))[0] # Time correction [ms]
-        a_f2 = struct.unpack('<f',bytearray(data[114:114+4]))[0] # Time correction [ms/ms^2]
-        a_f1 = struct.unpack('<f',bytearray(data[118:118+4]))[0] # Time correction [ms/ms^2]
-        a_f0 = struct.unpack('<f',bytearray(data[122:122+4]))[0] # Time correction [ms]
-        ura = struct.unpack('<H',bytearray(data[126:126+2]))[0] # User measurement accuracy
-        iode = struct.unpack('<H',bytearray(data[128:128+2]))[0] # An identifier of a setofephemerides
-
-        return {"System":sat_system, "PRN":prn, "C_rs":c_rs, "dn":dn, "M_0":m_0,
-                "C_uc":c_uc, "e":e,"C_us":c_us,"sqrtA":sqrtA, "t_0e":t_0e,
-                "C_ic":c_ic, "Omega_0":omega_0, "C_is":c_is, "I_0":i_0, 
-                "C_rc":c_rc, "w":w, "Omega_dot":omega_dot, "IDOT":idot,
-                "T_GD":t_gd, "t_0c":t_0c, "a_f2":a_f2, "a_f1":a_f1, 
-                "a_f0":a_f0, "URA":ura, "IODE":iode}
-    elif sat_system == GLONASS:
-        nA = struct.unpack('<B',bytearray(data[1:1+1]))[0] # On-board Number
-        HnA = struct.unpack('<b',bytearray(data[2:2+1]))[0] # Carrier frequency number
-        xn = struct.unpack('<d',bytearray(data[3:3+8]))[0] # Coordinates [m]
-        yn = struct.unpack('<d',bytearray(data[11:11+8]))[0] # Coordinates [m]
-        zn = struct.unpack('<d',bytearray(data[19:19+8]))[0] # Coordinates [m]
-        xnv = struct.unpack('<d',bytearray(data[27:27+8]))[0] # Speed [m/ms]
-        ynv = struct.unpack('<d',bytearray(data[35:35+8]))[0] # Speed [m/ms]
-        znv = struct.unpack('<d',bytearray(data[43:43+8]))[0] # Speed [m/ms]
-        xna = struct.unpack('<d',bytearray(data[51:51+8]))[0] # acceleration [m/ms^2]
-        yna = struct.unpack('<d',bytearray(data[59:59+8]))[0] # acceleration [m/ms^2]
-        zna = struct.unpack('<d',bytearray(data[67:67+8]))[0] # acceleration [m/ms^2]
-        tb = struct.unpack('<d',bytearray(data[75:75+8]))[0] # Time interval inside the current day [msec]
-        gamma_n = struct.unpack('<f',bytearray(data[83:83+4]))[0] # Signal-carrier frequency value relative deviation
-        tau_n = struct.unpack('<f',bytearray(data[87:87+4]))[0] # Satellite time scale offset value in relation to the GLONASS scale [ms]
-        e_n = struct.unpack('<H',bytearray(data[91:91+2]))[0] # Satellite time scale offset value in relation to the GLONASS scale [ms]
-  
-        return {"System":sat_system, "n^A":nA, "H_n^A":HnA,
-                "x_n":xn, "y_n":yn, "z_n":zn, 
-                "x_nv":xnv, "y_nv":ynv, "z_nv":znv,
-                "x_na":xna, "y_na":yna, "z_na":zna,
-                "t_b":tb, "gamma_n":gamma_n, "tau_n":tau_n,
-                "E_n":e_n}
+    return decode_message(0x49, data)
                 
 def request_raw_data(measurement_interval=10):
     """
@@ -441,40 +685,31 @@ def request_raw_data(measurement_interval=10):
 
     return packet
 
+# Raw data (F5h) layouts, offsets are for unstuffed data
+RAW_HEADER = struct.Struct('<dHddb') # 27 bytes
+RAW_CHANNEL = struct.Struct('<BBbBdddBx') # 30 bytes per channel
+
 def process_raw_data(data):
     """
-    Process the Raw data package F4h and return a dictionary 
+    Process the Raw data package F5h and return a dictionary 
     object with the data.
 
     arguments:
-        data - packet data
+        data - unstuffed packet data
 
     return:
         dictionary with data fields described in BINR Protocol v1.3 
         page 69.
     """
-    # Main 28 bytes
-    offset = 0
-    value, slip = read_double(data,offset, min=0, max=1E10, allow_negative=False, tries=5)
-    offset = offset + 8 + slip
-    tm = value # Time of measurements, UTC [ms] 
-
-    week_num = struct.unpack('<H',bytearray(data[8:8+2]))[0] # Week number
-    offset = offset + 2
-    
-    value, slip = read_double(data,offset, min=None, max=1E10, tries=5)
-    offset = offset + 8 + slip
-    gps_time_shift = value # GPS-UTC time shift [ms]
-
-    value, slip = read_double(data,offset, min=None, max=1E10, tries=5)
-    offset = offset + 8 + slip
-    glo_time_shift = value # GLONASS-UTC time shift [ms]
-
-    rec_t_corr = struct.unpack('<b',bytearray(data[offset:offset+1]))[0] # Receiver Time Scale Correction [ms]
-    offset = offset +1
+    # Main 27 bytes
+    # Time of measurements, UTC [ms], Week number, GPS-UTC time shift [ms],
+    # GLONASS-UTC time shift [ms], Receiver Time Scale Correction [ms]
+    tm, week_num, gps_time_shift, glo_time_shift, rec_t_corr = \
+        RAW_HEADER.unpack_from(data, 0)
+    offset = RAW_HEADER.size
 
     # 30*number of channels used
-    num_channels = int((len(data) - offset)/30)
+    num_channels = int((len(data) - offset)/RAW_CHANNEL.size)
     # Create storage structures
     signal_type = [] # 1-GLONASS, 2-GPS, 4-SBAS
     sat_number = []
@@ -485,33 +720,18 @@ def process_raw_data(data):
     doppler_freq = [] # Hz
     flags = []
 
-
     # Process data
     for i in range(0,num_channels):  
-        signal_type.append(struct.unpack('<B',bytearray(data[offset:offset+1]))[0])
-        offset = offset + 1
-        sat_number.append(struct.unpack('<B',bytearray(data[offset:offset+1]))[0])
-        offset = offset + 1
-        carrier_num.append(struct.unpack('<b',bytearray(data[offset:offset+1]))[0])
-        offset = offset + 1
-        snr.append(struct.unpack('<B',bytearray(data[offset:offset+1]))[0])
-        offset = offset + 1
-
-        value, slip = read_double(data,offset, min=1e-50, max=1E10, tries=5)
-        offset = offset + 8 + slip
-        carrier_phase.append(value)
-
-        value, slip = read_double(data,offset, min=1e-50, max=1E10, tries=5)
-        offset = offset + 8 + slip
-        pseudo_range.append(value)
-
-        value, slip = read_double(data,offset, min=1e-50, max=1E5, tries=5)
-        offset = offset + 8 + slip
-        doppler_freq.append(value) 
-
-        flags.append(struct.unpack('<B',bytearray(data[offset:offset+1]))[0])
-        offset = offset + 1
-        offset = offset + 1
+        channel = RAW_CHANNEL.unpack_from(data, offset)
+        offset = offset + RAW_CHANNEL.size
+        signal_type.append(channel[0])
+        sat_number.append(channel[1])
+        carrier_num.append(channel[2])
+        snr.append(channel[3])
+        carrier_phase.append(channel[4])
+        pseudo_range.append(channel[5])
+        doppler_freq.append(channel[6])
+        flags.append(channel[7])
          
     return {"Time":tm, "Week Number": week_num, "GPS time shift": gps_time_shift, 
             "GLO time shift": glo_time_shift, "Rec Time Scale Correction": rec_t_corr,
@@ -520,47 +740,65 @@ def process_raw_data(data):
             "Carrier Phase":carrier_phase, "Pseudo Range": pseudo_range,
             "Doppler Freq":doppler_freq, "Flags":flags}
 
-def read_double(data, offset, min=None, max=1E10, allow_negative=True, tries=1):
+# Raw data (F5h) header as a NumPy record, 27 bytes
+RAW_HEADER_DTYPE = np.dtype([("Time", '<f8'), # UTC [ms]
+                             ("Week Number", '<u2'),
+                             ("GPS time shift", '<f8'), # [ms]
+                             ("GLO time shift", '<f8'), # [ms]
+                             ("Rec Time Scale Correction", 'i1')]) # [ms]
+
+# Raw data (F5h) channel block as a NumPy record, 30 bytes per channel
+RAW_CHANNEL_DTYPE = np.dtype([("Signal Type", 'u1'), # 1-GLONASS, 2-GPS, 4-SBAS
+                              ("Sat Number", 'u1'),
+                              ("Carrier Number", 'i1'), # for glonass
+                              ("SNR", 'u1'), # dB-Hz
+                              ("Carrier Phase", '<f8'), # cycles
+                              ("Pseudo Range", '<f8'), # ms
+                              ("Doppler Freq", '<f8'), # Hz
+                              ("Flags", 'u1'),
+                              ("Reserved", 'u1')])
+
+# Raw data channel signal types
+SIGNAL_GLONASS = 1
+SIGNAL_GPS = 2
+SIGNAL_SBAS = 4
+
+# Raw data channel flag bits
+RAW_FLAGS = [("Signal Present", 0x01),
+             ("Pseudorange and Doppler Present", 0x02),
+             ("Pseudorange Smoothed", 0x04),
+             ("Phase Present", 0x08),
+             ("Signal Time Available", 0x10),
+             ("Preamble Not Detected", 0x20)]
+
+def process_raw_data_arrays(data):
     """
-    Reads a double from the given byte stream at a specified offset position.
-    The binr raw_data sometimes has a 0 in front of float values. Not sure where 
-    they come from. At the moment this is easily handled by detecting an out of
-    range value and start reading the double 1 byte later.
+    Process the Raw data package F5h into NumPy arrays. The channel 
+    block is viewed in place, so the channel arrays share memory with
+    data and are read only when data is bytes.
 
-    arguments: 
-        data - list of bytes to read double from
-        offset - index to start reading double
-        min - minimum valid value
-        max - maximum valid value
-        tries - number of tries allowed (to avoid infinite loops)
-        allow_negative - if False, range error will be triggered on negative values
+    arguments:
+        data - unstuffed packet data
 
-    returns:
-        value - double value that has been read
-        slip - number of spurious zeros we skipped
+    return:
+        dictionary with the same fields as process_raw_data, where the
+        channel fields are arrays, plus a boolean array for every flag 
+        in RAW_FLAGS.
     """
-    slip = 0 # keeps track of the number of zero jumps
-    tried = 0 # keeps track of the number of times we tried
-    
-    range_error = True # Error cleared when a valid value is read.
-    while tried < tries and range_error:
-        # Try and read the value
-        value = struct.unpack('<d',bytearray(data[offset+slip:offset+slip+8]))[0]
-
-        # Check if the value is stupid
-        if (np.abs(value) > max or 
-           (not (min == None) and np.abs(value) < min) and (not value == 0) or 
-           (not allow_negative and value < 0)):
-            slip = slip + 1
-        else:
-            range_error = False # It was valid
-        
-        tried = tried + 1
-    
-    return value, slip
-        
-            
-        
+    tm, week_num, gps_time_shift, glo_time_shift, rec_t_corr = \
+        RAW_HEADER.unpack_from(data, 0)
+    num_channels = (len(data) - RAW_HEADER.size)//RAW_CHANNEL_DTYPE.itemsize
+    channels = np.frombuffer(data, dtype=RAW_CHANNEL_DTYPE, 
+                             count=num_channels, offset=RAW_HEADER.size)
+
+    raw = {"Time":tm, "Week Number": week_num, "GPS time shift": gps_time_shift, 
+           "GLO time shift": glo_time_shift, "Rec Time Scale Correction": rec_t_corr}
+    for name in RAW_CHANNEL_DTYPE.names[:-1]:
+        raw[name] = channels[name]
+    flags = channels["Flags"]
+    for name, mask in RAW_FLAGS:
+        raw[name] = (flags & mask) > 0
+    return raw
 
 def print_raw_data(raw_data):
     """
@@ -609,19 +847,7 @@ def process_geocentric_coordinates_of_antenna(data):
     return:
         {X, Y, Z, X error, Y error, Z error, Flag}
     """
-
-    # Extract data from packet
-    X = struct.unpack('<d',bytearray(data[0:0+8]))[0] # [m]
-    Y = struct.unpack('<d',bytearray(data[8:8+8]))[0] # [m]
-    Z = struct.unpack('<d',bytearray(data[16:16+8]))[0] # [m]
-    Xerror = struct.unpack('<d',bytearray(data[24:24+8]))[0] # [m] rms error
-    Yerror = struct.unpack('<d',bytearray(data[32:32+8]))[0] # [m] rms error
-    Zerror = struct.unpack('<d',bytearray(data[40:40+8]))[0] # [m] rms error
-    flag = struct.unpack('<B',bytearray(data[48:48+1]))[0] # Flag of user dynamic 0 - static, 1 - kinematic
-
-    return {"X":X, "Y":Y, "Z":Z, 
-            "X error":Xerror, "Y error":Yerror, "Z error":Zerror, 
-            "Flag": flag}
+    return decode_message(0xF6, data)
 
 
 def process_software_version(data):
@@ -656,22 +882,7 @@ def process_ionosphere_parameters(data):
         {"alpha_0", "alpha_1", "alpha_2", "alpha_3",
          "beta_0", "beta_1", "beta_2", "beta_3", "Reliability"}
     """
-
-    a0 = struct.unpack('<f',bytearray(data[0:0+4]))[0] # sec
-    a1 = struct.unpack('<f',bytearray(data[4:4+4]))[0] # sec/semicycle
-    a2 = struct.unpack('<f',bytearray(data[8:8+4]))[0] # sec/(semicycle)^2
-    a3 = struct.unpack('<f',bytearray(data[12:12+4]))[0] # sec/(semicycle)^3
-
-    b0 = struct.unpack('<f',bytearray(data[16:16+4]))[0] # sec
-    b1 = struct.unpack('<f',bytearray(data[20:20+4]))[0] # sec/semicycle
-    b2 = struct.unpack('<f',bytearray(data[24:24+4]))[0] # sec/(semicycle)^2
-    b3 = struct.unpack('<f',bytearray(data[28:28+4]))[0]  # sec/(semicycle)^3
-
-    reliability = struct.unpack('<B',bytearray(data[32:32+1]))[0] # 255 - data is reliable
-
-    return {"alpha_0":a0, "alpha_1":a1, "alpha_2":a2, "alpha_3":a3,
-            "beta_0":b0, "beta_1":b1, "beta_2":b2, "beta_3":b3, 
-            "Reliability":reliability}
+    return decode_message(0x4A, data)
 
 def process_time_scales_parameters(data):
     
@@ -687,25 +898,7 @@ def process_time_scales_parameters(data):
         {"A_1", "A_0", "t_ot","WN_t", "dt_LS", "WN_LSF", "DN", "dt_LSF",
          "GPS Reliability", "N^A", "tau_c", "GLONASS Reliability"}
     """
-
-    A1 = struct.unpack('<d',bytearray(data[0:0+8]))[0]  # Sec/sec
-    A0 = struct.unpack('<d',bytearray(data[8:8+8]))[0]  # Sec
-    t_ot = struct.unpack('<f',bytearray(data[16:16+4]))[0]  # Sec
-    WN_t = struct.unpack('<H',bytearray(data[20:20+2]))[0]  # Weeks
-    dt_LS = struct.unpack('<h',bytearray(data[22:22+2]))[0]  # Sec
-    WN_LSF = struct.unpack('<H',bytearray(data[24:24+2]))[0]  # Weeks
-    DN = struct.unpack('<H',bytearray(data[26:26+2]))[0]  # Days
-    dt_LSF = struct.unpack('<h',bytearray(data[28:28+2]))[0]  # Sec
-    gps_rel = struct.unpack('<B',bytearray(data[30:30+1]))[0] # 255 - data is reliable
-    # Number of the day to which the tau_c time stamp refers
-    NA = struct.unpack('<H',bytearray(data[31:31+2]))[0]  
-    tau_c = struct.unpack('<d',bytearray(data[33:33+8]))[0]  # Sec
-    glo_rel = struct.unpack('<B',bytearray(data[41:41+1]))[0] # 255 - data is reliable
-    
-    return  {"A_1":A1, "A_0":A0, "t_ot":t_ot,"WN_t":WN_t, "dt_LS":dt_LS, 
-             "WN_LSF":WN_LSF, "DN":DN, "dt_LSF":dt_LSF,
-             "GPS Reliability":gps_rel, "N^A":NA, "tau_c":tau_c, 
-             "GLONASS Reliability":glo_rel}
+    return decode_message(0x4B, data)
 
 def process_extended_ephemeris_of_satellites(data):
     """
@@ -719,79 +912,126 @@ def process_extended_ephemeris_of_satellites(data):
         dictionary containing data listed on page 71 of the V1.3 BINR 
         protocol specification.
     """
+    return decode_message(0xF7, data)
 
-    # Get the system
-    sat_system = struct.unpack('<B',bytearray(data[0:0+1]))[0] # 1 - GPS, 2 - GLONASS
-    sat_no = struct.unpack('<B',bytearray(data[1:1+1]))[0] 
-
-    if sat_system == GPS: # Process the next 136 bytes
-        c_rs = struct.unpack('<f',bytearray(data[2:2+4]))[0]  # m
-        dn = struct.unpack('<f',bytearray(data[6:6+4]))[0]  # rad/ms
-        m_0 = struct.unpack('<d',bytearray(data[10:10+8]))[0]  # rad
-        c_uc = struct.unpack('<f',bytearray(data[18:18+4]))[0]  # rad
-        e = struct.unpack('<d',bytearray(data[22:22+8]))[0]  # E
-        c_us = struct.unpack('<f',bytearray(data[30:30+4]))[0]  # rad
-        sqrtA = struct.unpack('<d',bytearray(data[34:34+8]))[0]  # m^1/2
-        t_0e = struct.unpack('<d',bytearray(data[42:42+8]))[0]  # ms
-        c_ic = struct.unpack('<f',bytearray(data[50:50+4]))[0]  # rad
-        omega_0 = struct.unpack('<d',bytearray(data[54:54+8]))[0]  # rad
-        c_is = struct.unpack('<f',bytearray(data[62:62+4]))[0]  # rad
-        i_0 = struct.unpack('<d',bytearray(data[66:66+8]))[0]  # rad
-        c_rc = struct.unpack('<f',bytearray(data[74:74+4]))[0]  # rad
-        w = struct.unpack('<d',bytearray(data[78:78+8]))[0]  # rad
-        omega_dot = struct.unpack('<d',bytearray(data[86:86+8]))[0]  # ms
-        idot = struct.unpack('<d',bytearray(data[94:94+8]))[0]  # rad/ms
-        t_gd = struct.unpack('<f',bytearray(data[102:102+4]))[0]  # ms
-        t_0c = struct.unpack('<d',bytearray(data[106:106+8]))[0]  # ms
-        a_f2 = struct.unpack('<f',bytearray(data[114:114+4]))[0]  # ms/ms^2
-        a_f1 = struct.unpack('<f',bytearray(data[118:118+4]))[0]  # ms/ms
-        a_f0 = struct.unpack('<f',bytearray(data[122:122+4]))[0]  # ms
-        ura = struct.unpack('<H',bytearray(data[126:126+2]))[0]  
-        iode = struct.unpack('<H',bytearray(data[128:128+2]))[0]  
-        iodc = struct.unpack('<H',bytearray(data[130:130+2]))[0]
-        codel2 = struct.unpack('<H',bytearray(data[132:132+2]))[0]  
-        l2_pdata_flag = struct.unpack('<H',bytearray(data[134:134+2]))[0]  
-        weekN = struct.unpack('<H',bytearray(data[136:136+2]))[0]
-
-        return {"System":sat_system, "PRN":sat_no, "C_rs":c_rs, "dn":dn, "M_0":m_0,
-                "C_uc":c_uc, "e":e,"C_us":c_us,"sqrtA":sqrtA, "t_0e":t_0e,
-                "C_ic":c_ic, "Omega_0":omega_0, "C_is":c_is, "I_0":i_0, 
-                "C_rc":c_rc, "w":w, "Omega_dot":omega_dot, "IDOT":idot,
-                "T_GD":t_gd, "t_0c":t_0c, "a_f2":a_f2, "a_f1":a_f1, 
-                "a_f0":a_f0, "URA":ura, "IODE":iode, "IODC":iodc, 
-                "CODEL2":codel2, "L2 P Data Flag":l2_pdata_flag, "WN":weekN}
-
-    elif sat_system == GLONASS: # 92 bytes
-        HnA = struct.unpack('<b',bytearray(data[2:2+1]))[0] # Carrier frequency number
-        xn = struct.unpack('<d',bytearray(data[3:3+8]))[0] # Coordinates [m]
-        yn = struct.unpack('<d',bytearray(data[11:11+8]))[0] # Coordinates [m]
-        zn = struct.unpack('<d',bytearray(data[19:19+8]))[0] # Coordinates [m]
-        xnv = struct.unpack('<d',bytearray(data[27:27+8]))[0] # Speed [m/ms]
-        ynv = struct.unpack('<d',bytearray(data[35:35+8]))[0] # Speed [m/ms]
-        znv = struct.unpack('<d',bytearray(data[43:43+8]))[0] # Speed [m/ms]
-        xna = struct.unpack('<d',bytearray(data[51:51+8]))[0] # acceleration [m/ms^2]
-        yna = struct.unpack('<d',bytearray(data[59:59+8]))[0] # acceleration [m/ms^2]
-        zna = struct.unpack('<d',bytearray(data[67:67+8]))[0] # acceleration [m/ms^2]
-        tb = struct.unpack('<d',bytearray(data[75:75+8]))[0] # Time interval inside the current day [msec]
-        gamma_n = struct.unpack('<f',bytearray(data[83:83+4]))[0] # Signal-carrier frequency value relative deviation
-        tau_n = struct.unpack('<f',bytearray(data[87:87+4]))[0] # Satellite time scale offset value in relation to the GLONASS scale [ms]
-        e_n = struct.unpack('<H',bytearray(data[91:91+2]))[0] # Satellite time scale offset value in relation to the GLONASS scale [ms]
-
-        return {"System":sat_system, "PRN":sat_no, "H_n^A":HnA,
-                "x_n":xn, "y_n":yn, "z_n":zn, 
-                "x_nv":xnv, "y_nv":ynv, "z_nv":znv,
-                "x_na":xna, "y_na":yna, "z_na":zna,
-                "t_b":tb, "gamma_n":gamma_n, "tau_n":tau_n,
-                "E_n":e_n}
 
-    else:
-        raise ValueError("Invalid system byte")    
-        
-        
-        
-        
+def scan_frames(buffer, pos=0):
+    """
+    Find every complete frame in a buffer in a single pass.
+
+    arguments:
+        buffer - bytes, bytearray or mmap containing BINR data
+        pos - index to start scanning from
+    returns:
+        offsets - array with the index of the DLE opening every frame
+        lengths - array with the length of every frame including framing 
+                  bytes [bytes]
+        frames - list[{ID, data}] with unstuffed data
+    """
+    offsets = []
+    lengths = []
+    frames = []
+    start = -1
+    while True:
+        frame, pos, start = _next_frame(buffer, pos, start)
+        if frame is None:
+            break
+        offsets.append(start)
+        lengths.append(pos - start)
+        frames.append(frame)
+        start = -1
+    return (np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int64),
+            frames)
+
+
+def decode_raw_data_batch(payloads):
+    """
+    Decode many raw data (F5h) messages at once.
+
+    arguments:
+        payloads - list of unstuffed F5h data
+    returns:
+        epochs - RAW_HEADER_DTYPE array with one row per message
+        channel_count - number of channels in every message
+        observations - RAW_CHANNEL_DTYPE array of all channels, epoch major
+        epoch_index - index into epochs for every observation
+    """
+    header_size = RAW_HEADER_DTYPE.itemsize
+    channel_size = RAW_CHANNEL_DTYPE.itemsize
+    payloads = [p for p in payloads if len(p) >= header_size]
+    channel_count = np.array([(len(p)-header_size)//channel_size for p in payloads],
+                             dtype=np.int64)
+
+    # Join the blocks once and view them as records
+    epochs = np.frombuffer(b''.join([p[:header_size] for p in payloads]),
+                           dtype=RAW_HEADER_DTYPE)
+    observations = np.frombuffer(b''.join([p[header_size:header_size+n*channel_size] 
+                                           for p, n in zip(payloads, channel_count)]),
+                                 dtype=RAW_CHANNEL_DTYPE)
+    epoch_index = np.repeat(np.arange(len(payloads)), channel_count)
+    return epochs, channel_count, observations, epoch_index
+
+
+def decode_message_batch(message_id, system, payloads):
+    """
+    Decode many fixed length messages of the same layout at once.
+
+    arguments:
+        message_id - BINR message ID
+        system - system byte, None for messages without one
+        payloads - list of unstuffed message data
+    returns:
+        array of the layout dtype with one row per message
+    """
+    layout = LAYOUTS[(message_id, system)]
+    payloads = [p[:layout.size] for p in payloads if len(p) >= layout.size]
+    return np.frombuffer(b''.join(payloads), dtype=layout.dtype)
 
-        
-        
 
- 
+def load_recording(filename):
+    """
+    Decode a whole BINR recording in one pass. The file is memory mapped,
+    every frame is found in a single scan and the raw data and extended 
+    ephemeris messages are decoded in batches.
+
+    arguments:
+        filename - path to the recorded .dat file
+    returns:
+        dictionary with
+            "Epochs" - RAW_HEADER_DTYPE array, one row per F5h message
+            "Channel Count" - number of channels in every epoch
+            "Observations" - RAW_CHANNEL_DTYPE array of all channels
+            "Epoch Index" - index into "Epochs" for every observation
+            "GPS Ephemeris" - F7h GPS layout array
+            "GLONASS Ephemeris" - F7h GLONASS layout array
+            "Frames" - number of frames of every message ID
+    """
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            frames = []
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                offsets, lengths, frames = scan_frames(buffer)
+
+    # Group the payloads by message
+    raw_payloads = []
+    gps_payloads = []
+    glonass_payloads = []
+    frame_counts = {}
+    for frame in frames:
+        frame_counts[frame["ID"]] = frame_counts.get(frame["ID"], 0) + 1
+        if frame["ID"] == 0xF5:
+            raw_payloads.append(frame["data"])
+        elif frame["ID"] == 0xF7 and len(frame["data"]) > 0:
+            if frame["data"][0] == GPS:
+                gps_payloads.append(frame["data"])
+            elif frame["data"][0] == GLONASS:
+                glonass_payloads.append(frame["data"])
+
+    epochs, channel_count, observations, epoch_index = \
+        decode_raw_data_batch(raw_payloads)
+    return {"Epochs":epochs, "Channel Count":channel_count,
+            "Observations":observations, "Epoch Index":epoch_index,
+            "GPS Ephemeris":decode_message_batch(0xF7, GPS, gps_payloads),
+            "GLONASS Ephemeris":decode_message_batch(0xF7, GLONASS, glonass_payloads),
+            "Frames":frame_counts}
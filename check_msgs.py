@@ -7,23 +7,28 @@ June 2018
 """
 
 import binr
+import replay
 import serial
 import os
 import time
 
 # Parameters
 port = "/dev/ttyAMA0"
+replay_file = None # Recording to replay instead of the port
 
-# Switch device to BINR
-print("Switching serial protocol to BINR")
-ser = serial.Serial(port, 115200)
-ser.write("$PORZA,0,115200,3*7E\r\n".encode())
-ser.close()
+if replay_file is not None:
+    print("Replaying "+replay_file)
+    ser = replay.ReplaySerial(replay_file, timeout=0.5)
+else:
+    # Switch device to BINR
+    print("Switching serial protocol to BINR")
+    ser = serial.Serial(port, 115200)
+    ser.write("$PORZA,0,115200,3*7E\r\n".encode())
+    ser.close()
 
-# Connect to device
-print("Connecting to serial port [BINR 115200]")
-ser = serial.Serial(port, 115200, parity=serial.PARITY_ODD, timeout=0.5)
-#ser = open("pelham_shed_1_July_2018.dat",'rb')
+    # Connect to device
+    print("Connecting to serial port [BINR 115200]")
+    ser = serial.Serial(port, 115200, parity=serial.PARITY_ODD, timeout=0.5)
 
 # Request current receiver channels status
 #print("Requesting receiver channels status")
@@ -47,7 +52,7 @@ try:
     while True:
         try:
             
-            buffer = list(ser.read_until(terminator='\x10\x03'))
+            buffer = list(ser.read_until(b'\x10\x03'))
             if len(buffer) > 0:               
                 data, buffer = binr.process_msg(list(buffer))
                 print(len(buffer))
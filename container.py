@@ -0,0 +1,314 @@
+"""
+Block compressed container for BINR recordings.
+
+The recorded bytes are stored in independently compressed blocks that
+end on frame boundaries. Every block starts with a header, so a
+container can be read while it is still being written, and a block
+index with the raw offset and first receiver time of every block is
+appended when it is closed. Readers decompress only the blocks they
+need.
+
+Layout:
+    file header - FILE_MAGIC, codec
+    blocks - BLOCK_HEADER then the compressed bytes, repeated
+    index - BLOCK_DTYPE records, written on close
+    footer - index offset, number of blocks, FOOTER_MAGIC
+"""
+
+import lzma
+import os
+import struct
+import zlib
+import numpy as np
+import binr
+import recording
+
+FILE_MAGIC = b"BINRZ\x01"
+BLOCK_MAGIC = b"BLK"
+FOOTER_MAGIC = b"BINRZIDX"
+CONTAINER_SUFFIX = ".binz"
+
+# Codecs
+ZLIB = 1
+LZMA = 2
+CODECS = {"zlib":ZLIB, "lzma":LZMA}
+
+BLOCK_SIZE = 256*1024 # Raw bytes per block [bytes]
+
+FILE_HEADER = struct.Struct('<6sB') # Magic, codec
+BLOCK_HEADER = struct.Struct('<3sIIqdI') # Magic, compressed and raw length, raw offset, time, CRC32
+FOOTER = struct.Struct('<qI8s') # Index offset, number of blocks, magic
+
+# Block index record
+BLOCK_DTYPE = np.dtype([("Offset", '<i8'), # Offset of the compressed bytes in the container
+                        ("Length", '<u4'), # Compressed length [bytes]
+                        ("Raw Offset", '<i8'), # Offset of the block in the recording [bytes]
+                        ("Raw Length", '<u4'), # [bytes]
+                        ("Time", '<f8'), # First raw data time in the block, UTC [ms]
+                        ("CRC", '<u4')]) # CRC32 of the raw bytes
+
+
+def _compress(codec, data, level):
+    if codec == ZLIB:
+        return zlib.compress(data, level)
+    elif codec == LZMA:
+        return lzma.compress(data, preset=level)
+    raise ValueError("Unknown codec: "+str(codec))
+
+
+def _decompress(codec, data):
+    if codec == ZLIB:
+        return zlib.decompress(data)
+    elif codec == LZMA:
+        return lzma.decompress(data)
+    raise ValueError("Unknown codec: "+str(codec))
+
+
+class ContainerWriter:
+    """
+    Writes BINR bytes into a block compressed container. Complete blocks
+    are flushed to disk as they are written so readers can follow them.
+    """
+
+    def __init__(self, filename, codec="zlib", block_size=BLOCK_SIZE, level=6):
+        """
+        arguments:
+            filename - container to create
+            codec - "zlib" or "lzma"
+            block_size - raw bytes per block [bytes]
+            level - compression level
+        """
+        if codec not in CODECS:
+            raise ValueError("Unknown codec: "+str(codec))
+        self.codec = CODECS[codec]
+        self.block_size = block_size
+        self.level = level
+        self.blocks = []
+        self._buffer = bytearray()
+        self._raw_offset = 0
+        self._time = np.nan # Latest raw data time [ms]
+        self._file = open(filename, 'wb')
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, self.codec))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data):
+        """
+        Add recorded bytes. Blocks are written when enough bytes with
+        complete frames are buffered.
+        """
+        self._buffer += data
+        if len(self._buffer) >= self.block_size:
+            self._write_blocks(final=False)
+
+    def _write_blocks(self, final):
+        """
+        Write the buffered bytes as blocks that end after a complete frame.
+        """
+        frames = recording.build_index(bytes(self._buffer), 0, self._time)
+        ends = frames["Offset"] + frames["Length"]
+        start = 0
+        first = 0
+        while True:
+            remaining = len(self._buffer) - start
+            if remaining == 0 or (remaining < self.block_size and not final):
+                break
+            # Last frame that ends inside the block, or all of it when no frame does
+            last = np.searchsorted(ends, start + self.block_size, side='right') - 1
+            if final and remaining <= self.block_size:
+                stop = len(self._buffer)
+            elif last >= first:
+                stop = int(ends[last])
+            elif remaining >= 4*self.block_size or final:
+                stop = start + self.block_size
+            else:
+                break
+            in_block = np.flatnonzero((frames["Offset"] >= start) & (frames["Offset"] < stop))
+            time = np.nan
+            if len(in_block) > 0:
+                time = frames["Time"][in_block[0]]
+                first = in_block[-1] + 1
+            self._write_block(bytes(self._buffer[start:stop]), time)
+            start = stop
+        # Carry the time of the last frame written, the rest is buffered again
+        written = np.searchsorted(frames["Offset"], start) - 1
+        if written >= 0:
+            self._time = frames["Time"][written]
+        del self._buffer[:start]
+
+    def _write_block(self, data, time):
+        compressed = _compress(self.codec, data, self.level)
+        crc = zlib.crc32(data)
+        self._file.write(BLOCK_HEADER.pack(BLOCK_MAGIC, len(compressed), len(data),
+                                           self._raw_offset, time, crc))
+        offset = self._file.tell()
+        self._file.write(compressed)
+        self._file.flush()
+        self.blocks.append((offset, len(compressed), self._raw_offset, len(data), time, crc))
+        self._raw_offset += len(data)
+
+    def close(self):
+        """
+        Write the remaining bytes, the block index and the footer.
+        """
+        if self._file is None:
+            return
+        self._write_blocks(final=True)
+        index_offset = self._file.tell()
+        self._file.write(np.array(self.blocks, dtype=BLOCK_DTYPE).tobytes())
+        self._file.write(FOOTER.pack(index_offset, len(self.blocks), FOOTER_MAGIC))
+        self._file.close()
+        self._file = None
+
+
+class ContainerReader:
+    """
+    Random access to the blocks of a container, complete or still being
+    written.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        magic, self.codec = FILE_HEADER.unpack(self._file.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC:
+            raise ValueError("Not a BINR container: "+str(filename))
+        self.blocks = np.zeros(0, dtype=BLOCK_DTYPE)
+        self.complete = False
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def close(self):
+        self._file.close()
+
+    def refresh(self):
+        """
+        Load the block index from the footer, or scan the block headers
+        after the known blocks when the container is still being written.
+        """
+        if self.complete:
+            return
+        size = os.fstat(self._file.fileno()).st_size
+        if size >= FILE_HEADER.size + FOOTER.size:
+            self._file.seek(size - FOOTER.size)
+            index_offset, count, magic = FOOTER.unpack(self._file.read(FOOTER.size))
+            if magic == FOOTER_MAGIC:
+                self._file.seek(index_offset)
+                self.blocks = np.frombuffer(self._file.read(count*BLOCK_DTYPE.itemsize),
+                                            dtype=BLOCK_DTYPE)
+                self.complete = True
+                return
+
+        # Scan the headers of the complete blocks written so far
+        pos = FILE_HEADER.size
+        if len(self.blocks) > 0:
+            pos = int(self.blocks["Offset"][-1] + self.blocks["Length"][-1])
+        blocks = []
+        while pos + BLOCK_HEADER.size <= size:
+            self._file.seek(pos)
+            magic, length, raw_length, raw_offset, time, crc = \
+                BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+            if magic != BLOCK_MAGIC or pos + BLOCK_HEADER.size + length > size:
+                break
+            blocks.append((pos + BLOCK_HEADER.size, length, raw_offset, raw_length, time, crc))
+            pos += BLOCK_HEADER.size + length
+        if len(blocks) > 0:
+            self.blocks = np.concatenate([self.blocks, np.array(blocks, dtype=BLOCK_DTYPE)])
+
+    def read_block(self, i):
+        """
+        Decompressed bytes of a block.
+
+        raises:
+            ValueError - if the block is corrupt
+        """
+        block = self.blocks[i]
+        self._file.seek(int(block["Offset"]))
+        data = _decompress(self.codec, self._file.read(int(block["Length"])))
+        if zlib.crc32(data) != block["CRC"]:
+            raise ValueError("Block "+str(i)+" is corrupt")
+        return data
+
+    def find(self, time):
+        """
+        Block that holds the raw data of a receiver time [ms], the last
+        block that starts before it. A block that starts after the raw data
+        message of its time carries that time, so the message may be in the
+        block before one that starts at the same time.
+        """
+        times = self.blocks["Time"]
+        started = np.flatnonzero(~(times >= time)) # NaN blocks continue the previous one
+        return int(started[-1]) if len(started) > 0 else 0
+
+    def read(self, start=None, stop=None):
+        """
+        Recorded bytes of a receiver time window, in whole blocks.
+
+        arguments:
+            start - first receiver time [ms], None from the start
+            stop - receiver time to stop before [ms], None to the end
+        returns:
+            bytes starting on a frame boundary
+        """
+        first = 0 if start is None else self.find(start)
+        last = len(self.blocks) - 1
+        if stop is not None:
+            later = np.flatnonzero(self.blocks["Time"] >= stop)
+            if len(later) > 0:
+                last = later[0] - 1
+        return b''.join([self.read_block(i) for i in range(first, last+1)])
+
+    def frames(self, start=None, stop=None):
+        """
+        Frames of a receiver time window.
+
+        returns:
+            list[{ID, data}] with unstuffed data
+        """
+        frames = binr.BinrFramer().feed(self.read(start, stop))
+        if start is None and stop is None:
+            return frames
+        selected = []
+        time = np.nan
+        for frame in frames:
+            if frame["ID"] == 0xF5 and len(frame["data"]) >= 8:
+                time = struct.unpack_from('<d', frame["data"])[0]
+            if (start is None or time >= start) and (stop is None or time < stop):
+                selected.append(frame)
+        return selected
+
+
+def compress_recording(filename, container=None, codec="zlib", block_size=BLOCK_SIZE):
+    """
+    Store a recording in a container.
+
+    arguments:
+        filename - recorded .dat file
+        container - container to create, None for the recording name
+                    with CONTAINER_SUFFIX
+        codec - "zlib" or "lzma"
+        block_size - raw bytes per block [bytes]
+    returns:
+        container filename
+    """
+    if container is None:
+        container = os.path.splitext(filename)[0] + CONTAINER_SUFFIX
+    with open(filename, 'rb') as f, ContainerWriter(container, codec, block_size) as writer:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            writer.write(data)
+    return container
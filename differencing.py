@@ -0,0 +1,178 @@
+"""
+Single and double differences of aligned base and rover observations.
+
+Observations are scattered into arrays indexed by a global satellite
+index so that common satellites, differences and reference satellites
+are found with array operations instead of loops over channels.
+"""
+
+import numpy as np
+import binr
+import ephemeris
+
+F_GPS_L1 = 1575.42E6 # GPS L1 frequency [Hz]
+F_GLONASS_L1 = 1602.0E6 # GLONASS L1 frequency of carrier number 0 [Hz]
+DF_GLONASS_L1 = 0.5625E6 # GLONASS L1 carrier spacing [Hz]
+
+# Global satellite index: GPS PRN 1-32, GLONASS slots 1-32, SBAS PRN 120-158
+GPS_BASE, NUM_GPS = 0, 32
+GLONASS_BASE, NUM_GLONASS = 32, 32
+SBAS_BASE, NUM_SBAS, SBAS_FIRST_PRN = 64, 39, 120
+NUM_SATS = SBAS_BASE + NUM_SBAS
+
+# Flags required of an observation used in differencing
+DIFF_FLAGS = 0x0B # Signal present, pseudorange and Doppler present, phase present
+
+# System of every satellite index, with the raw data signal types
+SAT_SIGNAL = np.zeros(NUM_SATS, dtype=np.uint8)
+SAT_SIGNAL[GPS_BASE:GPS_BASE+NUM_GPS] = binr.SIGNAL_GPS
+SAT_SIGNAL[GLONASS_BASE:GLONASS_BASE+NUM_GLONASS] = binr.SIGNAL_GLONASS
+SAT_SIGNAL[SBAS_BASE:SBAS_BASE+NUM_SBAS] = binr.SIGNAL_SBAS
+
+
+def sat_index(signal_type, sat_number):
+    """
+    Global satellite index of raw data channels.
+
+    arguments:
+        signal_type - raw data signal types
+        sat_number - raw data satellite numbers
+    returns:
+        array of satellite indices, -1 where the satellite is unknown
+    """
+    signal_type = np.asarray(signal_type)
+    sat_number = np.asarray(sat_number).astype(np.int64)
+    index = np.full(sat_number.shape, -1, dtype=np.int64)
+
+    gps = (signal_type == binr.SIGNAL_GPS) & (sat_number >= 1) & (sat_number <= NUM_GPS)
+    index[gps] = GPS_BASE + sat_number[gps] - 1
+    glonass = ((signal_type == binr.SIGNAL_GLONASS) & (sat_number >= 1) &
+               (sat_number <= NUM_GLONASS))
+    index[glonass] = GLONASS_BASE + sat_number[glonass] - 1
+    sbas = ((signal_type == binr.SIGNAL_SBAS) & (sat_number >= SBAS_FIRST_PRN) &
+            (sat_number < SBAS_FIRST_PRN + NUM_SBAS))
+    index[sbas] = SBAS_BASE + sat_number[sbas] - SBAS_FIRST_PRN
+    return index
+
+
+def wavelength(signal_type, carrier_number):
+    """
+    L1 carrier wavelength of raw data channels [m].
+    """
+    signal_type = np.asarray(signal_type)
+    freq = np.where(signal_type == binr.SIGNAL_GLONASS,
+                    F_GLONASS_L1 + DF_GLONASS_L1*np.asarray(carrier_number),
+                    F_GPS_L1)
+    return ephemeris.C/freq
+
+
+class SatelliteObservations:
+    """
+    Observations of one receiver epoch in arrays indexed by satellite.
+    The arrays are allocated once and refilled every epoch, with NaN for
+    the satellites that are not valid.
+    """
+
+    def __init__(self):
+        self.valid = np.zeros(NUM_SATS, dtype=bool)
+        self.phase = np.full(NUM_SATS, np.nan) # Carrier phase [m]
+        self.code = np.full(NUM_SATS, np.nan) # Pseudorange [m]
+        self.snr = np.full(NUM_SATS, np.nan) # [dB-Hz]
+        self.wavelength = np.full(NUM_SATS, np.nan) # [m]
+
+    def fill(self, raw):
+        """
+        Scatter a raw data epoch into the satellite arrays.
+
+        arguments:
+            raw - raw data dictionary from binr.process_raw_data_arrays
+        returns:
+            self
+        """
+        signal = np.asarray(raw["Signal Type"])
+        index = sat_index(signal, raw["Sat Number"])
+        usable = (index >= 0) & ((np.asarray(raw["Flags"]) & DIFF_FLAGS) == DIFF_FLAGS)
+        index = index[usable]
+        lam = wavelength(signal[usable], np.asarray(raw["Carrier Number"])[usable])
+
+        self.valid[:] = False
+        self.phase[:] = np.nan
+        self.code[:] = np.nan
+        self.snr[:] = np.nan
+        self.wavelength[:] = np.nan
+        self.valid[index] = True
+        self.wavelength[index] = lam
+        self.phase[index] = np.asarray(raw["Carrier Phase"])[usable]*lam
+        self.code[index] = np.asarray(raw["Pseudo Range"])[usable]/1000*ephemeris.C
+        self.snr[index] = np.asarray(raw["SNR"])[usable]
+        return self
+
+
+def reference_satellites(common, priority):
+    """
+    Reference satellite of every system, the common satellite with the
+    highest priority.
+
+    arguments:
+        common - (NUM_SATS,) mask of the common satellites
+        priority - (NUM_SATS,) elevation or SNR of the satellites
+    returns:
+        {signal type: satellite index} of the systems with at least two
+        common satellites
+    """
+    refs = {}
+    masked = np.where(common, priority, -np.inf)
+    for signal in (binr.SIGNAL_GPS, binr.SIGNAL_GLONASS):
+        in_system = common & (SAT_SIGNAL == signal)
+        if np.count_nonzero(in_system) >= 2:
+            refs[signal] = int(np.argmax(np.where(in_system, masked, -np.inf)))
+    return refs
+
+
+def double_differences(rover, base, elevation=None):
+    """
+    Single and double differences of a rover and base epoch. Every system
+    is differenced against its own reference satellite, picked by
+    elevation when it is given and otherwise by SNR, the lower of the
+    rover and base values. SBAS satellites are not differenced.
+
+    arguments:
+        rover - SatelliteObservations of the rover
+        base - SatelliteObservations of the base at the same time
+        elevation - (NUM_SATS,) satellite elevations [rad], or None
+    returns:
+        dictionary with
+            "Common" - (NUM_SATS,) mask of satellites seen by both
+            "Single Phase", "Single Code" - (NUM_SATS,) rover minus base [m]
+            "Reference" - (N,) reference satellite index of every difference
+            "Satellites" - (N,) satellite index of every difference
+            "Phase", "Code" - (N,) double differences [m]
+            "Wavelength" - (N,) wavelength of the differenced satellites [m]
+            "Reference Wavelength" - (N,) wavelength of their references [m]
+    """
+    common = rover.valid & base.valid
+    single_phase = rover.phase - base.phase
+    single_code = rover.code - base.code
+    if elevation is None:
+        priority = np.minimum(rover.snr, base.snr)
+    else:
+        priority = np.asarray(elevation)
+    refs = reference_satellites(common, priority)
+
+    # Reference of every satellite, then all differences in one step
+    reference = np.full(NUM_SATS, -1, dtype=np.int64)
+    for signal, ref in refs.items():
+        reference[SAT_SIGNAL == signal] = ref
+    use = common & (reference >= 0)
+    use[list(refs.values())] = False
+    sats = np.flatnonzero(use)
+    ref = reference[sats]
+    return {"Common":common,
+            "Single Phase":single_phase,
+            "Single Code":single_code,
+            "Reference":ref,
+            "Satellites":sats,
+            "Phase":single_phase[sats] - single_phase[ref],
+            "Code":single_code[sats] - single_code[ref],
+            "Wavelength":rover.wavelength[sats],
+            "Reference Wavelength":rover.wavelength[ref]}
@@ -8,6 +8,7 @@ Makespace Cambridge
 July 2018
 """
 
+import bisect
 import numpy as np
 
 # Constants
@@ -19,10 +20,22 @@ Omega_dot_e = 7.292115E-5 # Earth rotation rate [rad/s]
 PI = 3.1415926535897932  # PI
 MU_GPS = 3.9860050E14 # Gravitational constant for GPS
 MU_GLONASS = 3.9860044E14 # Gravitational constant for GLONASS
+AE_GLONASS = 6378136.0 # Semi-major axis of the PZ-90 ellipsoid [m]
+J2_GLONASS = 1.0826257E-3 # Second zonal harmonic of the PZ-90 geopotential
+OMGE_GLONASS = 7.292115E-5 # Earth rotation rate in PZ-90 [rad/s]
+STEP_GLONASS = 60.0 # Largest integration step for GLONASS orbits [s]
 
 RTOL_KEPLER = 1E-14 # Relative tolerance for Kepler equation
 MAX_ITER_KEPLER = 30 # Maximum number of iteration of Kepler
 
+# Satellite systems, same values as the BINR system byte
+GPS = 1
+GLONASS = 2
+
+# Ephemeris validity and reference time period per system [s]
+MAX_EPHEMERIS_AGE = {GPS:7200.0, GLONASS:1800.0}
+REF_TIME_PERIOD = {GPS:604800.0, GLONASS:86400.0}
+
 
 def calc_sat_xyz(t, eph):
     """
@@ -122,6 +135,546 @@ def calc_sat_xyz(t, eph):
     return [x_k, y_k, z_k], sat_clk_bias, dt_r
 
 
+# Ephemeris fields used by the batched GPS orbit model
+GPS_ORBIT_FIELDS = ["C_rs", "dn", "M_0", "C_uc", "e", "C_us", "sqrtA", "t_0e",
+                    "C_ic", "Omega_0", "C_is", "I_0", "C_rc", "w", "Omega_dot",
+                    "IDOT", "T_GD", "t_0c", "a_f2", "a_f1", "a_f0"]
+
+# Ephemeris fields used by the GLONASS orbit model
+GLONASS_ORBIT_FIELDS = ["x_n", "y_n", "z_n", "x_nv", "y_nv", "z_nv",
+                        "x_na", "y_na", "z_na", "t_b", "tau_n", "gamma_n"]
+
+# Relativistic clock correction constant [s/sqrt(m)]
+F_REL = -4.442807633E-10
+
+
+def stack_ephemerides(ephs, fields=GPS_ORBIT_FIELDS):
+    """
+    Stack a list of ephemeris dictionaries into a dictionary of arrays
+    for the batched functions.
+
+    arguments:
+        ephs - list of ephemeris dictionaries
+        fields - fields to stack
+    
+    returns:
+        {field: array} with one entry per ephemeris
+    """
+    return dict([(name, np.array([eph[name] for eph in ephs], dtype=np.float64))
+                 for name in fields])
+
+
+def solve_kepler(M, e):
+    """
+    Solve Keplers equation M = E - e*sin(E) for the eccentric anomaly 
+    with Newton iterations on all elements at once.
+
+    arguments:
+        M - mean anomaly [rad]
+        e - eccentricity
+    
+    returns:
+        E - eccentric anomaly [rad]
+    raises:
+        OverflowError - if the iteration does not converge
+    """
+    M = np.asarray(M, dtype=np.float64)
+    E = M.copy()
+    for i in range(MAX_ITER_KEPLER):
+        dE = (E - e*np.sin(E) - M)/(1 - e*np.cos(E))
+        E = E - dE
+        if np.all(np.abs(dE) <= RTOL_KEPLER):
+            return E
+    raise OverflowError("Kepler iteration overflow")
+
+
+class GpsOrbit:
+    """
+    GPS ephemeris compiled for evaluation. The BINR units are converted 
+    to seconds and every term that does not depend on time is computed
+    once. Every attribute is either a float or an array of equal length,
+    so one object can hold a single ephemeris or many.
+    """
+    __slots__ = ["prn", "iode", "t_0e", "t_0c", "A", "n", "M_0", "e", 
+                 "sqrt_1_e2", "w", "C_us", "C_uc", "C_rs", "C_rc", "C_is", 
+                 "C_ic", "I_0", "IDOT", "Omega_0", "Omega_rate", "a_f0", 
+                 "a_f1", "a_f2", "T_GD", "F_e_sqrtA"]
+
+    def __init__(self, eph):
+        """
+        arguments:
+            eph - ephemeris mapping with GPS_ORBIT_FIELDS in BINR units, 
+                  values are scalars or arrays
+        """
+        field = lambda name: np.asarray(eph[name], dtype=np.float64)
+        self.prn = eph["PRN"] if "PRN" in _names(eph) else None
+        self.iode = eph["IODE"] if "IODE" in _names(eph) else None
+
+        # Reference times [s]
+        self.t_0e = field("t_0e")/1000
+        self.t_0c = field("t_0c")/1000
+
+        # Orbit shape and mean motion
+        sqrtA = field("sqrtA")
+        self.A = sqrtA**2
+        self.n = np.sqrt(MU_GPS/self.A**3) + field("dn")*1000 # [rad/s]
+        self.M_0 = field("M_0")
+        self.e = field("e")
+        self.sqrt_1_e2 = np.sqrt(1 - self.e**2)
+        self.w = field("w")
+
+        # Harmonic corrections
+        self.C_us = field("C_us")
+        self.C_uc = field("C_uc")
+        self.C_rs = field("C_rs")
+        self.C_rc = field("C_rc")
+        self.C_is = field("C_is")
+        self.C_ic = field("C_ic")
+        self.I_0 = field("I_0")
+        self.IDOT = field("IDOT")*1000 # [rad/s]
+
+        # Ascending node at t_0e in ECEF and its rate in ECEF [rad/s]
+        self.Omega_0 = field("Omega_0") - OMGE*self.t_0e
+        self.Omega_rate = field("Omega_dot")*1000 - OMGE
+
+        # Clock polynomial [s, s/s, s/s^2], group delay and relativity [s]
+        self.a_f0 = field("a_f0")/1000
+        self.a_f1 = field("a_f1")
+        self.a_f2 = field("a_f2")*1000
+        self.T_GD = field("T_GD")/1000
+        self.F_e_sqrtA = F_REL*self.e*sqrtA
+
+    def position(self, t):
+        """
+        Satellite position and clock at a time of transmission.
+
+        arguments:
+            t - GPS time of week of transmission [s], scalar or array
+                matching the compiled ephemerides
+
+        returns:
+            pos - (N, 3) ECEF coordinates of the satellites [m]
+            sat_clk_bias - (N,) satellite clock polynomial bias [s]
+            dt_r - (N,) relativistic clock correction [s]
+        """
+        t = np.asarray(t, dtype=np.float64)
+
+        # Time from ephemeris reference epoch, corrected for week crossovers
+        t_k = t - self.t_0e
+        t_k = t_k - 604800*np.round(t_k/604800)
+
+        # Eccentric and true anomaly
+        E = solve_kepler(self.M_0 + self.n*t_k, self.e)
+        sinE = np.sin(E)
+        cosE = np.cos(E)
+        v = np.arctan2(self.sqrt_1_e2*sinE, cosE - self.e)
+
+        # Argument of latitude and second harmonic pertubations
+        u = v + self.w
+        sin2u = np.sin(2*u)
+        cos2u = np.cos(2*u)
+        u = u + self.C_us*sin2u + self.C_uc*cos2u
+        r = self.A*(1 - self.e*cosE) + self.C_rc*cos2u + self.C_rs*sin2u
+        i = self.I_0 + self.IDOT*t_k + self.C_ic*cos2u + self.C_is*sin2u
+
+        # Positions in orbital plane
+        xa = r*np.cos(u)
+        ya = r*np.sin(u)
+
+        # Earth Centered, Earth Fixed coordinates (ECEF)
+        Omega = self.Omega_0 + self.Omega_rate*t_k
+        sinO = np.sin(Omega)
+        cosO = np.cos(Omega)
+        cosi = np.cos(i)
+        pos = np.stack([xa*cosO - ya*cosi*sinO,
+                        xa*sinO + ya*cosi*cosO,
+                        ya*np.sin(i)], axis=-1)
+
+        # Clock polynomial and relativistic effects
+        t_c = t - self.t_0c
+        t_c = t_c - 604800*np.round(t_c/604800)
+        sat_clk_bias = self.a_f0 + self.a_f1*t_c + self.a_f2*t_c**2
+        dt_r = self.F_e_sqrtA*sinE
+
+        return pos.reshape(-1, 3), np.atleast_1d(sat_clk_bias), np.atleast_1d(dt_r)
+
+
+def _names(eph):
+    """
+    Field names of an ephemeris dictionary or structured array.
+    """
+    if isinstance(eph, np.ndarray) or isinstance(eph, np.void):
+        return eph.dtype.names
+    return eph
+
+
+def calc_sat_xyz_batch(t, eph):
+    """
+    Calculate GPS satellite positions in ECEF coordinates for many
+    satellites and times at once.
+
+    Uses the IS-GPS-200 orbit model with the BINR units converted to 
+    seconds, so the rates given per ms are scaled to per second. Compile 
+    the ephemerides with GpsOrbit once when they are evaluated repeatedly.
+    
+    arguments:
+        t - GPS time of week of transmission [s], shape (N,) or scalar
+        eph - mapping of GPS_ORBIT_FIELDS to arrays in BINR units, 
+              shape (N,) or scalar. A structured array from 
+              binr.load_recording or stack_ephemerides both work.
+
+    returns:
+        pos - (N, 3) ECEF coordinates of the satellites [m]
+        sat_clk_bias - (N,) satellite clock polynomial bias [s]
+        dt_r - (N,) relativistic clock correction [s]
+    """
+    return GpsOrbit(eph).position(t)
+
+
+def glonass_derivatives(state, acc):
+    """
+    PZ-90 equations of motion of GLONASS satellites in the rotating 
+    Earth frame.
+
+    arguments:
+        state - (N, 6) positions [m] and velocities [m/s]
+        acc - (N, 3) luni-solar accelerations [m/s^2]
+
+    returns:
+        (N, 6) time derivative of state
+    """
+    x = state[:, 0]
+    y = state[:, 1]
+    z = state[:, 2]
+    vx = state[:, 3]
+    vy = state[:, 4]
+    r2 = x*x + y*y + z*z
+    r3 = r2*np.sqrt(r2)
+    a = 1.5*J2_GLONASS*MU_GLONASS*AE_GLONASS**2/(r2*r3)
+    b = 5*z*z/r2
+    c = -MU_GLONASS/r3 - a*(1 - b)
+    omg2 = OMGE_GLONASS**2
+    deriv = np.empty_like(state)
+    deriv[:, :3] = state[:, 3:]
+    deriv[:, 3] = (c + omg2)*x + 2*OMGE_GLONASS*vy + acc[:, 0]
+    deriv[:, 4] = (c + omg2)*y - 2*OMGE_GLONASS*vx + acc[:, 1]
+    deriv[:, 5] = (c - 2*a)*z + acc[:, 2]
+    return deriv
+
+
+def glonass_integrate(state, acc, dt, max_step=STEP_GLONASS):
+    """
+    Integrate GLONASS states over a time span with fourth order 
+    Runge-Kutta. Every satellite takes the same number of steps, sized 
+    to its own span, so all of them are advanced together.
+
+    arguments:
+        state - (N, 6) positions [m] and velocities [m/s]
+        acc - (N, 3) luni-solar accelerations [m/s^2]
+        dt - (N,) time span per satellite [s], may be negative
+        max_step - largest step [s]
+
+    returns:
+        (N, 6) state after dt
+    """
+    dt = np.asarray(dt, dtype=np.float64)
+    steps = int(np.ceil(np.max(np.abs(dt), initial=0)/max_step))
+    if steps == 0:
+        return state.copy()
+    h = (dt/steps)[:, None]
+    for i in range(steps):
+        k1 = glonass_derivatives(state, acc)
+        k2 = glonass_derivatives(state + h/2*k1, acc)
+        k3 = glonass_derivatives(state + h/2*k2, acc)
+        k4 = glonass_derivatives(state + h*k3, acc)
+        state = state + h/6*(k1 + 2*k2 + 2*k3 + k4)
+    return state
+
+
+class GlonassOrbit:
+    """
+    GLONASS ephemerides of one or many satellites, propagated with RK4
+    from the broadcast state at t_b. The last propagated state of every 
+    satellite is kept, so successive epochs only integrate the time 
+    since the previous call instead of starting over from t_b.
+    """
+    __slots__ = ["prn", "t_b", "state_b", "acc", "tau_n", "gamma_n",
+                 "t_cache", "state_cache"]
+
+    def __init__(self, eph):
+        """
+        arguments:
+            eph - ephemeris mapping with GLONASS_ORBIT_FIELDS in BINR 
+                  units, values are scalars or arrays
+        """
+        field = lambda name: np.atleast_1d(np.asarray(eph[name], dtype=np.float64))
+        self.prn = eph["PRN"] if "PRN" in _names(eph) else None
+
+        # Broadcast state in PZ-90, velocities in m/ms and accelerations
+        # in m/ms^2
+        self.t_b = field("t_b")/1000
+        self.state_b = np.column_stack([field("x_n"), field("y_n"), field("z_n"),
+                                        field("x_nv")*1000, field("y_nv")*1000, 
+                                        field("z_nv")*1000])
+        self.acc = np.column_stack([field("x_na"), field("y_na"), 
+                                    field("z_na")])*1E6
+
+        # Clock offset [s] and relative frequency deviation
+        self.tau_n = field("tau_n")/1000
+        self.gamma_n = field("gamma_n")
+
+        # Last propagated state
+        self.t_cache = self.t_b.copy()
+        self.state_cache = self.state_b.copy()
+
+    def state(self, t):
+        """
+        Satellite states at GLONASS times.
+
+        arguments:
+            t - GLONASS time of day [s], one per satellite, or any shape
+                for a single satellite
+
+        returns:
+            (N, 6) positions [m] and velocities [m/s]
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=np.float64)).ravel()
+        t_k = t - self.t_b
+        t_k = t_k - 86400*np.round(t_k/86400)
+        t = self.t_b + t_k
+
+        if len(t) != len(self.t_b):
+            # Many times of one satellite, integrate from t_b
+            return glonass_integrate(np.repeat(self.state_b, len(t), axis=0),
+                                     np.repeat(self.acc, len(t), axis=0), t_k)
+
+        # Start from whichever of t_b and the last state is closer
+        from_cache = np.abs(t - self.t_cache) < np.abs(t_k)
+        start = np.where(from_cache[:, None], self.state_cache, self.state_b)
+        dt = np.where(from_cache, t - self.t_cache, t_k)
+        state = glonass_integrate(start, self.acc, dt)
+        self.t_cache = t
+        self.state_cache = state
+        return state
+
+    def position(self, t):
+        """
+        Satellite position and clock at a time of transmission.
+
+        arguments:
+            t - GLONASS time of day of transmission [s]
+
+        returns:
+            pos - (N, 3) PZ-90 coordinates of the satellites [m]
+            sat_clk_bias - satellite clock bias [s]
+            dt_r - relativistic clock correction, included in tau_n [s]
+        """
+        state = self.state(t)
+        t = np.asarray(t, dtype=np.float64)
+        t_k = t - self.t_b if t.size == len(self.t_b) else t - self.t_b[0]
+        t_k = t_k - 86400*np.round(t_k/86400)
+        sat_clk_bias = -self.tau_n + self.gamma_n*t_k
+        return state[:, :3], sat_clk_bias, np.zeros_like(sat_clk_bias)
+
+
+class EphemerisStore:
+    """
+    Latest ephemerides of every satellite, deduplicated by issue and 
+    sorted by reference time so the best set for an epoch is found 
+    with a binary search. GPS sets are compiled into a GpsOrbit once 
+    when they are added.
+
+    GPS sets are identified by IODE and referenced to t_0e. GLONASS has
+    no IODE, so sets are identified and referenced by t_b.
+    """
+
+    def __init__(self, max_per_sat=3, max_age=MAX_EPHEMERIS_AGE):
+        """
+        arguments:
+            max_per_sat - ephemeris sets kept per satellite
+            max_age - {system: largest |t - reference time| served [s]}
+        """
+        self.max_per_sat = max_per_sat
+        self.max_age = dict(max_age)
+        # (system, PRN) -> [[reference times], [ephemerides], [orbits]]
+        self._sats = {}
+
+    @staticmethod
+    def key(eph):
+        """
+        Satellite (system, PRN), issue and reference time [s] of an 
+        ephemeris dictionary from message 49h or F7h.
+        """
+        system = eph["System"]
+        if system == GPS:
+            return (system, eph["PRN"]), eph["IODE"], eph["t_0e"]/1000
+        elif system == GLONASS:
+            prn = eph["PRN"] if "PRN" in eph else eph["n^A"]
+            return (system, prn), eph["t_b"], eph["t_b"]/1000
+        raise ValueError("Invalid system: "+str(system))
+
+    @staticmethod
+    def compile(eph):
+        """
+        Compile an ephemeris dictionary for evaluation.
+        """
+        if eph["System"] == GPS and "sqrtA" in eph:
+            return GpsOrbit(eph)
+        elif eph["System"] == GLONASS and "x_n" in eph:
+            return GlonassOrbit(eph)
+        return None
+
+    def add(self, eph):
+        """
+        Add an ephemeris. A set with the same issue or reference time as 
+        a stored set replaces it, and the oldest set is evicted once a 
+        satellite has max_per_sat sets, with reference times compared 
+        across day and week rollovers.
+
+        arguments:
+            eph - ephemeris dictionary from message 49h or F7h
+
+        returns:
+            True if the set was new and kept
+        """
+        sat, issue, t_ref = self.key(eph)
+        ref_times, ephs, orbits = self._sats.setdefault(sat, ([], [], []))
+
+        # Superseded or repeated sets
+        for i in range(len(ephs)):
+            stored_issue = self.key(ephs[i])[1]
+            if stored_issue == issue or ref_times[i] == t_ref:
+                if stored_issue == issue and ref_times[i] == t_ref:
+                    return False
+                del ref_times[i]
+                del ephs[i]
+                del orbits[i]
+                break
+
+        i = bisect.bisect(ref_times, t_ref)
+        ref_times.insert(i, t_ref)
+        ephs.insert(i, eph)
+        orbits.insert(i, self.compile(eph))
+        if len(ephs) > self.max_per_sat:
+            # Oldest set relative to the new one, across day or week rollovers
+            period = REF_TIME_PERIOD[sat[0]]
+            offsets = [(ref - t_ref + period/2) % period for ref in ref_times]
+            oldest = int(np.argmin(offsets))
+            del ref_times[oldest]
+            del ephs[oldest]
+            del orbits[oldest]
+            return oldest != i
+        return True
+
+    def _find(self, system, prn, t):
+        """
+        Entry and position of the set with the nearest reference time
+        within the maximum age, (None, -1) if there is none.
+        """
+        entry = self._sats.get((system, prn))
+        if entry is None:
+            return None, -1
+        ref_times = entry[0]
+        period = REF_TIME_PERIOD[system]
+
+        # Neighbours of t, plus the ends for period crossovers
+        i = bisect.bisect(ref_times, t)
+        best = -1
+        best_dt = self.max_age[system]
+        for j in set([i-1, i, 0, len(ref_times)-1]):
+            if j < 0 or j >= len(ref_times):
+                continue
+            dt = t - ref_times[j]
+            dt = abs(dt - period*np.round(dt/period))
+            if dt <= best_dt:
+                best = j
+                best_dt = dt
+        return entry, best
+
+    def get(self, system, prn, t):
+        """
+        Best ephemeris of a satellite for a time, the set with the 
+        nearest reference time within the maximum age.
+
+        arguments:
+            system - GPS or GLONASS
+            prn - satellite number
+            t - time in the reference time scale of the system [s]
+
+        returns:
+            ephemeris dictionary or None
+        """
+        entry, i = self._find(system, prn, t)
+        if i < 0:
+            return None
+        return entry[1][i]
+
+    def get_orbit(self, system, prn, t):
+        """
+        Compiled orbit of the best ephemeris of a satellite for a time.
+
+        arguments:
+            system - GPS or GLONASS
+            prn - satellite number
+            t - time in the reference time scale of the system [s]
+
+        returns:
+            GpsOrbit, GlonassOrbit or None
+        """
+        entry, i = self._find(system, prn, t)
+        if i < 0:
+            return None
+        return entry[2][i]
+
+    def lookup(self, system, prn, t):
+        """
+        Issue, reference time and compiled orbit of the best ephemeris of
+        a satellite for a time.
+
+        arguments:
+            system - GPS or GLONASS
+            prn - satellite number
+            t - time in the reference time scale of the system [s]
+
+        returns:
+            (issue, reference time [s], orbit) or None
+        """
+        entry, i = self._find(system, prn, t)
+        if i < 0:
+            return None
+        return self.key(entry[1][i])[1], entry[0][i], entry[2][i]
+
+    def expire(self, t):
+        """
+        Remove every set that is too old to be served at time t or later.
+
+        arguments:
+            t - current time in the reference time scale of the systems [s]
+        """
+        for (system, prn), entry in list(self._sats.items()):
+            period = REF_TIME_PERIOD[system]
+            keep = []
+            for i in range(len(entry[0])):
+                dt = t - entry[0][i]
+                dt = dt - period*np.round(dt/period)
+                if dt <= self.max_age[system]:
+                    keep.append(i)
+            if len(keep) == 0:
+                del self._sats[(system, prn)]
+            elif len(keep) < len(entry[0]):
+                self._sats[(system, prn)] = tuple([[items[i] for i in keep] 
+                                                   for items in entry])
+
+    def satellites(self):
+        """
+        List of (system, PRN) with stored ephemerides.
+        """
+        return list(self._sats.keys())
+
+    def __len__(self):
+        return sum([len(entry[1]) for entry in self._sats.values()])
+
+
 def calc_tx_time(rx_time, prng):
     """
     Calculate the transit time given the given pseudornage.
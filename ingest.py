@@ -0,0 +1,125 @@
+"""
+Concurrent ingest of BINR streams from several receivers with asyncio.
+
+Every stream gets its own reader task. The blocking serial reads run in
+worker threads and return as soon as any bytes arrive, so messages from
+all receivers are framed, decoded and delivered as they come in without
+fixed sleeps.
+"""
+
+import asyncio
+import binr
+
+READ_SIZE = 4096 # Largest read from a stream [bytes]
+
+
+def decode_frame(frame):
+    """
+    Decode the messages used for positioning.
+
+    arguments:
+        frame - {ID, data} from binr.BinrFramer
+    returns:
+        raw data arrays for F5h, ephemeris dictionary for F7h, None for
+        other messages
+    """
+    if frame["ID"] == 0xF5:
+        return binr.process_raw_data_arrays(frame["data"])
+    elif frame["ID"] == 0xF7:
+        return binr.process_extended_ephemeris_of_satellites(frame["data"])
+    return None
+
+
+class ReceiverReader:
+    """
+    Reads one receiver stream and frames the BINR messages.
+    """
+
+    def __init__(self, name, stream):
+        """
+        arguments:
+            name - name given to the messages of this receiver
+            stream - serial.Serial or any object with read() and in_waiting
+        """
+        self.name = name
+        self.stream = stream
+        self.framer = binr.BinrFramer()
+        self.bytes_read = 0
+
+    def read(self):
+        """
+        Blocking read of everything waiting, or of the first byte to
+        arrive within the stream timeout.
+        """
+        return self.stream.read(min(max(self.stream.in_waiting, 1), READ_SIZE))
+
+    async def run(self, queue, running):
+        """
+        Read the stream until running is cleared, putting
+        (name, message ID, decoded message) on the queue.
+        """
+        loop = asyncio.get_running_loop()
+        while running.is_set():
+            chunk = await loop.run_in_executor(None, self.read)
+            if not chunk:
+                continue
+            self.bytes_read += len(chunk)
+            for frame in self.framer.feed(chunk):
+                try:
+                    message = decode_frame(frame)
+                except (ValueError, IndexError):
+                    continue # Corrupt or truncated message
+                if message is not None:
+                    await queue.put((self.name, frame["ID"], message))
+
+
+class Ingest:
+    """
+    Reads several receivers concurrently and hands every decoded message
+    to a handler in arrival order.
+    """
+
+    def __init__(self, streams, handler, queue_size=256):
+        """
+        arguments:
+            streams - {name: stream}
+            handler - called as handler(name, message ID, message)
+            queue_size - decoded messages buffered for the handler
+        """
+        self.readers = [ReceiverReader(name, stream) for name, stream in streams.items()]
+        self.handler = handler
+        self.queue_size = queue_size
+        self._running = None
+
+    def stop(self):
+        """
+        Stop reading once the message being handled is done.
+        """
+        if self._running is not None:
+            self._running.clear()
+
+    async def run(self):
+        """
+        Read and deliver messages until stop is called.
+        """
+        queue = asyncio.Queue(self.queue_size)
+        self._running = asyncio.Event()
+        self._running.set()
+        readers = [asyncio.ensure_future(reader.run(queue, self._running))
+                   for reader in self.readers]
+        try:
+            while self._running.is_set():
+                getter = asyncio.ensure_future(queue.get())
+                done, pending = await asyncio.wait(readers + [getter],
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    for reader in done:
+                        reader.result() # Raise reader errors
+                    break
+                self.handler(*getter.result())
+        finally:
+            self._running.clear()
+            for reader in readers:
+                reader.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
@@ -0,0 +1,225 @@
+"""
+Recursive float RTK solution with a Kalman filter.
+"""
+
+import numpy as np
+import alignment
+import differencing
+
+SIGMA_PHASE = 0.003 # Undifferenced carrier phase noise [m]
+SIGMA_CODE = 0.3 # Undifferenced pseudorange noise [m]
+SIGMA_AMBIGUITY = 30.0 # Initial single difference ambiguity uncertainty [cycles]
+POSITION_NOISE = 1.0 # Baseline random walk [m/sqrt(s)]
+AMBIGUITY_NOISE = 1E-4 # Ambiguity random walk [cycles/sqrt(s)]
+BASELINE_VARIANCE = 100.0 # Variance of the initial baseline [m^2]
+
+
+class FloatRtkFilter:
+    """
+    Kalman filter of the rover baseline to a known base and the single
+    difference carrier phase ambiguity of every common satellite.
+
+    The filter is fed with double differences, but keeps one single
+    difference ambiguity per satellite so changing the reference
+    satellite does not touch the states. Ambiguity states are added
+    when a satellite rises and removed when it sets or slips, so the
+    work per epoch depends only on the satellites in view. The double
+    difference ambiguities for integer resolution follow from the
+    states with a linear transform.
+    """
+
+    def __init__(self, base_pos, position_noise=POSITION_NOISE,
+                 sigma_phase=SIGMA_PHASE, sigma_code=SIGMA_CODE):
+        """
+        arguments:
+            base_pos - (3,) ECEF base antenna position [m]
+            position_noise - baseline random walk [m/sqrt(s)]
+            sigma_phase - undifferenced carrier phase noise [m]
+            sigma_code - undifferenced pseudorange noise [m]
+        """
+        self.base_pos = np.asarray(base_pos, dtype=np.float64)
+        self.position_noise = position_noise
+        self.sigma_phase = sigma_phase
+        self.sigma_code = sigma_code
+        self.x = np.zeros(3) # Baseline [m], then ambiguities [cycles]
+        self.P = np.eye(3)*BASELINE_VARIANCE
+        self.sats = np.zeros(0, dtype=np.int64) # Satellite of every ambiguity state
+        self.wavelength = np.zeros(0)
+        self.t = None
+        self.initialized = False
+        self._last = None # Satellites and references of the latest update
+
+    @property
+    def baseline(self):
+        return self.x[:3]
+
+    @property
+    def position(self):
+        """
+        ECEF rover position [m].
+        """
+        return self.base_pos + self.x[:3]
+
+    def initialize(self, rover_pos, variance=BASELINE_VARIANCE):
+        """
+        Start the baseline from an approximate rover position, such as a
+        single point solution.
+        """
+        self.x = np.concatenate([np.asarray(rover_pos) - self.base_pos, self.x[3:]])
+        self.P[:3, :] = 0
+        self.P[:, :3] = 0
+        self.P[:3, :3] = np.eye(3)*variance
+        self.initialized = True
+
+    def _predict(self, t):
+        """
+        Random walk of the baseline and ambiguities up to time t [s].
+        """
+        if self.t is not None:
+            dt = t - self.t
+            dt = abs(dt - alignment.WEEK*np.round(dt/alignment.WEEK)) # Across the week rollover
+            diag = np.diag_indices(len(self.x))
+            noise = np.full(len(self.x), AMBIGUITY_NOISE**2*dt)
+            noise[:3] = self.position_noise**2*dt
+            self.P[diag] += noise
+        self.t = t
+
+    def _remove(self, keep):
+        """
+        Remove the ambiguity states that are not kept.
+        """
+        keep_state = np.concatenate([np.ones(3, dtype=bool), keep])
+        self.x = self.x[keep_state]
+        self.P = self.P[np.ix_(keep_state, keep_state)]
+        self.sats = self.sats[keep]
+        self.wavelength = self.wavelength[keep]
+
+    def _add(self, sats, ambiguities, wavelength):
+        """
+        Add ambiguity states with a large uncertainty.
+        """
+        n = len(self.x)
+        m = len(sats)
+        P = np.zeros((n+m, n+m))
+        P[:n, :n] = self.P
+        P[n:, n:] = np.eye(m)*SIGMA_AMBIGUITY**2
+        self.P = P
+        self.x = np.concatenate([self.x, ambiguities])
+        self.sats = np.concatenate([self.sats, sats])
+        self.wavelength = np.concatenate([self.wavelength, wavelength])
+
+    def _manage_states(self, dd, slips):
+        """
+        Match the ambiguity states to the satellites of an epoch.
+        """
+        sats = np.union1d(dd["Satellites"], dd["Reference"])
+        keep = np.isin(self.sats, sats)
+        if slips is not None:
+            keep &= ~np.isin(self.sats, slips)
+        if not np.all(keep):
+            self._remove(keep)
+
+        new = sats[~np.isin(sats, self.sats)]
+        if len(new) > 0:
+            lam = np.zeros(differencing.NUM_SATS)
+            lam[dd["Satellites"]] = dd["Wavelength"]
+            lam[dd["Reference"]] = dd["Reference Wavelength"]
+            ambiguities = (dd["Single Phase"][new] - dd["Single Code"][new])/lam[new]
+            self._add(new, ambiguities, lam[new])
+
+    def update(self, t, dd, sat_pos, slips=None):
+        """
+        Update the filter with the double differences of an epoch.
+
+        arguments:
+            t - GPS time of the epoch [s]
+            dd - double differences from differencing.double_differences
+            sat_pos - (NUM_SATS, 3) ECEF satellite positions [m]
+            slips - satellite indices with a cycle slip, or None
+        returns:
+            (N,) phase double difference residuals after the update [m]
+        raises:
+            ValueError - if the filter was not initialized
+        """
+        if not self.initialized:
+            raise ValueError("Filter needs an initial rover position")
+        self._predict(t)
+        self._manage_states(dd, slips)
+        sats = dd["Satellites"]
+        refs = dd["Reference"]
+        m = len(sats)
+        self._last = (sats, refs)
+        if m == 0:
+            return np.zeros(0)
+
+        # State column of every satellite
+        column = np.zeros(differencing.NUM_SATS, dtype=np.int64)
+        column[self.sats] = np.arange(len(self.sats)) + 3
+        col_sat = column[sats]
+        col_ref = column[refs]
+
+        # Geometry relative to the base, all satellites at once
+        rover_los = sat_pos - self.position
+        rover_rng = np.linalg.norm(rover_los, axis=1)
+        geometry = rover_rng - np.linalg.norm(sat_pos - self.base_pos, axis=1)
+        unit = rover_los/rover_rng[:, None]
+        dd_geometry = geometry[sats] - geometry[refs]
+
+        # Phase rows then code rows
+        n = len(self.x)
+        H = np.zeros((2*m, n))
+        H[:m, :3] = -(unit[sats] - unit[refs])
+        H[m:, :3] = H[:m, :3]
+        rows = np.arange(m)
+        H[rows, col_sat] = dd["Wavelength"]
+        H[rows, col_ref] = -dd["Reference Wavelength"]
+        predicted = np.concatenate([dd_geometry + self.x[col_sat]*dd["Wavelength"]
+                                    - self.x[col_ref]*dd["Reference Wavelength"],
+                                    dd_geometry])
+        v = np.concatenate([dd["Phase"], dd["Code"]]) - predicted
+
+        # Double differences with a shared reference are correlated
+        shared = (refs[:, None] == refs[None, :]) + np.eye(m)
+        R = np.zeros((2*m, 2*m))
+        R[:m, :m] = 2*self.sigma_phase**2*shared
+        R[m:, m:] = 2*self.sigma_code**2*shared
+
+        # Kalman update
+        PHt = self.P @ H.T
+        S = H @ PHt + R
+        K = np.linalg.solve(S, PHt.T).T
+        self.x = self.x + K @ v
+        self.P = self.P - K @ PHt.T
+        self.P = (self.P + self.P.T)/2
+        return (v - H @ (K @ v))[:m]
+
+    def dd_ambiguities(self):
+        """
+        Float double difference ambiguities of the latest update.
+
+        returns:
+            a - (N,) float ambiguities [cycles]
+            Q - (N, N) their covariance [cycles^2]
+            Q_ba - (3, N) covariance of the baseline and the ambiguities
+        """
+        sats, refs = self._last
+        column = np.zeros(differencing.NUM_SATS, dtype=np.int64)
+        column[self.sats] = np.arange(len(self.sats)) + 3
+        T = np.zeros((len(sats), len(self.x)))
+        rows = np.arange(len(sats))
+        T[rows, column[sats]] = 1
+        T[rows, column[refs]] = -1
+        PT = self.P @ T.T
+        return T @ self.x, T @ PT, PT[:3]
+
+    def fixed_baseline(self, fixed):
+        """
+        Baseline conditioned on integer double difference ambiguities.
+
+        arguments:
+            fixed - (N,) integer ambiguities, in the order of dd_ambiguities
+        returns:
+            (3,) baseline [m]
+        """
+        a, Q, Q_ba = self.dd_ambiguities()
+        return self.x[:3] - Q_ba @ np.linalg.solve(Q, a - fixed)
@@ -18,25 +18,18 @@ reader = open(filename, 'rb')
 
 # Count messages
 print("Starting read loop")
-buffer = []
+framer = binr.BinrFramer()
 try:
     while True:
-        read = list(reader.read(100))
-        buffer = buffer + read
+        read = reader.read(100)
         if len(read) == 0:
             reader.close()
             print("Done")
             break
-        try:
-            data, buffer = binr.process_msg(buffer)
-            print("Msg: "+str(data["ID"])+" buffer length: "+str(len(buffer)))
+        for data in framer.feed(read):
+            print("Msg: "+str(data["ID"])+" buffer length: "+str(framer.pending()))
             if data["ID"] == 0xF5:
                 print(bytearray(data["data"]))
-        except ValueError:
-            print("Buffer length: "+str(len(buffer)))  
         time.sleep(0.01)
 except KeyboardInterrupt:
     reader.close()
-
-        
-
@@ -1,6 +1,6 @@
 """
 We need to be able to test this thing without putting on sunscreen every time.
-So this file is soley to record the serial stream to a file for later readback 
+So this file is soley to record the serial stream to a file for later readback
 testing.
 
 Hardie Pienaar
@@ -9,42 +9,45 @@ July 2018
 """
 
 import binr
+import recorder
 import serial
-import os
 import time
 
 # Parameters
-port = "COM5"
-filename = "recording.dat"
-
-# Switch device to BINR
-print("Switching serial protocol to BINR")
-ser = serial.Serial(port, 115200)
-ser.write("$PORZA,0,115200,3*7E\r\n".encode())
-ser.close()
+ports = {"rover":"COM5"} # Receivers to record, add more to record them together
+directory = "."
+max_bytes = 256*1024*1024 # Rotate recordings at this size
+max_seconds = 3600 # Rotate recordings after this time
+
+# Switch devices to BINR
+streams = {}
+for name, port in ports.items():
+    print("Switching serial protocol of "+name+" to BINR")
+    ser = serial.Serial(port, 115200)
+    ser.write("$PORZA,0,115200,3*7E\r\n".encode())
+    ser.close()
 
 time.sleep(1)
-assert(False)
-# Connect to device
-print("Connecting to serial port [BINR 115200]")
-ser = serial.Serial(port, 115200, parity=serial.PARITY_ODD, timeout=1)
-
-# Create file
-record_file  = open(filename, "wb")
+for name, port in ports.items():
+    # Connect to device
+    print("Connecting to serial port "+port+" [BINR 115200]")
+    streams[name] = serial.Serial(port, 115200, parity=serial.PARITY_ODD, timeout=1)
 
-# Send commands (this is up to you!)
-ser.write(binr.request_raw_data(10))
+    # Send commands (this is up to you!)
+    streams[name].write(binr.request_raw_data(10))
 
 # Start recording
-total = 0
+capture = recorder.Recorder(streams, directory, max_bytes, max_seconds)
+capture.start()
 try:
     while True:
-        buffer = ser.read(100)
-        total = total + len(buffer)
-        print("Received: "+str(len(buffer))+" bytes. Total: "+str(total))
-        record_file.write(buffer)
-        time.sleep(0.1)
+        time.sleep(5)
+        for name, (total, waiting) in capture.status().items():
+            print(name+" total: "+str(total)+" bytes, queued chunks: "+str(waiting))
 except KeyboardInterrupt:
-    # Close file
-    record_file.close()
-    ser.close()
\ No newline at end of file
+    # Write out what was read and close the files
+    capture.stop()
+    for stream in streams.values():
+        stream.close()
+    for writer in capture.writers.values():
+        print("Recorded "+", ".join(writer.filenames))
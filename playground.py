@@ -16,7 +16,7 @@ if False:
 
     # Process messages
     eph = binr.process_sv_ephemeris(eph_bin)
-    raw = binr.process_raw_data(raw_data_bin)
+    raw = binr.process_raw_data(binr.unstuff(raw_data_bin))
 
     # Print raw data message
     #binr.print_raw_data(raw)
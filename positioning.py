@@ -0,0 +1,345 @@
+"""
+Single point positioning from BINR raw data.
+"""
+
+import concurrent.futures
+import numpy as np
+import binr
+import ephemeris
+
+# Raw data flags required for a usable pseudorange
+PSEUDORANGE_FLAGS = 0x03 # Signal present, pseudorange and Doppler present
+
+# Offline solution record, one per raw data epoch
+SOLUTION_DTYPE = np.dtype([("Time", '<f8'), # Receiver time, UTC [ms]
+                           ("X", '<f8'), # ECEF position [m]
+                           ("Y", '<f8'),
+                           ("Z", '<f8'),
+                           ("Clock Bias", '<f8'), # Receiver clock to GPS time [s]
+                           ("GLONASS Clock Offset", '<f8'), # [s]
+                           ("Satellites", '<i2'), # Satellites used
+                           ("RMS", '<f8'), # RMS of the residuals [m]
+                           ("Iterations", '<i2')])
+
+CHUNK_SIZE = 256 # Epochs per offline positioning job
+
+MAX_ITER_SPP = 10 # Maximum number of least squares iterations
+TOL_SPP = 1E-3 # Position update at which the solution has converged [m]
+
+
+def sagnac_rotate(pos, tau):
+    """
+    Rotate satellite positions at transmission into the ECEF frame at
+    reception.
+
+    arguments:
+        pos - (N, 3) ECEF satellite positions at transmission [m]
+        tau - (N,) signal travel time [s]
+
+    returns:
+        (N, 3) rotated positions [m]
+    """
+    theta = ephemeris.OMGE*tau
+    cos_t = np.cos(theta)
+    sin_t = np.sin(theta)
+    return np.column_stack([pos[:, 0]*cos_t + pos[:, 1]*sin_t,
+                            -pos[:, 0]*sin_t + pos[:, 1]*cos_t,
+                            pos[:, 2]])
+
+
+def elevation(rx_pos, sat_pos):
+    """
+    Elevation of satellites seen from a receiver, on a spherical Earth.
+
+    arguments:
+        rx_pos - (3,) receiver ECEF position [m]
+        sat_pos - (N, 3) satellite ECEF positions [m]
+
+    returns:
+        (N,) elevation [rad]
+    """
+    los = sat_pos - rx_pos
+    up = rx_pos/np.linalg.norm(rx_pos)
+    return np.arcsin(los @ up/np.linalg.norm(los, axis=1))
+
+
+class SppSolver:
+    """
+    Least squares single point positioning of a receiver, one raw data
+    (F5h) epoch at a time.
+
+    Satellite orbits are evaluated once per epoch at the time of
+    transmission, corrected for the satellite clock offset. The
+    iterations only update the Sagnac rotation and the geometry, all
+    satellites at once. Every epoch starts from the
+    previous solution so it converges in one or two iterations, and the
+    compiled orbit batches are reused while the tracked satellites and
+    their ephemerides do not change.
+    """
+
+    def __init__(self, store, elevation_mask=10.0):
+        """
+        arguments:
+            store - EphemerisStore with the ephemerides
+            elevation_mask - lowest satellite elevation used [deg]
+        """
+        self.store = store
+        self.elevation_mask = np.radians(elevation_mask)
+        self.state = np.zeros(5) # x, y, z [m], GPS clock [m], GLONASS clock [m]
+        self._batches = {}
+
+    def _orbits(self, system, prns, t):
+        """
+        Compiled orbit batch of satellites, rebuilt only when a satellite
+        or ephemeris changes.
+
+        returns:
+            orbit batch and a mask of the satellites with ephemerides
+        """
+        found = [self.store.lookup(system, prn, t) for prn in prns]
+        mask = np.array([f is not None for f in found], dtype=bool)
+        key = tuple([(prn, f[0], f[1]) for prn, f in zip(prns, found)
+                     if f is not None])
+        batch = self._batches.get(system)
+        if batch is not None and batch[0] == key:
+            return batch[1], mask
+        if len(key) == 0:
+            return None, mask
+
+        ephs = [self.store.get(system, prn, t_ref) for prn, issue, t_ref in key]
+        if system == ephemeris.GPS:
+            orbit = ephemeris.GpsOrbit(ephemeris.stack_ephemerides(ephs))
+        else:
+            orbit = ephemeris.GlonassOrbit(ephemeris.stack_ephemerides(
+                ephs, ephemeris.GLONASS_ORBIT_FIELDS))
+        self._batches[system] = (key, orbit)
+        return orbit, mask
+
+    def solve(self, raw):
+        """
+        Solve the receiver position of a raw data epoch.
+
+        Time + GPS time shift is taken as GPS time of week and
+        Time + GLO time shift as GLONASS time of day.
+
+        arguments:
+            raw - raw data dictionary from binr.process_raw_data or
+                  binr.process_raw_data_arrays
+
+        returns:
+            dictionary with
+                "Position" - (3,) ECEF position [m]
+                "Clock Bias" - receiver clock bias to GPS time [s]
+                "GLONASS Clock Offset" - GLONASS minus GPS clock bias [s]
+                "Satellites" - (N, 2) system and number of the used satellites
+                "Satellite Positions" - (N, 3) ECEF positions at reception [m]
+                "Residuals" - (N,) pseudorange residuals [m]
+                "Iterations" - number of least squares iterations
+        raises:
+            ValueError - if there are too few satellites
+        """
+        signal = np.asarray(raw["Signal Type"])
+        sat_no = np.asarray(raw["Sat Number"])
+        prng = np.asarray(raw["Pseudo Range"], dtype=np.float64)
+        flags = np.asarray(raw["Flags"])
+        usable = (flags & PSEUDORANGE_FLAGS) == PSEUDORANGE_FLAGS
+
+        # Satellite positions and clocks at transmission, per system
+        sat_pos = []
+        sat_clk = []
+        pr = []
+        systems = []
+        numbers = []
+        for system, signal_type, shift in [
+                (ephemeris.GPS, binr.SIGNAL_GPS, "GPS time shift"),
+                (ephemeris.GLONASS, binr.SIGNAL_GLONASS, "GLO time shift")]:
+            select = usable & (signal == signal_type)
+            if not np.any(select):
+                continue
+            t_rx = (raw["Time"] + raw[shift])/1000
+            if system == ephemeris.GLONASS:
+                t_rx = t_rx % 86400
+            orbit, mask = self._orbits(system, sat_no[select].tolist(), t_rx)
+            if orbit is None:
+                continue
+            sys_prng = prng[select][mask]
+            t_tx = t_rx - sys_prng/1000
+
+            # The pseudorange includes the satellite clock offset, so the
+            # orbit is evaluated again at the transmission time in system time
+            clk, dt_r = orbit.position(t_tx)[1:]
+            pos, clk, dt_r = orbit.position(t_tx - clk - dt_r)
+            clk = clk + dt_r
+            if system == ephemeris.GPS:
+                clk = clk - orbit.T_GD
+            sat_pos.append(pos)
+            sat_clk.append(clk)
+            pr.append(sys_prng/1000*ephemeris.C)
+            systems.append(np.full(len(sys_prng), system))
+            numbers.append(sat_no[select][mask])
+        if len(pr) == 0:
+            raise ValueError("No satellites with ephemerides")
+        sat_pos = np.concatenate(sat_pos)
+        corrected = np.concatenate(pr) + np.concatenate(sat_clk)*ephemeris.C
+        systems = np.concatenate(systems)
+        numbers = np.concatenate(numbers)
+        glonass = (systems == ephemeris.GLONASS).astype(np.float64)
+
+        # Elevation mask, once a position is known
+        state = self.state.copy()
+        if np.linalg.norm(state[:3]) > 1E6:
+            keep = elevation(state[:3], sat_pos) >= self.elevation_mask
+            sat_pos = sat_pos[keep]
+            corrected = corrected[keep]
+            systems = systems[keep]
+            numbers = numbers[keep]
+            glonass = glonass[keep]
+
+        # Drop the GLONASS clock when there are no GLONASS satellites
+        columns = 5 if np.any(glonass) else 4
+        if len(corrected) < columns:
+            raise ValueError("Not enough satellites: "+str(len(corrected)))
+
+        # Iterative least squares
+        H = np.empty((len(corrected), columns))
+        H[:, 3] = 1
+        if columns == 5:
+            H[:, 4] = glonass
+        for iteration in range(1, MAX_ITER_SPP+1):
+            rx = state[:3]
+            rng = np.linalg.norm(sat_pos - rx, axis=1)
+            rotated = sagnac_rotate(sat_pos, rng/ephemeris.C)
+            los = rotated - rx
+            rng = np.linalg.norm(los, axis=1)
+            residuals = corrected - rng - state[3] - state[4]*glonass
+            H[:, :3] = -los/rng[:, None]
+            dx = np.linalg.lstsq(H, residuals, rcond=None)[0]
+            state[:columns] = state[:columns] + dx
+            if np.linalg.norm(dx[:3]) < TOL_SPP:
+                break
+        residuals = residuals - H @ dx
+
+        self.state = state
+        return {"Position":state[:3].copy(),
+                "Clock Bias":state[3]/ephemeris.C,
+                "GLONASS Clock Offset":state[4]/ephemeris.C,
+                "Satellites":np.column_stack([systems, numbers]),
+                "Satellite Positions":rotated,
+                "Residuals":residuals,
+                "Iterations":iteration}
+
+
+def _ephemeris_snapshot(ephs, t_start, t_stop, max_age):
+    """
+    Ephemerides that can serve some epoch in a time window.
+
+    arguments:
+        ephs - F7h layout array of one system
+        t_start, t_stop - window in the reference time scale of the system [s]
+        max_age - largest |t - reference time| served [s]
+    returns:
+        list of ephemeris dictionaries
+    """
+    if len(ephs) == 0:
+        return []
+    system = int(ephs["System"][0])
+    period = ephemeris.REF_TIME_PERIOD[system]
+    t_ref = ephs["t_0e" if system == ephemeris.GPS else "t_b"]/1000
+    centre = (t_start + t_stop)/2
+    dist = t_ref - centre
+    dist = np.abs(dist - period*np.round(dist/period))
+    keep = np.flatnonzero(dist <= max_age + (t_stop - t_start)/2)
+    return [dict([(name, ephs[name][i].item()) for name in ephs.dtype.names])
+            for i in keep]
+
+
+def _solve_chunk(job):
+    """
+    Solve a chunk of epochs with a cold started solver. Runs in a worker
+    process, so everything it needs is in the job.
+
+    arguments:
+        job - (epochs, observations, epoch_index, ephemerides, elevation_mask)
+    returns:
+        SOLUTION_DTYPE array, NaN positions where an epoch could not be solved
+    """
+    epochs, obs, epoch_index, ephs, elevation_mask = job
+    store = ephemeris.EphemerisStore(max_per_sat=len(ephs)+1)
+    for eph in ephs:
+        store.add(eph)
+    solver = SppSolver(store, elevation_mask)
+
+    solutions = np.zeros(len(epochs), dtype=SOLUTION_DTYPE)
+    for name in ["X", "Y", "Z", "Clock Bias", "GLONASS Clock Offset", "RMS"]:
+        solutions[name] = np.nan
+    solutions["Time"] = epochs["Time"]
+    bounds = np.searchsorted(epoch_index, np.arange(len(epochs)+1))
+    for i in range(len(epochs)):
+        channels = obs[bounds[i]:bounds[i+1]]
+        raw = {"Time":epochs["Time"][i],
+               "GPS time shift":epochs["GPS time shift"][i],
+               "GLO time shift":epochs["GLO time shift"][i],
+               "Signal Type":channels["Signal Type"],
+               "Sat Number":channels["Sat Number"],
+               "Pseudo Range":channels["Pseudo Range"],
+               "Flags":channels["Flags"]}
+        try:
+            solution = solver.solve(raw)
+        except ValueError:
+            continue # Not enough satellites
+        solutions[i]["X"], solutions[i]["Y"], solutions[i]["Z"] = solution["Position"]
+        solutions[i]["Clock Bias"] = solution["Clock Bias"]
+        solutions[i]["GLONASS Clock Offset"] = solution["GLONASS Clock Offset"]
+        solutions[i]["Satellites"] = len(solution["Residuals"])
+        solutions[i]["RMS"] = np.sqrt(np.mean(solution["Residuals"]**2))
+        solutions[i]["Iterations"] = solution["Iterations"]
+    return solutions
+
+
+def solve_recording(recording, workers=None, chunk_size=CHUNK_SIZE,
+                    elevation_mask=10.0):
+    """
+    Position every raw data epoch of a recording.
+
+    The epochs are split into chunks that are solved in parallel in a
+    process pool. Each chunk is sent with only the ephemerides that can
+    serve its time window and starts its solver cold, which costs a few
+    extra iterations on its first epoch. The results are merged in
+    recording order.
+
+    arguments:
+        recording - dictionary from binr.load_recording, or a filename
+        workers - number of processes, None for one per CPU, 1 to solve
+                  in this process
+        chunk_size - epochs per job
+        elevation_mask - lowest satellite elevation used [deg]
+    returns:
+        SOLUTION_DTYPE array, one row per epoch
+    """
+    if isinstance(recording, str):
+        recording = binr.load_recording(recording)
+    epochs = recording["Epochs"]
+    obs = recording["Observations"]
+    epoch_index = recording["Epoch Index"]
+
+    # Split into jobs
+    jobs = []
+    obs_bounds = np.searchsorted(epoch_index, np.arange(0, len(epochs)+chunk_size, chunk_size))
+    for n, start in enumerate(range(0, len(epochs), chunk_size)):
+        chunk = epochs[start:start+chunk_size]
+        gps_t = (chunk["Time"] + chunk["GPS time shift"])/1000
+        glo_t = ((chunk["Time"] + chunk["GLO time shift"])/1000) % 86400
+        ephs = (_ephemeris_snapshot(recording["GPS Ephemeris"], gps_t.min(), gps_t.max(),
+                                    ephemeris.MAX_EPHEMERIS_AGE[ephemeris.GPS]) +
+                _ephemeris_snapshot(recording["GLONASS Ephemeris"], glo_t.min(), glo_t.max(),
+                                    ephemeris.MAX_EPHEMERIS_AGE[ephemeris.GLONASS]))
+        channels = slice(obs_bounds[n], obs_bounds[n+1])
+        jobs.append((chunk, obs[channels], epoch_index[channels] - start,
+                     ephs, elevation_mask))
+
+    if len(jobs) == 0:
+        return np.zeros(0, dtype=SOLUTION_DTYPE)
+    if workers == 1:
+        return np.concatenate([_solve_chunk(job) for job in jobs])
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        return np.concatenate(list(pool.map(_solve_chunk, jobs)))
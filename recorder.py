@@ -0,0 +1,259 @@
+"""
+Recording of receiver serial streams to disk.
+
+Every receiver gets a reader thread that only pulls bytes off the serial
+port and a writer thread that does all the file work, connected by a
+bounded queue. The reader never waits on the disk, so the OS serial
+buffer is emptied as fast as the bytes arrive. Next to every recording
+a sidecar keeps the host monotonic time each chunk was read. Recordings
+rotate between BINR frames, so every file decodes on its own.
+"""
+
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+READ_SIZE = 4096 # Largest read from a stream [bytes]
+QUEUE_CHUNKS = 4096 # Chunks buffered between the reader and writer
+WRITE_BUFFER = 1 << 20 # File write buffer [bytes]
+FLUSH_INTERVAL = 1.0 # Time between flushes to disk [s]
+MAX_FILE_BYTES = 1 << 30 # Rotate recordings at this size [bytes]
+MAX_FILE_SECONDS = 3600 # Rotate recordings after this time [s]
+MAX_FRAME_BYTES = 1 << 16 # Rotate anyway when no frame ends within this [bytes]
+
+DLE = 0x10
+ETX = 0x03
+
+# Sidecar record, one per chunk read from the stream
+TIMESTAMP_DTYPE = np.dtype([("Host Time", '<i8'), # time.monotonic_ns() after the read [ns]
+                            ("Offset", '<i8'), # Offset of the chunk in the recording [bytes]
+                            ("Length", '<u4')]) # [bytes]
+TIMESTAMP_SUFFIX = ".ts"
+
+
+def timestamp_filename(filename):
+    """
+    Name of the timestamp sidecar of a recording.
+    """
+    return filename + TIMESTAMP_SUFFIX
+
+
+def load_timestamps(filename):
+    """
+    Read the timestamp sidecar of a recording.
+
+    returns:
+        TIMESTAMP_DTYPE array
+    """
+    return np.fromfile(timestamp_filename(filename), dtype=TIMESTAMP_DTYPE)
+
+
+def _odd_dles(data, end, odd):
+    """
+    True if an odd number of DLE bytes comes right before end, odd being
+    the parity of the DLE bytes that end the stream before data.
+    """
+    run = end - len(data[:end].rstrip(bytes([DLE])))
+    if run == end:
+        return odd != (run % 2 == 1)
+    return run % 2 == 1
+
+
+def frame_end(data, odd):
+    """
+    Position right after the first frame that ends in data. A frame ends
+    with an ETX after an odd number of DLE bytes, doubled DLE bytes being
+    data.
+
+    arguments:
+        data - bytes that continue the stream
+        odd - parity of the DLE bytes that end the stream before data
+    returns:
+        position after the ETX, None if no frame ends in data
+    """
+    i = data.find(bytes([ETX]))
+    while i >= 0:
+        if _odd_dles(data, i, odd):
+            return i + 1
+        i = data.find(bytes([ETX]), i + 1)
+    return None
+
+
+def read_stream(stream, chunks, running):
+    """
+    Reader thread, moves chunks from the stream to the queue until
+    running is cleared, then queues None.
+    """
+    while running.is_set():
+        chunk = stream.read(min(max(stream.in_waiting, 1), READ_SIZE))
+        if chunk:
+            chunks.put((time.monotonic_ns(), chunk))
+    chunks.put(None)
+
+
+class RecordingWriter:
+    """
+    Writes queued chunks to rotating recordings with timestamp sidecars.
+    """
+
+    def __init__(self, prefix, max_bytes=MAX_FILE_BYTES, max_seconds=MAX_FILE_SECONDS):
+        """
+        arguments:
+            prefix - path and name start of the recordings
+            max_bytes - rotate at this size [bytes]
+            max_seconds - rotate after this time [s]
+        """
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.filenames = []
+        self.total = 0
+        self._file = None
+        self._sidecar = None
+        self._odd = False # Odd number of DLE bytes at the end of the stream
+        self._between = True # Stream ends between frames
+
+    def _open(self):
+        """
+        Start the next recording.
+        """
+        self.close()
+        filename = (self.prefix + "_" + time.strftime("%Y%m%d_%H%M%S") +
+                    "_" + str(len(self.filenames)).zfill(4) + ".dat")
+        self._file = open(filename, 'wb', buffering=WRITE_BUFFER)
+        self._sidecar = open(timestamp_filename(filename), 'wb', buffering=WRITE_BUFFER)
+        self._size = 0
+        self._due = None # Size when rotation became due [bytes]
+        self._opened = time.monotonic()
+        self._flushed = self._opened
+        self.filenames.append(filename)
+
+    def write(self, host_time, chunk):
+        """
+        Write a chunk and its timestamp. When a rotation is due the next
+        recording starts after the frame being written ends.
+        """
+        now = time.monotonic()
+        if self._file is None:
+            self._open()
+        elif (self._due is None and (self._size >= self.max_bytes or
+                                     now - self._opened >= self.max_seconds)):
+            self._due = self._size
+        if self._due is not None:
+            end = 0 if self._between else frame_end(chunk, self._odd)
+            if end is None and self._size - self._due >= MAX_FRAME_BYTES:
+                end = 0 # Not a BINR stream
+            if end is not None:
+                self._write(host_time, chunk[:end], now)
+                self._open()
+                chunk = chunk[end:]
+        self._write(host_time, chunk, now)
+
+    def _write(self, host_time, chunk, now):
+        if len(chunk) == 0:
+            return
+        record = np.array((host_time, self._size, len(chunk)), dtype=TIMESTAMP_DTYPE)
+        self._file.write(chunk)
+        self._sidecar.write(record.tobytes())
+        self._size += len(chunk)
+        self.total += len(chunk)
+        self._between = chunk[-1] == ETX and _odd_dles(chunk, len(chunk) - 1, self._odd)
+        self._odd = _odd_dles(chunk, len(chunk), self._odd)
+        if now - self._flushed >= FLUSH_INTERVAL:
+            self._file.flush()
+            self._sidecar.flush()
+            self._flushed = now
+
+    def run(self, chunks):
+        """
+        Writer thread, writes queued chunks until None is queued.
+        """
+        try:
+            while True:
+                item = chunks.get()
+                if item is None:
+                    break
+                self.write(*item)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._sidecar.close()
+            self._file = None
+            self._sidecar = None
+
+
+class Recorder:
+    """
+    Records several receivers at once, each with its own reader and
+    writer thread.
+    """
+
+    def __init__(self, streams, directory=".", max_bytes=MAX_FILE_BYTES,
+                 max_seconds=MAX_FILE_SECONDS, queue_chunks=QUEUE_CHUNKS):
+        """
+        arguments:
+            streams - {name: stream}, the name starts the recording names
+            directory - where the recordings go
+            max_bytes - rotate at this size [bytes]
+            max_seconds - rotate after this time [s]
+            queue_chunks - chunks buffered per receiver
+        """
+        self.streams = streams
+        self.writers = dict([(name, RecordingWriter(os.path.join(directory, name),
+                                                    max_bytes, max_seconds))
+                             for name in streams])
+        self.queues = dict([(name, queue.Queue(queue_chunks)) for name in streams])
+        self.errors = {} # Exceptions that stopped writers
+        self._running = dict([(name, threading.Event()) for name in streams])
+        self._threads = []
+
+    def start(self):
+        for name, stream in self.streams.items():
+            self._running[name].set()
+            self._threads.append(threading.Thread(
+                target=read_stream, args=(stream, self.queues[name], self._running[name]),
+                name=name+" reader", daemon=True))
+            self._threads.append(threading.Thread(
+                target=self._write, args=(name,), name=name+" writer", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _write(self, name):
+        """
+        Writer thread of a receiver. When writing fails the receiver stops
+        reading, and the queue is emptied so the reader is not blocked.
+        """
+        try:
+            self.writers[name].run(self.queues[name])
+        except Exception as e:
+            self.errors[name] = e
+            self._running[name].clear()
+            while self.queues[name].get() is not None:
+                pass
+
+    def stop(self):
+        """
+        Stop reading, write out everything read and close the recordings.
+
+        raises:
+            the exception of a writer that failed
+        """
+        for running in self._running.values():
+            running.clear()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if len(self.errors) > 0:
+            raise list(self.errors.values())[0]
+
+    def status(self):
+        """
+        Bytes written and chunks waiting in the queue of every receiver.
+        """
+        return dict([(name, (self.writers[name].total, self.queues[name].qsize()))
+                     for name in self.streams])
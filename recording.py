@@ -0,0 +1,207 @@
+"""
+Random access into recorded BINR streams.
+
+A frame index is stored next to every recording so analyses can jump
+straight to a time window or message type instead of replaying the
+recording from the first byte.
+"""
+
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+import binr
+
+# Index record, one per frame in the recording
+INDEX_DTYPE = np.dtype([("Offset", '<i8'), # Index of the opening DLE [bytes]
+                        ("Length", '<u4'), # Frame length with framing bytes [bytes]
+                        ("ID", 'u1'), # Message ID
+                        ("Time", '<f8')]) # Latest raw data time, UTC [ms]
+INDEX_SUFFIX = ".idx"
+FINGERPRINT_BYTES = 4096 # Leading bytes of the recording checksummed in the sidecar
+
+_RAW_TIME = struct.Struct('<d')
+
+
+def index_filename(filename):
+    """
+    Name of the index sidecar of a recording.
+    """
+    return filename + INDEX_SUFFIX
+
+
+def build_index(buffer, pos=0, time=np.nan):
+    """
+    Index every frame in a buffer.
+
+    Frames other than raw data (F5h) carry the time of the latest raw
+    data message before them so time windows include their ephemerides.
+
+    arguments:
+        buffer - bytes or mmap containing BINR data
+        pos - index to start scanning from
+        time - receiver time to carry into the first frames [ms]
+    returns:
+        INDEX_DTYPE array
+    """
+    offsets, lengths, frames = binr.scan_frames(buffer, pos)
+    index = np.zeros(len(frames), dtype=INDEX_DTYPE)
+    index["Offset"] = offsets
+    index["Length"] = lengths
+    times = index["Time"]
+    for i, frame in enumerate(frames):
+        if frame["ID"] == 0xF5 and len(frame["data"]) >= _RAW_TIME.size:
+            time = _RAW_TIME.unpack_from(frame["data"])[0]
+        index["ID"][i] = frame["ID"]
+        times[i] = time
+    return index
+
+
+class RecordingIndex:
+    """
+    Frame index of a recording, kept in a sidecar file. The sidecar is
+    created on first use and extended when the recording has grown. It
+    also keeps the size and checksums of the indexed part, so a
+    recording that was replaced is indexed again.
+    """
+
+    def __init__(self, filename, rebuild=False):
+        """
+        arguments:
+            filename - path to the recorded .dat file
+            rebuild - ignore an existing sidecar and index from scratch
+        """
+        self.filename = filename
+        self.index_filename = index_filename(filename)
+        self.frames = self._load(rebuild)
+
+        # Times never decrease after the first raw data, unless the
+        # recording crosses the week rollover
+        times = self.frames["Time"]
+        timed = np.flatnonzero(~np.isnan(times))
+        self._first_time = int(timed[0]) if len(timed) > 0 else len(times)
+        self._sorted = bool(np.all(np.diff(times[self._first_time:]) >= 0))
+
+    def _fingerprint(self, buffer, index):
+        """
+        Size and checksums of the first bytes and the last frame of the
+        indexed part of a recording.
+        """
+        if len(index) == 0:
+            return np.zeros(3, dtype=np.int64)
+        offset = int(index["Offset"][-1])
+        end = offset + int(index["Length"][-1])
+        return np.array([end, zlib.crc32(buffer[:min(FINGERPRINT_BYTES, end)]),
+                         zlib.crc32(buffer[offset:end])], dtype=np.int64)
+
+    def _load(self, rebuild):
+        """
+        Load the sidecar, extending or rebuilding it when it does not
+        match the recording.
+        """
+        size = os.path.getsize(self.filename)
+        index = np.zeros(0, dtype=INDEX_DTYPE)
+        fingerprint = np.zeros(3, dtype=np.int64)
+        if not rebuild and os.path.exists(self.index_filename):
+            try:
+                sidecar = np.load(self.index_filename)
+                if isinstance(sidecar, np.lib.npyio.NpzFile): # Else an older sidecar
+                    with sidecar:
+                        index = sidecar["frames"]
+                        fingerprint = sidecar["fingerprint"]
+            except (ValueError, KeyError, OSError):
+                pass # Damaged sidecar
+            if index.dtype != INDEX_DTYPE:
+                index = np.zeros(0, dtype=INDEX_DTYPE)
+
+        with open(self.filename, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+            try:
+                # Recording shrank or was replaced, start over
+                end = int(fingerprint[0]) if len(index) > 0 else 0
+                if end > size or not np.array_equal(self._fingerprint(buffer, index),
+                                                    fingerprint):
+                    index = np.zeros(0, dtype=INDEX_DTYPE)
+                    end = 0
+                if len(index) > 0 and end == size:
+                    return index
+
+                # Index the frames after the last indexed one
+                time = np.nan
+                if len(index) > 0:
+                    time = index["Time"][-1]
+                new = np.zeros(0, dtype=INDEX_DTYPE)
+                if size > end:
+                    new = build_index(buffer, end, time)
+                if len(new) == 0 and len(index) > 0:
+                    return index # Only a partial frame was added
+                index = np.concatenate([index, new])
+                fingerprint = self._fingerprint(buffer, index)
+            finally:
+                if isinstance(buffer, mmap.mmap):
+                    buffer.close()
+
+        # Replace the sidecar in one step so readers never see half of it
+        with open(self.index_filename+".tmp", 'wb') as f:
+            np.savez(f, frames=index, fingerprint=fingerprint)
+        try:
+            os.replace(self.index_filename+".tmp", self.index_filename)
+        except OSError:
+            os.remove(self.index_filename+".tmp") # Sidecar in use, index this time only
+        return index
+
+    def __len__(self):
+        return len(self.frames)
+
+    def select(self, message_id=None, start=None, stop=None):
+        """
+        Find frames by message ID and receiver time window.
+
+        arguments:
+            message_id - message ID or list of IDs, None for all
+            start - first receiver time to include [ms], None for no limit
+            stop - receiver time to stop before [ms], None for no limit
+        returns:
+            array of frame numbers in recording order
+        """
+        times = self.frames["Time"]
+        if (start is None and stop is None) or not self._sorted:
+            mask = np.ones(len(self.frames), dtype=bool)
+            if start is not None:
+                mask &= times >= start
+            if stop is not None:
+                mask &= times < stop
+            rows = np.flatnonzero(mask)
+        else:
+            # Binary search of the window, frames before the first raw
+            # data have no time
+            timed = times[self._first_time:]
+            first = 0 if start is None else np.searchsorted(timed, start, side='left')
+            last = len(timed) if stop is None else np.searchsorted(timed, stop, side='left')
+            rows = self._first_time + np.arange(first, max(first, last))
+        if message_id is not None:
+            rows = rows[np.isin(self.frames["ID"][rows], message_id)]
+        return rows
+
+    def read(self, rows):
+        """
+        Read frames from the recording.
+
+        arguments:
+            rows - frame numbers, as returned by select
+        returns:
+            list[{ID, data}] with unstuffed data
+        """
+        frames = []
+        rows = np.asarray(rows)
+        if len(rows) == 0:
+            return frames
+        with open(self.filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                for row in rows:
+                    offset = int(self.frames["Offset"][row])
+                    length = int(self.frames["Length"][row])
+                    frames.append({"ID":buffer[offset+1],
+                                   "data":binr.unstuff(buffer[offset+2:offset+length-2])})
+        return frames
@@ -0,0 +1,259 @@
+"""
+Replay of BINR recordings through the read API of a serial port.
+
+A ReplaySerial releases the bytes of a recording at the pace they were
+received, frame by frame at the receiver time of every frame, or chunk by
+chunk at the host times kept by the recorder. The pace can be real time,
+N times faster or as fast as the reader can go. Replays that share a
+ReplayClock stay in step, so a base and rover recording replay together
+as if both receivers were connected.
+"""
+
+import mmap
+import os
+import threading
+import time
+import numpy as np
+import alignment
+import recorder
+import recording
+
+FAST = None # Speed to replay as fast as possible
+
+
+class ReplayClock:
+    """
+    Recording time of the replays that share it. The clock starts on the
+    first read from any of them.
+    """
+
+    def __init__(self, speed=1.0):
+        """
+        arguments:
+            speed - recording seconds per wall clock second, FAST for no pacing
+        """
+        self.speed = speed
+        self.origin = np.inf # Recording time at the start [s]
+        self._start = None
+        self._lock = threading.Lock()
+
+    def add(self, t):
+        """
+        Start from the first recording time of a replay if it is earlier.
+        """
+        with self._lock:
+            self.origin = min(self.origin, t)
+
+    def start(self):
+        with self._lock:
+            if self._start is None:
+                self._start = time.monotonic()
+
+    def now(self):
+        """
+        Current recording time [s].
+        """
+        if self.speed is FAST:
+            return np.inf
+        if self._start is None:
+            return self.origin
+        return self.origin + (time.monotonic() - self._start)*self.speed
+
+    def wait(self, t):
+        """
+        Wall clock time until a recording time [s].
+        """
+        return max((t - self.now())/self.speed, 0.0)
+
+
+def receiver_schedule(data):
+    """
+    Release of the recording frame by frame at the receiver time of the
+    latest raw data message.
+
+    returns:
+        ends - byte offset up to which every release goes
+        times - recording time of every release [s]
+    """
+    index = recording.build_index(data)
+    ends = index["Offset"] + index["Length"]
+    times = index["Time"]/1000
+    finite = np.isfinite(times)
+    if not np.any(finite):
+        return np.array([len(data)]), np.zeros(1)
+    # Unwrap the week rollover, frames before the first raw data go with it
+    steps = np.diff(times[finite])
+    steps = steps - alignment.WEEK*np.round(steps/alignment.WEEK)
+    times[finite] = times[finite][0] + np.concatenate([[0], np.cumsum(steps)])
+    times[:np.argmax(finite)] = times[finite][0]
+    times = np.fmax.accumulate(times)
+    return np.append(ends, len(data)), np.append(times, times[-1])
+
+
+def host_schedule(filename):
+    """
+    Release of the recording chunk by chunk at the host times of the
+    recorder timestamp sidecar.
+
+    returns:
+        ends - byte offset up to which every release goes
+        times - recording time of every release [s]
+    """
+    stamps = recorder.load_timestamps(filename)
+    ends = stamps["Offset"] + stamps["Length"].astype(np.int64)
+    return ends, np.maximum.accumulate(stamps["Host Time"]/1E9)
+
+
+class ReplaySerial:
+    """
+    Read only stand in for serial.Serial that replays a recording. Writes
+    are accepted and ignored, so commands sent to a receiver do no harm.
+    """
+
+    def __init__(self, filename, speed=1.0, clock=None, timeout=0.5, timing="receiver"):
+        """
+        arguments:
+            filename - recorded .dat file
+            speed - recording seconds per wall clock second, FAST for no
+                    pacing, ignored when a clock is given
+            clock - ReplayClock shared with other replays
+            timeout - read timeout like serial.Serial, None to block [s]
+            timing - "receiver" for receiver times or "host" for the
+                     recorder timestamp sidecar
+        """
+        self.port = filename
+        self.timeout = timeout
+        self.clock = clock if clock is not None else ReplayClock(speed)
+        self._file = open(filename, 'rb')
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b''
+        if timing == "receiver":
+            self._ends, self._times = receiver_schedule(self._data)
+        elif timing == "host":
+            self._ends, self._times = host_schedule(filename)
+        else:
+            raise ValueError("Unknown timing: "+str(timing))
+        self.clock.add(self._times[0] if len(self._times) > 0 else 0.0)
+        self._pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def is_open(self):
+        return self._file is not None
+
+    @property
+    def finished(self):
+        """
+        True when every byte of the recording was read.
+        """
+        return self._pos >= len(self._data)
+
+    def _released(self):
+        """
+        Bytes released up to the current recording time, and the recording
+        time of the next release.
+        """
+        i = np.searchsorted(self._times, self.clock.now(), side='right')
+        released = int(self._ends[i-1]) if i > 0 else 0
+        if i < len(self._times):
+            return released, self._times[i]
+        return len(self._data), np.inf
+
+    @property
+    def in_waiting(self):
+        self.clock.start()
+        return self._released()[0] - self._pos
+
+    def _wait_for(self, ready):
+        """
+        Wait until ready(released) or the timeout, like a serial port
+        that goes quiet after the end of the recording.
+
+        returns:
+            bytes released
+        """
+        self.clock.start()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            released, next_time = self._released()
+            if ready(released):
+                return released
+            remaining = np.inf if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return released
+            pause = min(remaining, self.clock.wait(next_time)) if self.clock.speed else remaining
+            time.sleep(min(pause, 1.0) if np.isfinite(pause) else 1.0)
+
+    def read(self, size=1):
+        """
+        Read size bytes, returning fewer when the timeout runs out.
+        """
+        released = self._wait_for(lambda released: released - self._pos >= size)
+        data = self._data[self._pos:min(self._pos + size, released)]
+        self._pos += len(data)
+        return bytes(data)
+
+    def read_until(self, expected=b'\n', size=None):
+        """
+        Read up to and including expected, or size bytes, returning what
+        was read when the timeout runs out.
+        """
+        def stop(released):
+            end = self._data.find(expected, self._pos, released)
+            if end >= 0:
+                return min(end + len(expected), released)
+            if size is not None and released - self._pos >= size:
+                return self._pos + size
+            return None
+        released = self._wait_for(lambda released: stop(released) is not None)
+        end = stop(released)
+        if end is None:
+            end = released
+        if size is not None:
+            end = min(end, self._pos + size)
+        data = self._data[self._pos:end]
+        self._pos += len(data)
+        return bytes(data)
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        """
+        Drop the bytes released so far.
+        """
+        self._pos = max(self._pos, self._released()[0])
+
+    def close(self):
+        if self._file is not None:
+            if isinstance(self._data, mmap.mmap):
+                self._data.close()
+            self._file.close()
+            self._file = None
+
+
+def open_replays(filenames, speed=1.0, timeout=0.5, timing="receiver"):
+    """
+    Replay several recordings in step, for example a base and a rover.
+
+    arguments:
+        filenames - {name: recorded .dat file}
+        speed - recording seconds per wall clock second, FAST for no pacing
+        timeout - read timeout [s]
+        timing - "receiver" or "host"
+    returns:
+        {name: ReplaySerial} sharing one ReplayClock
+    """
+    clock = ReplayClock(speed)
+    return dict([(name, ReplaySerial(filename, clock=clock, timeout=timeout, timing=timing))
+                 for name, filename in filenames.items()])
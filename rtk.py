@@ -6,122 +6,119 @@ Makespace Cambridge
 July 2018
 """
 
+import asyncio
 import serial
+import numpy as np
+import alignment
+import ambiguity
 import binr
-import time
-import numpy as np 
-
-Nc = 28 # Number of raw data channels
-T_IDX = 0 # Time index
-C_IDX = 1 # Carrier index
-P_IDX = 2 # Pseudorange index
-SNR_IDX = 3 # Signal to noise index
-
-rover_obs = np.zeros((Nc, 4))
-base_obs = np.zeros((Nc, 4))
-
-# Define input streams
-rover_stream = serial.Serial("COM5", 115200, parity=serial.PARITY_ODD, timeout=0.5)
-base_stream = serial.Serial("COM6", 115200, parity=serial.PARITY_ODD, timeout=0.5)
-
-# Main loop
-while True:
-    rover_obs = np.zeros((Nc, 4))
-    base_obs = np.zeros((Nc, 4))
-
-    # Get messages from base and rover
-    print("Checking for messages")
-    if rover_stream.in_waiting > 0:
-        # Read and process the messages
-        try:
-            rover_buffer = list(rover_stream.read_until(terminator='\x10\x03'))
-            rover_msg, rover_buffer = binr.process_msg(rover_buffer)
-            print("Rover message received. Unread buffer size: "+str(len(rover_buffer)))
-
-            # We are only interrested in observation and navigation messages
-            if rover_msg['ID'] == 0xF5: # observation message
-                rover_data = binr.process_raw_data(rover_msg["data"])
-
-                # Calculate obervable receiver time
-                t_rx = (rover_data["Time"] + rover_data["GPS time shift"])/1000
-                
-                # Loop through all channels
-                for i in range(len(rover_data["Carrier Phase"])):
-                    # Check if raw data is valid
-                    if (rover_data["Signal Type"][i] == binr.GPS and 
-                        rover_data["Flags"][i]&0b00011011 == 0b00011011): # Only handle GPS for now
-                        
-                        # Start adding information 
-                        sat_no = rover_data["Sat Number"][i]
-                        phase = rover_data["Carrier Phase"][i]
-                        prng = rover_data["Pseudo Range"][i]
-                        snr = rover_data["SNR"][i]
-                        rover_obs[sat_no,T_IDX] = t_rx
-                        rover_obs[sat_no,P_IDX] = prng
-                        rover_obs[sat_no,C_IDX] = phase  
-                        rover_obs[sat_no,SNR_IDX] = snr        
-
-            elif rover_msg['ID'] == 0xF7: # navigation message
-                rover_data = binr.process_extended_ephemeris_of_satellites(rover_msg["data"])
-            else:
-                print("Discarding unused message: "+str(hex(rover_msg['ID'])))
-        except ValueError:
-            print("No message found in rover buffer.")
-    if base_stream.in_waiting > 0:
-        # Read and process the messages
-        try:
-            base_buffer = list(base_stream.read_until(terminator='\x10\x03'))
-            base_msg, base_buffer = binr.process_msg(base_buffer)
-            print("base message received. Unread buffer size: "+str(len(base_buffer)))
-
-            # We are only interrested in observation and navigation messages
-            if base_msg['ID'] == 0xF5: # observation message
-                base_data = binr.process_raw_data(base_msg["data"])
-
-                # Calculate obervable receiver time
-                t_rx = (base_data["Time"] + base_data["GPS time shift"])/1000
-                
-                # Loop through all channels
-                for i in range(len(base_data["Carrier Phase"])):
-                    # Check if raw data is valid
-                    if (base_data["Signal Type"][i] == binr.GPS and 
-                        base_data["Flags"][i]&0b00011011 == 0b00011011): # Only handle GPS for now
-                        
-                        # Start adding information 
-                        sat_no = base_data["Sat Number"][i]
-                        phase = base_data["Carrier Phase"][i]
-                        prng = base_data["Pseudo Range"][i]
-                        snr = base_data["SNR"][i]
-                        base_obs[sat_no,T_IDX] = t_rx
-                        base_obs[sat_no,P_IDX] = prng
-                        base_obs[sat_no,C_IDX] = phase   
-                        base_obs[sat_no,SNR_IDX] = snr      
-
-            elif base_msg['ID'] == 0xF7: # navigation message
-                base_data = binr.process_extended_ephemeris_of_satellites(base_msg["data"])
-            else:
-                print("Discarding unused message: "+str(hex(base_msg['ID'])))
-        except ValueError:
-            print("No message found in base buffer.")
-
-    print("Observables Rover: ")  
-    for i in range(28):
-        if base_obs[i][0] != 0:
-            print(str(i)+" "+str(base_obs[i]))
-    print("Observables Base: ") 
-    for i in range(28):
-        if rover_obs[i][0] != 0:
-            print(str(i)+" "+str(rover_obs[i]))
-    time.sleep(0.5)
-
-    # Calculate single differentials
-
-    # Check common satellites
-
-    # Calculate double differentials
-
-    # Calculate float position
-
-    # Calculate residuals
-
-    # Try and solve integer ambiguity
\ No newline at end of file
+import differencing
+import ephemeris
+import ingest
+import kalman
+import positioning
+import replay
+import slips
+
+# Observations of the latest base and rover pair, indexed by satellite
+observations = {"rover":differencing.SatelliteObservations(),
+                "base":differencing.SatelliteObservations()}
+
+# Cycle slips of every receiver since the latest pair
+slip_detectors = {"rover":slips.CycleSlipDetector(), "base":slips.CycleSlipDetector()}
+slipped = set()
+
+# Pairs base and rover epochs measured at the same GPS time
+aligner = alignment.EpochAligner()
+
+# Ephemerides from both receivers
+ephemerides = ephemeris.EphemerisStore()
+
+# Single point solutions of both receivers and the float RTK filter,
+# started once the base has a position
+spp = {"rover":positioning.SppSolver(ephemerides),
+       "base":positioning.SppSolver(ephemerides)}
+float_rtk = None
+SIGNAL_TYPES = {ephemeris.GPS:binr.SIGNAL_GPS,
+                ephemeris.GLONASS:binr.SIGNAL_GLONASS}
+
+
+def satellite_positions(solution):
+    """
+    Satellite positions of a single point solution indexed by satellite.
+    """
+    sat_pos = np.zeros((differencing.NUM_SATS, 3))
+    signal = [SIGNAL_TYPES[system] for system in solution["Satellites"][:, 0]]
+    index = differencing.sat_index(signal, solution["Satellites"][:, 1])
+    sat_pos[index[index >= 0]] = solution["Satellite Positions"][index >= 0]
+    return sat_pos
+
+
+def handle_message(name, message_id, message):
+    """
+    Handle a decoded message from the base or rover as soon as it arrives.
+    """
+    global float_rtk
+    if message_id == 0xF5: # observation message
+        sats, reasons = slip_detectors[name].update(message)
+        slipped.update(sats.tolist())
+
+        for pair in aligner.add(name, message):
+            print("Epoch pair at "+str(pair["Time"])+", age "+str(pair["Age"]))
+
+            # Single point solutions give the satellite positions
+            try:
+                base_spp = spp["base"].solve(pair["Base"])
+                rover_spp = spp["rover"].solve(pair["Rover"])
+            except ValueError:
+                continue # Not enough ephemerides yet
+            if float_rtk is None:
+                float_rtk = kalman.FloatRtkFilter(base_spp["Position"])
+                float_rtk.initialize(rover_spp["Position"])
+            sat_pos = satellite_positions(base_spp)
+
+            # Calculate single and double differentials of common satellites
+            # with a known position
+            rover = observations["rover"].fill(pair["Rover"])
+            base = observations["base"].fill(pair["Base"])
+            base.valid &= np.any(sat_pos != 0, axis=1)
+            dd = differencing.double_differences(rover, base)
+            for sat, ref, phase, code in zip(dd["Satellites"], dd["Reference"],
+                                             dd["Phase"], dd["Code"]):
+                print(str(sat)+"-"+str(ref)+" phase "+str(phase)+" code "+str(code))
+
+            # Calculate float position
+            residuals = float_rtk.update(pair["Time"], dd, sat_pos, list(slipped))
+            slipped.clear()
+            if len(residuals) > 0:
+                print("Float baseline "+str(float_rtk.baseline)+
+                      " residual RMS "+str(np.sqrt(np.mean(residuals**2))))
+
+            # Try and solve integer ambiguity
+            a, Q, Q_ba = float_rtk.dd_ambiguities()
+            if len(a) > 0:
+                try:
+                    result = ambiguity.resolve(a, Q)
+                except ValueError:
+                    print("Float only, ambiguity covariance not positive definite")
+                    continue
+                if result["Accepted"]:
+                    print("Fixed baseline "+str(float_rtk.fixed_baseline(result["Fixed"]))+
+                          " ratio "+str(result["Ratio"]))
+
+    elif message_id == 0xF7: # navigation message
+        ephemerides.add(message)
+
+
+# Define input streams, or replay recordings of them in step
+replay_files = None # {"rover":"rover.dat", "base":"base.dat"}
+replay_speed = 10 # Times real time, replay.FAST for no pacing
+if replay_files is None:
+    streams = {"rover":serial.Serial("COM5", 115200, parity=serial.PARITY_ODD, timeout=0.5),
+               "base":serial.Serial("COM6", 115200, parity=serial.PARITY_ODD, timeout=0.5)}
+else:
+    streams = replay.open_replays(replay_files, replay_speed)
+
+# Main loop, reading both receivers concurrently
+receivers = ingest.Ingest(streams, handle_message)
+asyncio.run(receivers.run())
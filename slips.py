@@ -0,0 +1,146 @@
+"""
+Streaming cycle slip detection on raw data (F5h) epochs.
+
+Every epoch is checked for all channels at once against the state kept
+per satellite in arrays indexed by the global satellite index. Changes
+common to all satellites of a system, such as receiver clock jumps, are
+removed before testing so they are not taken for slips.
+"""
+
+import numpy as np
+import alignment
+import differencing
+import ephemeris
+
+# Slip reasons, combined as bits
+SLIP_DOPPLER = 0x01 # Phase jump against the Doppler prediction
+SLIP_PHASE_CODE = 0x02 # Phase minus code jump
+SLIP_LOCK = 0x04 # Phase tracking was lost and regained
+SLIP_HALF_CYCLE = 0x08 # Preamble detection changed, possible half cycle jump
+
+# Raw data flags
+FLAG_PHASE = 0x08 # Phase present
+FLAG_PREAMBLE = 0x20 # Preamble not detected
+TRACK_FLAGS = 0x09 # Signal present and phase present
+
+DOPPLER_THRESHOLD = 1.0 # Doppler predicted phase error [cycles]
+PMC_THRESHOLD = 5.0 # Smallest phase minus code jump [m]
+PMC_SIGMAS = 5.0 # Phase minus code jump in standard deviations
+PMC_MIN_EPOCHS = 5 # Epochs of phase minus code statistics before testing
+PMC_ALPHA = 0.1 # Phase minus code averaging weight
+MAX_GAP = 5.0 # Largest gap between epochs of a continuous arc [s]
+
+SYSTEMS = [slice(differencing.GPS_BASE, differencing.GPS_BASE+differencing.NUM_GPS),
+           slice(differencing.GLONASS_BASE, differencing.GLONASS_BASE+differencing.NUM_GLONASS),
+           slice(differencing.SBAS_BASE, differencing.SBAS_BASE+differencing.NUM_SBAS)]
+
+
+def _remove_common(values, sats, mask):
+    """
+    Subtract the median of every system from per satellite values.
+
+    arguments:
+        values - (N,) values of the satellites
+        sats - (N,) satellite indices
+        mask - (N,) values to use
+    returns:
+        (N,) values with the system medians removed
+    """
+    out = values.copy()
+    for system in SYSTEMS:
+        in_system = mask & (sats >= system.start) & (sats < system.stop)
+        if np.any(in_system):
+            out[in_system] -= np.median(values[in_system])
+    return out
+
+
+class CycleSlipDetector:
+    """
+    Detects cycle slips of one receiver, one raw data epoch at a time.
+    """
+
+    def __init__(self, doppler_threshold=DOPPLER_THRESHOLD,
+                 pmc_threshold=PMC_THRESHOLD, max_gap=MAX_GAP):
+        """
+        arguments:
+            doppler_threshold - Doppler predicted phase error [cycles]
+            pmc_threshold - smallest phase minus code jump [m]
+            max_gap - largest gap within an arc [s]
+        """
+        self.doppler_threshold = doppler_threshold
+        self.pmc_threshold = pmc_threshold
+        self.max_gap = max_gap
+        n = differencing.NUM_SATS
+        self.active = np.zeros(n, dtype=bool) # Phase tracked in the last epoch
+        self.time = np.full(n, np.nan) # Last epoch with phase, NaN if never [s]
+        self.phase = np.zeros(n) # [m]
+        self.rate = np.zeros(n) # Phase rate from Doppler [m/s]
+        self.code = np.zeros(n) # [m]
+        self.flags = np.zeros(n, dtype=np.uint8)
+        self.pmc = np.zeros(n) # Phase minus code without common changes [m]
+        self.pmc_mean = np.zeros(n) # [m]
+        self.pmc_var = np.zeros(n) # [m^2]
+        self.count = np.zeros(n, dtype=np.int64) # Epochs in the arc
+
+    def update(self, raw):
+        """
+        Check an epoch for cycle slips.
+
+        arguments:
+            raw - raw data dictionary from binr.process_raw_data_arrays
+        returns:
+            sats - satellite indices with a slip
+            reasons - slip reason bits of every satellite
+        """
+        t = (raw["Time"] + raw["GPS time shift"])/1000
+        signal = np.asarray(raw["Signal Type"])
+        flags = np.asarray(raw["Flags"])
+        index = differencing.sat_index(signal, raw["Sat Number"])
+        usable = (index >= 0) & ((flags & TRACK_FLAGS) == TRACK_FLAGS)
+        sats = index[usable]
+        flags = flags[usable]
+        lam = differencing.wavelength(signal[usable], np.asarray(raw["Carrier Number"])[usable])
+        phase = np.asarray(raw["Carrier Phase"])[usable]*lam
+        code = np.asarray(raw["Pseudo Range"])[usable]/1000*ephemeris.C
+        rate = -np.asarray(raw["Doppler Freq"])[usable]*lam
+
+        # Arcs that continue from the previous epoch
+        dt = t - self.time[sats]
+        dt = dt - alignment.WEEK*np.round(dt/alignment.WEEK) # Across the week rollover
+        cont = self.active[sats] & (dt > 0) & (dt <= self.max_gap)
+        reasons = np.zeros(len(sats), dtype=np.uint8)
+        reasons[~cont & ~np.isnan(self.time[sats])] |= SLIP_LOCK
+        reasons[cont & (((flags ^ self.flags[sats]) & FLAG_PREAMBLE) > 0)] |= SLIP_HALF_CYCLE
+
+        # Doppler predicted phase
+        predicted = self.phase[sats] + (self.rate[sats] + rate)/2*dt
+        error = _remove_common(phase - predicted, sats, cont)
+        reasons[cont & (np.abs(error) > self.doppler_threshold*lam)] |= SLIP_DOPPLER
+
+        # Phase minus code against its running statistics
+        pmc_step = _remove_common(phase - code - (self.phase[sats] - self.code[sats]),
+                                  sats, cont)
+        pmc = self.pmc[sats] + pmc_step
+        deviation = pmc - self.pmc_mean[sats]
+        limit = np.maximum(PMC_SIGMAS*np.sqrt(self.pmc_var[sats]), self.pmc_threshold)
+        tested = cont & (self.count[sats] >= PMC_MIN_EPOCHS)
+        reasons[tested & (np.abs(deviation) > limit)] |= SLIP_PHASE_CODE
+
+        # Update the state, starting a new arc after a slip
+        restart = ~cont | (reasons > 0)
+        self.active[:] = False
+        self.active[sats] = True
+        self.time[sats] = t
+        self.phase[sats] = phase
+        self.rate[sats] = rate
+        self.flags[sats] = flags
+        self.code[sats] = code
+        mean = self.pmc_mean[sats] + PMC_ALPHA*deviation
+        var = (1 - PMC_ALPHA)*(self.pmc_var[sats] + PMC_ALPHA*deviation**2)
+        self.pmc[sats] = np.where(restart, 0, pmc)
+        self.pmc_mean[sats] = np.where(restart, 0, mean)
+        self.pmc_var[sats] = np.where(restart, 0, var)
+        self.count[sats] = np.where(restart, 1, self.count[sats] + 1)
+
+        slipped = reasons > 0
+        return sats[slipped], reasons[slipped]
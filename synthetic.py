@@ -0,0 +1,477 @@
+"""
+Synthetic BINR streams for testing without receivers.
+
+A Constellation of nominal GPS and GLONASS orbits is broadcast as
+extended ephemeris (F7h) messages, and every SyntheticReceiver measures
+it from its own location as raw data (F5h) messages. Pseudorange,
+carrier phase and Doppler follow the orbit models in ephemeris.py, so
+the single point solution of a synthetic stream lands on the receiver
+location. Noise and cycle slips can be added, with the injected slips
+kept for checking detectors against.
+"""
+
+import os
+import numpy as np
+import binr
+import differencing
+import ephemeris
+import positioning
+
+# Defaults, the time of the Pelham recording
+WEEK = 984
+START_TIME = 58374000.0 # UTC time of week [ms]
+GPS_TIME_SHIFT = 18000.0 # GPS - UTC [ms]
+GLO_TIME_SHIFT = 10800000.0 # GLONASS - UTC [ms]
+PELHAM = np.array([3915016.0, 7526.0, 5018415.0]) # ECEF [m]
+
+MIN_INTERVAL = 0.1 # Shortest raw data interval, see binr.request_raw_data [s]
+GPS_ISSUE_PERIOD = 7200.0 # Time between GPS ephemeris issues [s]
+GLONASS_ISSUE_PERIOD = 1800.0 # Time between GLONASS ephemeris issues [s]
+FLAGS = 0x1B # Signal, pseudorange and Doppler, phase and signal time present
+
+# Nominal orbits
+GPS_SQRT_A = 5153.7 # [sqrt_m]
+GPS_INCLINATION = np.radians(55.0)
+GPS_ECCENTRICITY = 0.005
+GPS_OMEGA_DOT = -8.0E-9 # [rad/s]
+GLONASS_RADIUS = 25510000.0 # [m]
+GLONASS_INCLINATION = np.radians(64.8)
+# Carrier numbers of GLONASS slots 1 to 24, antipodal satellites share one
+GLONASS_CARRIERS = [1, -4, 5, 6, 1, -4, 5, 6, -2, -7, 0, -1, -2, -7, 0, -1,
+                    4, -3, 3, 2, 4, -3, 3, 2]
+
+# Times before reception the orbits are evaluated at, the transmission
+# times are interpolated between them [s]
+SAMPLE_TIMES = np.array([0.0, 0.06, 0.12])
+
+
+def geodetic_to_ecef(lat, lon, height):
+    """
+    WGS84 geodetic coordinates to ECEF.
+
+    arguments:
+        lat - latitude [deg]
+        lon - longitude [deg]
+        height - height above the ellipsoid [m]
+    returns:
+        (3,) ECEF position [m]
+    """
+    a = 6378137.0
+    e2 = 6.69437999014E-3
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    n = a/np.sqrt(1 - e2*np.sin(lat)**2)
+    return np.array([(n + height)*np.cos(lat)*np.cos(lon),
+                     (n + height)*np.cos(lat)*np.sin(lon),
+                     (n*(1 - e2) + height)*np.sin(lat)])
+
+
+def gps_ephemeris(prn, t_0e, week=WEEK):
+    """
+    Extended ephemeris (F7h) of a nominal GPS orbit. The orbits are fixed,
+    only the reference time changes between issues.
+
+    arguments:
+        prn - satellite number, 1 to 32, in 6 planes
+        t_0e - reference GPS time of week [s]
+        week - GPS week number
+    returns:
+        dictionary with the F7h GPS fields in BINR units
+    """
+    plane, slot = (prn - 1) % 6, (prn - 1)//6
+    n = np.sqrt(ephemeris.MU_GPS/GPS_SQRT_A**6)
+    issue = int(t_0e//GPS_ISSUE_PERIOD) % 256
+    eph = dict([(name, 0) for name in binr.LAYOUTS[(0xF7, ephemeris.GPS)].names])
+    eph.update({"System":ephemeris.GPS, "PRN":prn,
+                "M_0":(np.radians(slot*64.0 + plane*18.0) + n*t_0e) % (2*np.pi),
+                "e":GPS_ECCENTRICITY, "sqrtA":GPS_SQRT_A, "t_0e":t_0e*1000,
+                "Omega_0":np.radians(plane*60.0) + GPS_OMEGA_DOT*t_0e,
+                "I_0":GPS_INCLINATION, "w":np.radians(slot*7.0),
+                "Omega_dot":GPS_OMEGA_DOT/1000, "t_0c":t_0e*1000,
+                "a_f0":((prn*37) % 21 - 10)*0.1, # +-1 ms [ms]
+                "IODE":issue, "IODC":issue, "WN":week})
+    return eph
+
+
+def glonass_state(slot, t):
+    """
+    PZ-90 state of a nominal circular GLONASS orbit.
+
+    arguments:
+        slot - satellite slot, 1 to 24, in 3 planes
+        t - GLONASS time of day [s]
+    returns:
+        (6,) position [m] and velocity [m/s]
+    """
+    plane, k = (slot - 1)//8, (slot - 1) % 8
+    n = np.sqrt(ephemeris.MU_GLONASS/GLONASS_RADIUS**3)
+    u = np.radians(k*45.0 + plane*15.0) + n*t
+    node = np.radians(plane*120.0) - ephemeris.OMGE_GLONASS*t
+    cos_i, sin_i = np.cos(GLONASS_INCLINATION), np.sin(GLONASS_INCLINATION)
+    in_plane = np.array([np.cos(u), np.sin(u)*cos_i, np.sin(u)*sin_i])
+    along = np.array([-np.sin(u), np.cos(u)*cos_i, np.cos(u)*sin_i])
+    rotate = np.array([[np.cos(node), -np.sin(node), 0],
+                       [np.sin(node), np.cos(node), 0],
+                       [0, 0, 1]])
+    pos = rotate @ in_plane*GLONASS_RADIUS
+    vel = rotate @ along*GLONASS_RADIUS*n
+    # Velocity in the rotating frame
+    vel = vel - np.cross([0, 0, ephemeris.OMGE_GLONASS], pos)
+    return np.concatenate([pos, vel])
+
+
+def glonass_ephemeris(slot, t_b, state):
+    """
+    Extended ephemeris (F7h) of a GLONASS satellite.
+
+    arguments:
+        slot - satellite slot
+        t_b - reference GLONASS time of day [s]
+        state - (6,) PZ-90 position [m] and velocity [m/s] at t_b
+    returns:
+        dictionary with the F7h GLONASS fields in BINR units
+    """
+    return {"System":ephemeris.GLONASS, "PRN":slot,
+            "H_n^A":GLONASS_CARRIERS[(slot - 1) % 24],
+            "x_n":state[0], "y_n":state[1], "z_n":state[2],
+            "x_nv":state[3]/1000, "y_nv":state[4]/1000, "z_nv":state[5]/1000,
+            "x_na":0.0, "y_na":0.0, "z_na":0.0,
+            "t_b":(t_b % 86400)*1000, "gamma_n":0.0,
+            "tau_n":((slot*53) % 21 - 10)*0.05, # +-0.5 ms [ms]
+            "E_n":0}
+
+
+def encode_ephemeris(eph):
+    """
+    Extended ephemeris (F7h) frame of an ephemeris dictionary.
+    """
+    layout = binr.LAYOUTS[(0xF7, eph["System"])]
+    return binr.build_frame(0xF7, layout.struct.pack(*[eph[name] for name in layout.names]))
+
+
+def encode_raw_data(header, channels):
+    """
+    Raw data (F5h) frame.
+
+    arguments:
+        header - RAW_HEADER_DTYPE record
+        channels - RAW_CHANNEL_DTYPE array
+    """
+    return binr.build_frame(0xF5, np.asarray(header, dtype=binr.RAW_HEADER_DTYPE).tobytes() +
+                            np.ascontiguousarray(channels, dtype=binr.RAW_CHANNEL_DTYPE).tobytes())
+
+
+class Constellation:
+    """
+    Nominal GPS and GLONASS constellations and their ephemeris issues.
+
+    GPS orbits are Keplerian and every issue describes the same orbit.
+    Every GLONASS issue starts from the previous one propagated with the
+    GLONASS orbit model, so the orbits stay continuous across issues.
+    """
+
+    def __init__(self, gps=24, glonass=24, start=START_TIME, week=WEEK,
+                 gps_time_shift=GPS_TIME_SHIFT, glo_time_shift=GLO_TIME_SHIFT):
+        """
+        arguments:
+            gps - number of GPS satellites, PRN 1 upwards
+            glonass - number of GLONASS satellites, slot 1 upwards
+            start - UTC time of week of the first epoch [ms]
+            week - GPS week number
+            gps_time_shift - GPS - UTC [ms]
+            glo_time_shift - GLONASS - UTC [ms]
+        """
+        self.start = start
+        self.week = week
+        self.gps_time_shift = gps_time_shift
+        self.glo_time_shift = glo_time_shift
+        self.gps = list(range(1, gps + 1))
+        self.glonass = list(range(1, glonass + 1))
+        self._issues = {ephemeris.GPS:(-1, None, None), ephemeris.GLONASS:(-1, None, None)}
+        self._glonass_states = None
+
+    def gps_time(self, utc):
+        return (utc + self.gps_time_shift)/1000
+
+    def glonass_time(self, utc):
+        return ((utc + self.glo_time_shift)/1000) % 86400
+
+    def _issue(self, system, utc):
+        """
+        Ephemerides and stacked orbits of the issue that covers a time.
+        The issue reference times are halfway through their periods.
+        """
+        period = GPS_ISSUE_PERIOD if system == ephemeris.GPS else GLONASS_ISSUE_PERIOD
+        number = int((utc - self.start)/1000//period)
+        current, ephs, orbit = self._issues[system]
+        if number == current:
+            return ephs, orbit
+        if system == ephemeris.GPS:
+            t_0e = (self.gps_time(self.start) + (number + 0.5)*period) % 604800
+            ephs = [gps_ephemeris(prn, t_0e, self.week) for prn in self.gps]
+            orbit = ephemeris.GpsOrbit(ephemeris.stack_ephemerides(ephs))
+        else:
+            t_b = self.glonass_time(self.start) + (number + 0.5)*period
+            if self._glonass_states is None:
+                self._glonass_states = (number, np.array([glonass_state(slot, t_b)
+                                                          for slot in self.glonass]))
+            issued, states = self._glonass_states
+            states = ephemeris.glonass_integrate(states, np.zeros((len(states), 3)),
+                                                 np.full(len(states), (number - issued)*period))
+            self._glonass_states = (number, states)
+            ephs = [glonass_ephemeris(slot, t_b, state)
+                    for slot, state in zip(self.glonass, states)]
+            orbit = ephemeris.GlonassOrbit(ephemeris.stack_ephemerides(
+                ephs, ephemeris.GLONASS_ORBIT_FIELDS))
+        self._issues[system] = (number, ephs, orbit)
+        return ephs, orbit
+
+    def ephemerides(self, utc):
+        """
+        Current ephemeris dictionaries of every satellite.
+        """
+        return (self._issue(ephemeris.GPS, utc)[0] +
+                self._issue(ephemeris.GLONASS, utc)[0])
+
+    def sky(self, utc):
+        """
+        Satellite positions and clocks around a reception time, shared by
+        all receivers of an epoch.
+
+        arguments:
+            utc - UTC time of week of reception [ms]
+        returns:
+            dictionary with
+                "Signal Type", "Sat Number", "Carrier Number" - (N,)
+                "Samples" - (len(SAMPLE_TIMES), N, 4) ECEF positions [m]
+                            and satellite clock corrections as the SPP
+                            solver applies them [s]
+        """
+        signals = []
+        numbers = []
+        carriers = []
+        samples = []
+        for system, signal, sats, t in [
+                (ephemeris.GPS, binr.SIGNAL_GPS, self.gps, self.gps_time(utc)),
+                (ephemeris.GLONASS, binr.SIGNAL_GLONASS, self.glonass,
+                 self.glonass_time(utc))]:
+            if len(sats) == 0:
+                continue
+            ephs, orbit = self._issue(system, utc)
+            system_samples = []
+            for dt in SAMPLE_TIMES:
+                pos, clk, dt_r = orbit.position(np.full(len(sats), t - dt))
+                if system == ephemeris.GPS:
+                    clk = clk - orbit.T_GD
+                system_samples.append(np.column_stack([pos, clk + dt_r]))
+            signals.append(np.full(len(sats), signal))
+            numbers.append(sats)
+            carriers.append([eph.get("H_n^A", 0) for eph in ephs])
+            samples.append(np.array(system_samples))
+        return {"Signal Type":np.concatenate(signals), "Sat Number":np.concatenate(numbers),
+                "Carrier Number":np.concatenate(carriers),
+                "Samples":np.concatenate(samples, axis=1)}
+
+
+def _interpolate(samples, dt, rates=False):
+    """
+    Quadratic interpolation of values sampled SAMPLE_TIMES before
+    reception.
+
+    arguments:
+        samples - (3, N, M) values
+        dt - (N,) time before reception [s]
+        rates - also return the rates
+    returns:
+        values (N, M), and rates (N, M) per second
+    """
+    x0, x1, x2 = SAMPLE_TIMES
+    d = dt[:, None]
+    values = ((d - x1)*(d - x2)/((x0 - x1)*(x0 - x2))*samples[0] +
+              (d - x0)*(d - x2)/((x1 - x0)*(x1 - x2))*samples[1] +
+              (d - x0)*(d - x1)/((x2 - x0)*(x2 - x1))*samples[2])
+    if not rates:
+        return values
+    # Time runs against dt
+    return values, -((2*d - x1 - x2)/((x0 - x1)*(x0 - x2))*samples[0] +
+                     (2*d - x0 - x2)/((x1 - x0)*(x1 - x2))*samples[1] +
+                     (2*d - x0 - x1)/((x2 - x0)*(x2 - x1))*samples[2])
+
+
+class SyntheticReceiver:
+    """
+    Static receiver that measures a constellation.
+
+    The receiver clock has a bias and a drift, and the GLONASS
+    measurements an extra offset. Carrier phase starts every arc with a
+    random integer ambiguity. Cycle slips change the ambiguity of a
+    channel for the rest of its arc without touching its flags.
+    """
+
+    def __init__(self, position=PELHAM, channels=24, elevation_mask=10.0,
+                 clock_bias=1E-4, clock_drift=1E-8, glonass_offset=0.0,
+                 code_noise=0.5, phase_noise=0.005, doppler_noise=0.05,
+                 slip_rate=0.0, max_slip=100, seed=None):
+        """
+        arguments:
+            position - (3,) ECEF position [m], see geodetic_to_ecef
+            channels - most satellites tracked, the highest are kept
+            elevation_mask - lowest tracked elevation [deg]
+            clock_bias - receiver clock bias at the first epoch [s]
+            clock_drift - receiver clock drift [s/s]
+            glonass_offset - extra GLONASS clock bias [s]
+            code_noise - pseudorange noise standard deviation [m]
+            phase_noise - carrier phase noise standard deviation [cycles]
+            doppler_noise - Doppler noise standard deviation [Hz]
+            slip_rate - chance of a cycle slip per channel and epoch
+            max_slip - largest slip [cycles]
+            seed - random seed, for repeatable streams
+        """
+        self.position = np.asarray(position, dtype=np.float64)
+        self.channels = channels
+        self.elevation_mask = np.radians(elevation_mask)
+        self.clock_bias = clock_bias
+        self.clock_drift = clock_drift
+        self.glonass_offset = glonass_offset
+        self.code_noise = code_noise
+        self.phase_noise = phase_noise
+        self.doppler_noise = doppler_noise
+        self.slip_rate = slip_rate
+        self.max_slip = max_slip
+        self.rng = np.random.default_rng(seed)
+        self.ambiguities = {} # (signal type, sat number) to integer ambiguity [cycles]
+        self.slips = [] # Injected slips (UTC time [ms], signal type, sat number, cycles)
+        self._start = None
+
+    def observe(self, sky, utc):
+        """
+        Measure the satellites of an epoch.
+
+        arguments:
+            sky - from Constellation.sky
+            utc - UTC time of week of reception [ms]
+        returns:
+            RAW_CHANNEL_DTYPE array, highest satellites first
+        """
+        if self._start is None:
+            self._start = utc
+        clock = self.clock_bias + self.clock_drift*(utc - self._start)/1000
+        bias = clock + self.glonass_offset*(sky["Signal Type"] == binr.SIGNAL_GLONASS)
+
+        # Satellites at the true transmission time, the geometric travel
+        # time before the true reception time
+        dt = np.full(len(sky["Sat Number"]), 0.075)
+        for i in range(4):
+            sat = _interpolate(sky["Samples"], dt)
+            rng = np.linalg.norm(sat[:, :3] - self.position, axis=1)
+            rotated = positioning.sagnac_rotate(sat[:, :3], rng/ephemeris.C)
+            rng = np.linalg.norm(rotated - self.position, axis=1)
+            dt = clock + rng/ephemeris.C
+        sat, rate = _interpolate(sky["Samples"], dt, rates=True)
+        tau = rng/ephemeris.C + bias - sat[:, 3] # Pseudorange [s]
+        los = (rotated - self.position)/rng[:, None]
+        rate = np.sum(los*rate[:, :3], axis=1) + ephemeris.C*(self.clock_drift - rate[:, 3])
+
+        # Highest satellites above the mask
+        elevation = positioning.elevation(self.position, sat[:, :3])
+        order = np.argsort(-elevation)
+        order = order[elevation[order] >= self.elevation_mask][:self.channels]
+        obs = np.zeros(len(order), dtype=binr.RAW_CHANNEL_DTYPE)
+        for name in ["Signal Type", "Sat Number", "Carrier Number"]:
+            obs[name] = sky[name][order]
+        tau = tau[order]
+        wavelength = differencing.wavelength(obs["Signal Type"], obs["Carrier Number"])
+        noise = self.rng.normal(0, 1, (3, len(order)))
+        obs["Pseudo Range"] = (tau + noise[0]*self.code_noise/ephemeris.C)*1000
+        obs["Carrier Phase"] = tau*ephemeris.C/wavelength + noise[1]*self.phase_noise
+        obs["Doppler Freq"] = -rate[order]/wavelength + noise[2]*self.doppler_noise
+        obs["SNR"] = np.clip(np.round(25 + 25*np.sin(elevation[order])), 0, 60)
+        obs["Flags"] = FLAGS
+
+        # Ambiguities start with an arc and change with slips
+        tracked = list(zip(obs["Signal Type"].tolist(), obs["Sat Number"].tolist()))
+        slipped = self.rng.random(len(tracked)) < self.slip_rate
+        ambiguities = {}
+        for i, key in enumerate(tracked):
+            n = self.ambiguities.get(key)
+            if n is None:
+                n = int(self.rng.integers(-1000000, 1000000))
+            elif slipped[i]:
+                cycles = int(self.rng.integers(1, self.max_slip + 1))*int(self.rng.choice([-1, 1]))
+                n += cycles
+                self.slips.append((utc, key[0], key[1], cycles))
+            ambiguities[key] = n
+            obs["Carrier Phase"][i] += n
+        self.ambiguities = ambiguities
+        return obs
+
+
+def generate(receivers, duration, interval=1.0, constellation=None, ephemeris_interval=30.0):
+    """
+    Synthesize the streams of several receivers epoch by epoch.
+
+    Every epoch gives a raw data (F5h) frame per receiver. Every
+    ephemeris_interval, and at the first epoch, the extended ephemerides
+    (F7h) of the tracked satellites come before it.
+
+    arguments:
+        receivers - {name: SyntheticReceiver}
+        duration - length of the streams [s]
+        interval - time between epochs, a multiple of MIN_INTERVAL [s]
+        constellation - Constellation, None for the default one
+        ephemeris_interval - time between ephemeris broadcasts [s]
+    returns:
+        generator of (UTC time of week [ms], {name: frame bytes})
+    raises:
+        ValueError - if the interval is not a multiple of MIN_INTERVAL
+    """
+    steps = interval/MIN_INTERVAL
+    if steps < 1 or abs(steps - round(steps)) > 1E-9:
+        raise ValueError("Interval should be a multiple of "+str(MIN_INTERVAL)+" s: "+str(interval))
+    if constellation is None:
+        constellation = Constellation()
+    epochs = int(round(duration/interval))
+    every = max(int(round(ephemeris_interval/interval)), 1)
+    for epoch in range(epochs):
+        utc = constellation.start + epoch*round(steps)*MIN_INTERVAL*1000
+        sky = constellation.sky(utc)
+        header = np.array((utc, constellation.week, constellation.gps_time_shift,
+                           constellation.glo_time_shift, 0), dtype=binr.RAW_HEADER_DTYPE)
+        frames = {}
+        for name, receiver in receivers.items():
+            obs = receiver.observe(sky, utc)
+            data = b''
+            if epoch % every == 0:
+                tracked = set(zip(obs["Signal Type"].tolist(), obs["Sat Number"].tolist()))
+                for eph in constellation.ephemerides(utc):
+                    signal = (binr.SIGNAL_GPS if eph["System"] == ephemeris.GPS
+                              else binr.SIGNAL_GLONASS)
+                    if (signal, eph["PRN"]) in tracked:
+                        data += encode_ephemeris(eph)
+            frames[name] = data + encode_raw_data(header, obs)
+        yield utc, frames
+
+
+def write_recordings(receivers, duration, directory=".", **kwargs):
+    """
+    Write synthetic streams as recordings, ready for binr.load_recording
+    or replay.ReplaySerial.
+
+    arguments:
+        receivers - {name: SyntheticReceiver}
+        duration - length of the recordings [s]
+        directory - where the recordings go, named after the receivers
+        kwargs - passed on to generate
+    returns:
+        {name: filename}
+    """
+    filenames = dict([(name, os.path.join(directory, name + ".dat")) for name in receivers])
+    files = dict([(name, open(filename, 'wb')) for name, filename in filenames.items()])
+    try:
+        for utc, frames in generate(receivers, duration, **kwargs):
+            for name, data in frames.items():
+                files[name].write(data)
+    finally:
+        for f in files.values():
+            f.close()
+    return filenames
@@ -0,0 +1,79 @@
+import unittest
+import numpy as np
+import alignment
+import binr
+
+def load_epochs():
+    with open("pelham_shed_1_July_2018.dat", 'rb') as f:
+        frames = binr.BinrFramer().feed(f.read())
+    return [binr.process_raw_data_arrays(frame["data"]) for frame in frames
+            if frame["ID"] == 0xF5]
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.epochs = load_epochs()[:200]
+
+    def test_pairs(self):
+        # Base lags the rover by three epochs and misses every tenth epoch
+        aligner = alignment.EpochAligner(max_wait=5.0, capacity=8)
+        pairs = []
+        for i in range(len(self.epochs)):
+            pairs += aligner.add("rover", self.epochs[i])
+            if i >= 3 and (i - 3) % 10 != 5:
+                pairs += aligner.add("base", self.epochs[i-3])
+
+        self.assertEqual(aligner.pairs, len(pairs))
+        self.assertEqual(len(pairs), 197 - 20)
+        for pair in pairs:
+            self.assertEqual(pair["Age"], 0)
+            self.assertEqual(pair["Time"], alignment.gps_time(pair["Base"]))
+            np.testing.assert_array_equal(pair["Rover"]["Pseudo Range"],
+                                          pair["Base"]["Pseudo Range"])
+        self.assertLessEqual(aligner.waiting("rover"), 8)
+        self.assertGreater(aligner.unmatched["rover"], 0)
+        self.assertAlmostEqual(aligner.age(), alignment.gps_time(self.epochs[-1]) - 
+                               pairs[-1]["Time"])
+
+    def test_free_slots(self):
+        # Pairs free slots out of order, waiting epochs are kept
+        aligner = alignment.EpochAligner(max_wait=5.0, capacity=2)
+        aligner.add("rover", self.epochs[0])
+        aligner.add("rover", self.epochs[1])
+        self.assertEqual(len(aligner.add("base", self.epochs[1])), 1)
+        aligner.add("rover", self.epochs[2])
+        self.assertEqual(aligner.unmatched["rover"], 0)
+        self.assertEqual(len(aligner.add("base", self.epochs[0])), 1)
+        self.assertEqual(len(aligner.add("base", self.epochs[2])), 1)
+
+        # The oldest epoch gives way when every slot is taken
+        aligner.add("rover", self.epochs[3])
+        aligner.add("rover", self.epochs[4])
+        aligner.add("rover", self.epochs[5])
+        self.assertEqual(aligner.unmatched["rover"], 1)
+        self.assertEqual(aligner.add("base", self.epochs[3]), [])
+        self.assertEqual(len(aligner.add("base", self.epochs[4])), 1)
+
+    def test_late_and_stored_epochs(self):
+        aligner = alignment.EpochAligner(max_wait=1.0)
+        self.assertTrue(np.isnan(aligner.age()))
+
+        # A stored base epoch is copied into the pair
+        epoch = self.epochs[0]
+        self.assertEqual(aligner.add("base", epoch), [])
+        self.assertEqual(aligner.waiting("base"), 1)
+        pair = aligner.add("rover", epoch)[0]
+        np.testing.assert_array_equal(pair["Base"]["Carrier Phase"], epoch["Carrier Phase"])
+        self.assertEqual(pair["Base"]["GLO time shift"], epoch["GLO time shift"])
+        self.assertEqual(aligner.waiting("base"), 0)
+
+        # Epochs that arrive after the partner moved on are dropped
+        for raw in self.epochs[1:30]:
+            aligner.add("rover", raw)
+        self.assertEqual(aligner.add("base", self.epochs[2]), [])
+        self.assertEqual(aligner.late["base"], 1)
+
+        with self.assertRaises(ValueError):
+            aligner.add("moon", epoch)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import itertools
+import unittest
+import numpy as np
+import ambiguity
+
+class Tests(unittest.TestCase):
+    def test_ld_factorize(self):
+        rng = np.random.default_rng(0)
+        A = rng.normal(size=(5, 5))
+        Q = A @ A.T + np.eye(5)
+        L, D = ambiguity.ld_factorize(Q)
+        np.testing.assert_allclose(L.T @ np.diag(D) @ L, Q, atol=1E-12)
+        np.testing.assert_allclose(np.diag(L), 1)
+        with self.assertRaises(ValueError):
+            ambiguity.ld_factorize(-np.eye(2))
+
+    def test_resolve_matches_brute_force(self):
+        rng = np.random.default_rng(1)
+        for trial in range(5):
+            A = rng.normal(size=(3, 3))
+            Q = A @ A.T*0.3 + np.eye(3)*0.01
+            a = rng.normal(size=3)*10
+            result = ambiguity.resolve(a, Q)
+
+            # Every integer vector near the float solution
+            Q_inv = np.linalg.inv(Q)
+            best = []
+            for d in itertools.product(range(-5, 6), repeat=3):
+                e = a - np.round(a) - d
+                best.append((e @ Q_inv @ e, tuple(np.round(a) + d)))
+            best.sort()
+            np.testing.assert_array_equal(result["Fixed"], best[0][1])
+            np.testing.assert_array_equal(result["Runner Up"], best[1][1])
+            np.testing.assert_allclose(result["Residuals"], [best[0][0], best[1][0]])
+            self.assertAlmostEqual(result["Ratio"], best[1][0]/best[0][0])
+
+    def test_resolve_many_ambiguities(self):
+        # 24 double differences with DD correlation and a precise float solution
+        rng = np.random.default_rng(2)
+        n = 24
+        Q = (np.eye(n) + np.ones((n, n)))*0.001
+        true = rng.integers(-1000, 1000, n).astype(np.float64)
+        a = true + rng.multivariate_normal(np.zeros(n), Q)
+        result = ambiguity.resolve(a, Q)
+        self.assertTrue(result["Complete"])
+        self.assertTrue(result["Accepted"])
+        np.testing.assert_array_equal(result["Fixed"], true)
+
+        # A search stopped at the node limit is never accepted
+        result = ambiguity.resolve(a, Q, max_nodes=3)
+        self.assertFalse(result["Complete"])
+        self.assertFalse(result["Accepted"])
+        self.assertLessEqual(result["Nodes"], 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import archive
+import binr
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_pack_ints(self):
+        values = np.array([0, 1, -1, 5, -7, 3, 0, 123456789, -2, 4], dtype=np.int64)
+        bits, exception_bits, exception_count, packed = archive.pack_ints(values)
+        self.assertEqual(exception_count, 1)
+        self.assertLess(len(packed), values.nbytes)
+        self.assertTrue(np.array_equal(archive.unpack_ints(packed, len(values), bits,
+                                                           exception_bits, exception_count),
+                                       values))
+
+    def test_archive(self):
+        recording = binr.load_recording("pelham_shed_1_July_2018.dat")
+        filename = os.path.join(self.tmp_dir, "observations.obs")
+        archive.write_archive(filename, recording, chunk_size=1000)
+
+        # At least five times smaller than the observables as float64
+        obs = recording["Observations"]
+        self.assertLess(os.path.getsize(filename)*5, len(obs)*len(archive.COLUMNS)*8)
+
+        observations = archive.ObservationArchive(filename)
+        self.assertIsInstance(observations.arcs, np.memmap)
+        self.assertEqual(len(observations), len(obs))
+        self.assertTrue(np.array_equal(observations.epochs, recording["Epochs"]))
+
+        # Same observations within the resolution, in epoch order
+        decoded, epoch_index = observations.decode()
+        self.assertTrue(np.array_equal(epoch_index, np.sort(recording["Epoch Index"])))
+        key = lambda o, e: np.lexsort((o["Carrier Number"], o["Sat Number"], o["Signal Type"], e))
+        expected = obs[key(obs, recording["Epoch Index"])]
+        decoded = decoded[key(decoded, epoch_index)]
+        for name in ["Signal Type", "Sat Number", "Carrier Number", "Flags"]:
+            self.assertTrue(np.array_equal(decoded[name], expected[name]))
+        for name, resolution in archive.RESOLUTION.items():
+            error = np.abs(decoded[name] - expected[name])
+            self.assertLessEqual(error.max(), resolution/2*1.0001)
+
+        # A single arc decodes on its own
+        arc = observations.arcs[3]
+        arc_obs, arc_epochs = observations.arc(3)
+        self.assertEqual(len(arc_obs), arc["Length"])
+        self.assertTrue(np.array_equal(np.diff(arc_epochs), np.ones(len(arc_obs) - 1)))
+        selected = ((obs["Signal Type"] == arc["Signal Type"]) &
+                    (obs["Sat Number"] == arc["Sat Number"]) &
+                    np.isin(recording["Epoch Index"], arc_epochs))
+        self.assertTrue(np.allclose(arc_obs["Carrier Phase"], obs["Carrier Phase"][selected],
+                                    atol=archive.RESOLUTION["Carrier Phase"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -60,6 +60,73 @@ class Tests(unittest.TestCase):
         with self.assertRaises(ValueError):
             binr.process_msg(raw_msg)
     
+    def test_process_msg_escaped_dle(self):
+        # Escaped DLE followed by an ETX valued data byte
+        raw_msg = bytearray([0x10,0x21,0x10,0x10,0x03,0x10,0x03,0x23])
+        msg, buffer = binr.process_msg(raw_msg)
+
+        # Test that the frame did not end at the escaped DLE
+        self.assertEqual(msg["ID"], 0x21)
+        self.assertEqual(msg["data"], bytes([0x10,0x03]))
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer[0], 0x23)
+
+    def test_binr_framer(self):
+        # Two messages with leading garbage
+        stream = bytes([0x11,0x21,0x10,0x21,0x01,0x10,0x03,
+                        0x10,0x60,0x0B,0x10,0x10,0x03,0x3E,0x10,0x03])
+
+        # Feed the whole stream at once
+        framer = binr.BinrFramer()
+        frames = framer.feed(stream)
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(frames[0]["ID"], 0x21)
+        self.assertEqual(frames[0]["data"], b'\x01')
+        self.assertEqual(frames[1]["ID"], 0x60)
+        self.assertEqual(frames[1]["data"], bytes([0x0B,0x10,0x03,0x3E]))
+        self.assertEqual(framer.pending(), 0)
+
+        # Feed the stream a byte at a time
+        framer = binr.BinrFramer()
+        frames = []
+        for i in range(len(stream)):
+            frames = frames + framer.feed(memoryview(stream)[i:i+1])
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(frames[1]["data"], bytes([0x0B,0x10,0x03,0x3E]))
+
+        # Partial frames are kept until they complete
+        framer = binr.BinrFramer()
+        self.assertEqual(framer.feed(stream[:9]), [{"ID":0x21, "data":b'\x01'}])
+        self.assertEqual(framer.pending(), 2)
+        self.assertEqual(len(framer.feed(stream[9:])), 1)
+
+    def test_binr_framer_resync(self):
+        # Corrupt frame (lone DLE) followed by a valid frame
+        stream = bytes([0x10,0x21,0x01,0x10,0x00,0x23,
+                        0x10,0x22,0x02,0x10,0x03])
+        frames = binr.BinrFramer().feed(stream)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]["ID"], 0x22)
+
+        # Frame that never ends is dropped
+        framer = binr.BinrFramer(max_frame_length=8)
+        self.assertEqual(framer.feed(bytes([0x10,0x21]+[0x00]*20)), [])
+        self.assertEqual(framer.pending(), 0)
+        frames = framer.feed(bytes([0x10,0x22,0x02,0x10,0x03]))
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]["ID"], 0x22)
+    
+    def test_unstuff(self):
+        self.assertEqual(binr.unstuff(b'\x01\x10\x10\x10\x10\x02'), b'\x01\x10\x10\x02')
+        self.assertEqual(binr.unstuff([0x10,0x10,0x03]), b'\x10\x03')
+        self.assertEqual(binr.unstuff(b''), b'')
+
+    def test_build_frame(self):
+        self.assertEqual(binr.stuff(b'\x01\x10\x03'), b'\x01\x10\x10\x03')
+        frame = binr.build_frame(0xF5, b'\x10\x03\x10')
+        self.assertEqual(frame, b'\x10\xF5\x10\x10\x03\x10\x10\x10\x03')
+        self.assertEqual(binr.BinrFramer().feed(frame), [{"ID":0xF5, "data":b'\x10\x03\x10'}])
+
     def test_reboot(self):
         # Generate normal packet
         packet = binr.reboot()
@@ -241,12 +308,11 @@ class Tests(unittest.TestCase):
             binr.request_raw_data(0)
 
     def test_process_raw_data(self):
-        # TODO: Suspect something is wrong with channel 0
-        # Test data
+        # Test data (captured before unstuffing)
         data = b'\xc7\xad-\x81\xbb\xd5\x8bA\xd8\x03\x0e\xabW\x00\x00\x94\xd1@\x00\x00\x00\x00p\x99dA\x00\x01\x15\x04*\x89\xf5\xec=m\xea\xff@\x00\x90+,\xc8\x8fP@\x00\x00\x88\x13\x8f\xfc\x94\xc0{\x00\x01\r\xfe \xc5x\x03\xf2\x04\xb9\xf1\xc0\x00\x10\x10\x02\xa2\xf4\x98R@\x00\x00`\x12w\xee\x88@{\x00\x01\x05\x01*\x19\xbbc\xd5(\\\x11A\x00`\nL\x0fWR@\x00\x00\xa8\x10\x10\x02\xac\xa6\xc0{\x00\x01\x16\xfd+\x93d_8?-\r\xc1\x00\xa0\xe8\xd5\xd9\xc1P@\x00\x00\xc4!M\xbf\xa2@;\x00\x02\x01\x01\x1c\x00\x01\xc0\xb7\xa3P\x13\xc1\x00H\xfd\xad\x1b\xa2R@\x00\x00<\xb7\x8f\xf0\xa8@3\x00\x02\x12\x120\x00nX|\x93z\n\xc1\x00H\x85\xa4\x93\x1bQ@\x00\x00X\t\xb0\x0f\xa1@{\x00\x02\x1b\x1b.\x00\xae\xed"\xfe\xd5\x0bA\x00H\xa5\x00\x1b\xf7Q@\x00\x00\xf8\xda\xd8s\xa2\xc0{\x00\x02\x14\x14.\x00\xf9d \x05\xeb\x11A\x00H5$\xcd\x9eS@\x00\x004`\xe1h\xa7\xc0{\x00\x02\x08\x082\x00\x00\xd5\x83\x90\xb1\x97@\x00H\xbdl&\xf9P@\x00\x00\x00\xb7\x9c\x9dC\xc0;\x00\x02  $\x00\x96\xe8\xda\xcdo\x0e\xc1\x00H\x1d\x16E\xc9S@\x00\x00H)\xce,\xa6@{\x00\x02\n\n1\x00\x0eJJ\xb5B\x03A\x00H-\x83\xac\tR@\x00\x00\xe8\xed\xb6T\x99\xc0;\x00\x02\x0b\x0b/\x00E\xf4\xa7\xba;\x12\xc1\x00H\x05g\xbf\xf9Q@\x00\x00\xb8zl\x8f\xa7@{\x00\x02\x1c\x1c"\x00p\xfc\x1d\xe1\'\x0c\xc1\x00H\x05n\xb3\xd0S@\x00\x00\\F4\x1f\xa4@;\x00'
 
         # Process data
-        raw = binr.process_raw_data(data)
+        raw = binr.process_raw_data(binr.unstuff(data))
 
         # Check raw data response
         self.assertEquals(raw["Time"],58374000.14730411)
@@ -260,9 +326,35 @@ class Tests(unittest.TestCase):
         self.assertEquals(raw["Carrier Number"][2],1)
         self.assertEquals(raw["Carrier Phase"][2],284426.2083882555)
         self.assertEquals(raw["Pseudo Range"][2],73.36030865681823)
-        self.assertEquals(raw["Doppler Freq"][2],-2902.0040288167074)
+        self.assertEquals(raw["Doppler Freq"][2],-2902.0040333271027)
         self.assertEquals(raw["Flags"][2],123)
     
+    def test_process_raw_data_arrays(self):
+        # Test data (captured before unstuffing)
+        data = b'\xc7\xad-\x81\xbb\xd5\x8bA\xd8\x03\x0e\xabW\x00\x00\x94\xd1@\x00\x00\x00\x00p\x99dA\x00\x01\x15\x04*\x89\xf5\xec=m\xea\xff@\x00\x90+,\xc8\x8fP@\x00\x00\x88\x13\x8f\xfc\x94\xc0{\x00\x01\r\xfe \xc5x\x03\xf2\x04\xb9\xf1\xc0\x00\x10\x10\x02\xa2\xf4\x98R@\x00\x00`\x12w\xee\x88@{\x00\x01\x05\x01*\x19\xbbc\xd5(\\\x11A\x00`\nL\x0fWR@\x00\x00\xa8\x10\x10\x02\xac\xa6\xc0{\x00\x01\x16\xfd+\x93d_8?-\r\xc1\x00\xa0\xe8\xd5\xd9\xc1P@\x00\x00\xc4!M\xbf\xa2@;\x00\x02\x01\x01\x1c\x00\x01\xc0\xb7\xa3P\x13\xc1\x00H\xfd\xad\x1b\xa2R@\x00\x00<\xb7\x8f\xf0\xa8@3\x00\x02\x12\x120\x00nX|\x93z\n\xc1\x00H\x85\xa4\x93\x1bQ@\x00\x00X\t\xb0\x0f\xa1@{\x00\x02\x1b\x1b.\x00\xae\xed"\xfe\xd5\x0bA\x00H\xa5\x00\x1b\xf7Q@\x00\x00\xf8\xda\xd8s\xa2\xc0{\x00\x02\x14\x14.\x00\xf9d \x05\xeb\x11A\x00H5$\xcd\x9eS@\x00\x004`\xe1h\xa7\xc0{\x00\x02\x08\x082\x00\x00\xd5\x83\x90\xb1\x97@\x00H\xbdl&\xf9P@\x00\x00\x00\xb7\x9c\x9dC\xc0;\x00\x02  $\x00\x96\xe8\xda\xcdo\x0e\xc1\x00H\x1d\x16E\xc9S@\x00\x00H)\xce,\xa6@{\x00\x02\n\n1\x00\x0eJJ\xb5B\x03A\x00H-\x83\xac\tR@\x00\x00\xe8\xed\xb6T\x99\xc0;\x00\x02\x0b\x0b/\x00E\xf4\xa7\xba;\x12\xc1\x00H\x05g\xbf\xf9Q@\x00\x00\xb8zl\x8f\xa7@{\x00\x02\x1c\x1c"\x00p\xfc\x1d\xe1\'\x0c\xc1\x00H\x05n\xb3\xd0S@\x00\x00\\F4\x1f\xa4@;\x00'
+        data = binr.unstuff(data)
+
+        # Process data
+        raw = binr.process_raw_data_arrays(data)
+        ref = binr.process_raw_data(data)
+
+        # Check that the arrays match the scalar decoder
+        self.assertEqual(raw["Time"], ref["Time"])
+        self.assertEqual(raw["Week Number"], ref["Week Number"])
+        self.assertEqual(len(raw["Signal Type"]), 13)
+        for name in ["Signal Type", "Sat Number", "Carrier Number", "SNR",
+                     "Carrier Phase", "Pseudo Range", "Doppler Freq", "Flags"]:
+            self.assertEqual(raw[name].tolist(), ref[name])
+
+        # Check split flags (123 = 0b01111011)
+        self.assertTrue(raw["Signal Present"][2])
+        self.assertTrue(raw["Pseudorange and Doppler Present"][2])
+        self.assertFalse(raw["Pseudorange Smoothed"][2])
+        self.assertTrue(raw["Phase Present"][2])
+        self.assertTrue(raw["Signal Time Available"][2])
+        self.assertTrue(raw["Preamble Not Detected"][2])
+        self.assertEqual(raw["Phase Present"].dtype, bool)
+    
     def test_process_software_version(self):
         # Test data
         data = b' CSM54 05.04 18/10/16\x00\xbc\x8f\xec\x1cNV08C 07.03 30/03/12\x00\xbc\x8f\xec\x1c                    \x00\x00\x00\x00\x00'
@@ -306,16 +398,16 @@ class Tests(unittest.TestCase):
         data = b'\xebaFF\x0f\xe0MA\xdf\x10\x10\xb3\t\xb4\x1e\xb7@Gi\xb8a5$SA\x00\x00\x00`\x9d\xde\x1a@\x00\x00\x00\xc0jd\x13@\x00\x00\x00 \xbe=\x1c@\x00'
 
         # Process antenna
-        geo_coords = binr.process_geocentric_coordinates_of_antenna(data)
+        geo_coords = binr.process_geocentric_coordinates_of_antenna(binr.unstuff(data))
 
         # Check returned values
         self.assertEquals(geo_coords["X"],3915806.549022903)
-        self.assertEquals(geo_coords["Y"],-3.4419559446041095e-43) # TODO: something looks wrong here
-        self.assertEquals(geo_coords["Z"],3.2932389635128064e+92)
-        self.assertEquals(geo_coords["X error"],2.9511633910563842e-179)
-        self.assertEquals(geo_coords["Y error"],2.9613168073097877e-215)
-        self.assertEquals(geo_coords["Z error"],1.2025483161027633e-172)
-        self.assertEquals(geo_coords["Flag"],64)
+        self.assertEquals(geo_coords["Y"],5918.703273002261)
+        self.assertEquals(geo_coords["Z"],5017813.526880569)
+        self.assertEquals(geo_coords["X error"],6.717397212982178)
+        self.assertEquals(geo_coords["Y error"],4.8480634689331055)
+        self.assertEquals(geo_coords["Z error"],7.060295581817627)
+        self.assertEquals(geo_coords["Flag"],0)
 
       
     def test_process_extended_ephemeris_of_satellites(self):
@@ -380,4 +472,56 @@ class Tests(unittest.TestCase):
         self.assertEquals(ext_ephemeris["t_b"], 69300000.0)
         self.assertEquals(ext_ephemeris["gamma_n"], 0)
         self.assertEquals(ext_ephemeris["tau_n"], 0.033291056752204895)
-        self.assertEquals(ext_ephemeris["E_n"], 0)
\ No newline at end of file
+        self.assertEquals(ext_ephemeris["E_n"], 0)
+
+        # Test invalid system
+        with self.assertRaises(ValueError):
+            binr.process_extended_ephemeris_of_satellites(b'\x03\x01'+bytes(136))
+
+    def test_message_layouts(self):
+        # Check compiled sizes against the protocol specification
+        self.assertEqual(binr.LAYOUTS[(0x49, binr.GPS)].size, 130)
+        self.assertEqual(binr.LAYOUTS[(0x49, binr.GLONASS)].size, 93)
+        self.assertEqual(binr.LAYOUTS[(0x4A, None)].size, 33)
+        self.assertEqual(binr.LAYOUTS[(0x4B, None)].size, 42)
+        self.assertEqual(binr.LAYOUTS[(0xF6, None)].size, 49)
+        self.assertEqual(binr.LAYOUTS[(0xF7, binr.GPS)].size, 138)
+        self.assertEqual(binr.LAYOUTS[(0xF7, binr.GLONASS)].size, 93)
+
+        # Decode from an offset into a memoryview
+        data = memoryview(b'\xff'+bytes(32)+b'\xff')
+        param = binr.LAYOUTS[(0x4A, None)].decode(data, 1)
+        self.assertEqual(param["alpha_0"], 0.0)
+        self.assertEqual(param["Reliability"], 255)
+
+        # Unknown messages
+        with self.assertRaises(ValueError):
+            binr.decode_message(0x99, b'\x01')
+
+    def test_scan_frames(self):
+        # Two frames with garbage between them
+        stream = bytes([0x11,0x10,0x21,0x01,0x10,0x03,0x23,
+                        0x10,0x60,0x10,0x10,0x10,0x03])
+        offsets, lengths, frames = binr.scan_frames(stream)
+        self.assertEqual(offsets.tolist(), [1, 7])
+        self.assertEqual(lengths.tolist(), [5, 6])
+        self.assertEqual(frames[1]["data"], b'\x10')
+
+    def test_load_recording(self):
+        # Decode the example recording
+        recording = binr.load_recording("pelham_shed_1_July_2018.dat")
+
+        # Check message counts
+        self.assertEqual(recording["Frames"][0xF5], 1154)
+        self.assertEqual(len(recording["Epochs"]), 1154)
+        self.assertEqual(len(recording["Observations"]), 19908)
+        self.assertEqual(recording["Channel Count"].sum(), 19908)
+        self.assertEqual(len(recording["Epoch Index"]), 19908)
+        self.assertEqual(len(recording["GPS Ephemeris"]), 11)
+        self.assertEqual(len(recording["GLONASS Ephemeris"]), 12)
+
+        # Check against the single message decoders
+        self.assertEqual(recording["Epochs"]["Time"][0], 58374000.14730411)
+        self.assertEqual(recording["Observations"]["Carrier Phase"][0], 130726.82761855995)
+        self.assertEqual(recording["GPS Ephemeris"]["sqrtA"][0], 5153.671276092529)
+        self.assertEqual(recording["GPS Ephemeris"]["IODE"][0], 68)
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import binr
+import container
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open("pelham_shed_1_July_2018.dat", 'rb') as f:
+            self.data = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_container(self):
+        for codec in ["zlib", "lzma"]:
+            filename = os.path.join(self.tmp_dir, "recording_"+codec+".binz")
+            container.compress_recording("pelham_shed_1_July_2018.dat", filename,
+                                         codec, block_size=32*1024)
+            self.assertLess(os.path.getsize(filename), len(self.data))
+            with container.ContainerReader(filename) as reader:
+                self.assertTrue(reader.complete)
+                self.assertGreater(len(reader), 10)
+                self.assertEqual(reader.read(), self.data)
+
+                # Blocks end on frame boundaries, the recording ends mid frame
+                for i in range(len(reader) - 1):
+                    block = reader.read_block(i)
+                    offsets, lengths, frames = binr.scan_frames(block)
+                    self.assertEqual(offsets[-1] + lengths[-1], len(block))
+
+                # A time window decompresses only the blocks it needs
+                start = reader.blocks["Time"][5] + 10000
+                stop = start + 20000
+                frames = reader.frames(start, stop)
+                times = [binr.process_raw_data_arrays(frame["data"])["Time"]
+                         for frame in frames if frame["ID"] == 0xF5]
+                self.assertEqual(len(times), 20)
+                self.assertGreaterEqual(times[0], start)
+                self.assertLess(times[-1], stop)
+
+    def test_window_mid_block(self):
+        filename = os.path.join(self.tmp_dir, "recording.binz")
+        container.compress_recording("pelham_shed_1_July_2018.dat", filename, block_size=8192)
+        raw_time = lambda frame: binr.process_raw_data_arrays(frame["data"])["Time"]
+        all_times = np.array([raw_time(frame) for frame in binr.BinrFramer().feed(self.data)
+                              if frame["ID"] == 0xF5])
+        with container.ContainerReader(filename) as reader:
+            # Windows that start in blocks which do not begin with raw data
+            starts = []
+            for i in range(1, len(reader)):
+                frames = binr.BinrFramer().feed(reader.read_block(i))
+                if frames[0]["ID"] != 0xF5:
+                    # The block carries the time of the raw data before it
+                    start = all_times[all_times < reader.blocks["Time"][i] + 1][-1]
+                    self.assertEqual(reader.blocks["Time"][i], start)
+                    starts.append(start)
+            self.assertGreater(len(starts), 0)
+            for start in starts[:20]:
+                stop = start + 2000
+                times = [raw_time(frame) for frame in reader.frames(start, stop)
+                         if frame["ID"] == 0xF5]
+                expected = all_times[(all_times >= start) & (all_times < stop)]
+                self.assertEqual(len(expected), 2)
+                self.assertTrue(np.array_equal(times, expected))
+
+    def test_streaming(self):
+        filename = os.path.join(self.tmp_dir, "live.binz")
+        writer = container.ContainerWriter(filename, block_size=16*1024)
+        writer.write(self.data[:100000])
+        reader = container.ContainerReader(filename)
+        self.assertFalse(reader.complete)
+        blocks = len(reader)
+        self.assertGreater(blocks, 0)
+        partial = reader.read()
+        self.assertEqual(partial, self.data[:len(partial)])
+
+        writer.write(self.data[100000:])
+        reader.refresh()
+        self.assertGreater(len(reader), blocks)
+        writer.close()
+        reader.refresh()
+        self.assertTrue(reader.complete)
+        self.assertEqual(reader.read(), self.data)
+        reader.close()
+
+if __name__ == '__main__':
+    unittest.main()
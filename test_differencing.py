@@ -0,0 +1,67 @@
+import unittest
+import numpy as np
+import binr
+import differencing
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        with open("pelham_shed_1_July_2018.dat", 'rb') as f:
+            frames = binr.BinrFramer().feed(f.read())
+        self.epochs = [binr.process_raw_data_arrays(frame["data"]) for frame in frames
+                       if frame["ID"] == 0xF5]
+
+    def test_sat_index(self):
+        index = differencing.sat_index([2, 2, 1, 4, 1, 2], [1, 32, 1, 120, 40, 0])
+        np.testing.assert_array_equal(index, [0, 31, 32, 64, -1, -1])
+        lam = differencing.wavelength([2, 1], [0, -7])
+        self.assertAlmostEqual(lam[0], 0.19029367279836487)
+        self.assertAlmostEqual(lam[1], 299792458.0/(1602E6 - 7*0.5625E6))
+
+    def test_double_differences(self):
+        raw = self.epochs[600]
+        rover = differencing.SatelliteObservations().fill(raw)
+
+        # A base with a receiver clock offset and one satellite missing
+        base_raw = dict(raw)
+        base_raw["Carrier Phase"] = raw["Carrier Phase"] + 1000.0
+        base_raw["Pseudo Range"] = raw["Pseudo Range"] + 0.001
+        base_raw["Flags"] = raw["Flags"].copy()
+        usable = np.flatnonzero((raw["Flags"] & 0x0B) == 0x0B)
+        missing = differencing.sat_index(raw["Signal Type"][usable[0]],
+                                         raw["Sat Number"][usable[0]])
+        base_raw["Flags"][usable[0]] = 0
+        base = differencing.SatelliteObservations().fill(base_raw)
+
+        dd = differencing.double_differences(rover, base)
+        self.assertFalse(dd["Common"][missing])
+        self.assertEqual(np.count_nonzero(dd["Common"]), len(usable) - 1)
+        self.assertNotIn(missing, dd["Satellites"])
+        self.assertEqual(len(dd["Satellites"]), len(usable) - 1 - len(np.unique(dd["Reference"])))
+        np.testing.assert_allclose(dd["Code"], 0, atol=1E-6)
+        np.testing.assert_allclose(dd["Phase"][dd["Reference"] < 32], 0, atol=1E-6)
+
+        # Reference satellites have the highest SNR or elevation of their system
+        for ref in np.unique(dd["Reference"]):
+            system = differencing.SAT_SIGNAL == differencing.SAT_SIGNAL[ref]
+            self.assertEqual(rover.snr[ref], np.max(rover.snr[system & dd["Common"]]))
+        elevation = np.zeros(differencing.NUM_SATS)
+        elevation[dd["Satellites"][0]] = 1.0
+        dd = differencing.double_differences(rover, base, elevation)
+        self.assertIn(np.flatnonzero(elevation)[0], dd["Reference"])
+
+    def test_refill(self):
+        # Satellites that drop out leave no observations behind
+        observations = differencing.SatelliteObservations()
+        observations.fill(self.epochs[600])
+        raw = dict(self.epochs[601])
+        raw["Flags"] = np.zeros_like(raw["Flags"])
+        observations.fill(raw)
+        self.assertFalse(np.any(observations.valid))
+        self.assertTrue(np.all(np.isnan(observations.phase)))
+        self.assertTrue(np.all(np.isnan(observations.code)))
+        dd = differencing.double_differences(observations, observations)
+        self.assertTrue(np.all(np.isnan(dd["Single Phase"])))
+        self.assertTrue(np.all(np.isnan(dd["Single Code"])))
+
+if __name__ == '__main__':
+    unittest.main()
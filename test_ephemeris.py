@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 import ephemeris
 
 class Tests(unittest.TestCase):
@@ -37,4 +38,242 @@ class Tests(unittest.TestCase):
         )
         self.assertEquals(sat_clk_bias,-6.1549414555349904e-05)
         self.assertEquals(dt_r,3.5336684847128199e-09)      
-    
\ No newline at end of file
+    
+    def test_solve_kepler(self):
+        # Check that the solution satisfies Keplers equation
+        M = np.linspace(-np.pi, np.pi, 101)
+        e = np.full(101, 0.02)
+        E = ephemeris.solve_kepler(M, e)
+        self.assertTrue(np.allclose(E - e*np.sin(E), M, rtol=0, atol=1e-12))
+
+    def test_calc_sat_xyz_batch(self):
+        # Create test data
+        eph = {"System":1,"PRN":1,"C_rs":-96.59375,
+               "C_us":5.757436156272888e-06,
+               "dn":4.394468729879142e-12,
+               "M_0":0.9302223777587179,
+               "C_uc":-4.811212420463562e-06,
+               "e":0.00794832909014076,
+               "sqrtA":5153.671276092529,
+               "t_0e":64800000.0,
+               "C_ic":-3.725290298461914e-09,
+               "Omega_0":2.910170226716813,
+               "C_is":8.568167686462402e-08,
+               "I_0":0.9720403650400273,
+               "C_rc": 274.09375,
+               "w":0.652247015654833,
+               "Omega_dot":-8.148910863417868e-12,
+               "IDOT":-3.3679974334690787e-13,
+               "T_GD":5.587935447692871e-06 ,
+               "t_0c":64800000.0,"a_f2": 0.0,
+               "a_f1":-3.637978807091713e-12,
+               "a_f0":-0.061552971601486206 ,
+               "URA":0,"IODE":68}
+        t = 58374000.14730411/1000 + 18
+
+        # Run function on a single satellite
+        pos, sat_clk_bias, dt_r = ephemeris.calc_sat_xyz_batch(t, eph)
+        self.assertEqual(pos.shape, (1, 3))
+        self.assertEqual(sat_clk_bias.shape, (1,))
+        self.assertEqual(dt_r.shape, (1,))
+        self.assertAlmostEqual(pos[0, 0], 13385961.902648877, delta=1e-3)
+        self.assertAlmostEqual(pos[0, 1], -18510030.0029075, delta=1e-3)
+        self.assertAlmostEqual(pos[0, 2], 13132981.772602744, delta=1e-3)
+        self.assertAlmostEqual(sat_clk_bias, -6.152965943382626e-05, delta=1e-15)
+        self.assertAlmostEqual(dt_r, 8.143513401481322e-11, delta=1e-18)
+
+        # Run function on many epochs and check against single evaluations
+        times = t + np.arange(0, 3600, 300)
+        ephs = ephemeris.stack_ephemerides([eph]*len(times))
+        pos, sat_clk_bias, dt_r = ephemeris.calc_sat_xyz_batch(times, ephs)
+        self.assertEqual(pos.shape, (len(times), 3))
+        for i in range(len(times)):
+            single, clk, rel = ephemeris.calc_sat_xyz_batch(times[i], eph)
+            self.assertTrue(np.allclose(pos[i], single[0], rtol=0, atol=1e-6))
+            self.assertAlmostEqual(sat_clk_bias[i], clk, delta=1e-18)
+
+        # GPS orbit radius
+        radius = np.linalg.norm(pos, axis=1)
+        self.assertTrue(np.all(radius > 2.6e7) and np.all(radius < 2.7e7))
+
+    def test_ephemeris_store(self):
+        store = ephemeris.EphemerisStore(max_per_sat=2)
+
+        # Add sets for GPS PRN 1 two hours apart
+        eph_a = {"System":ephemeris.GPS, "PRN":1, "IODE":10, "t_0e":57600000.0}
+        eph_b = {"System":ephemeris.GPS, "PRN":1, "IODE":11, "t_0e":64800000.0}
+        self.assertTrue(store.add(eph_a))
+        self.assertTrue(store.add(eph_b))
+        self.assertFalse(store.add(dict(eph_b))) # Repeated set
+        self.assertEqual(len(store), 2)
+
+        # Nearest reference time is served
+        self.assertIs(store.get(ephemeris.GPS, 1, 58000), eph_a)
+        self.assertIs(store.get(ephemeris.GPS, 1, 63000), eph_b)
+        self.assertIsNone(store.get(ephemeris.GPS, 1, 64800+7201))
+        self.assertIsNone(store.get(ephemeris.GPS, 2, 58000))
+
+        # New issue with the same reference time supersedes the old one
+        eph_c = {"System":ephemeris.GPS, "PRN":1, "IODE":12, "t_0e":64800000.0}
+        self.assertTrue(store.add(eph_c))
+        self.assertEqual(len(store), 2)
+        self.assertIs(store.get(ephemeris.GPS, 1, 63000), eph_c)
+
+        # Memory is bounded per satellite
+        eph_d = {"System":ephemeris.GPS, "PRN":1, "IODE":13, "t_0e":72000000.0}
+        store.add(eph_d)
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get(ephemeris.GPS, 1, 57000))
+
+        # Week crossover
+        eph_e = {"System":ephemeris.GPS, "PRN":3, "IODE":1, "t_0e":0.0}
+        store.add(eph_e)
+        self.assertIs(store.get(ephemeris.GPS, 3, 604000), eph_e)
+
+        # GLONASS sets from message 49h
+        eph_f = {"System":ephemeris.GLONASS, "n^A":5, "t_b":69300000.0}
+        store.add(eph_f)
+        self.assertIs(store.get(ephemeris.GLONASS, 5, 69000), eph_f)
+
+        # Expire old sets
+        store.expire(72000+7300)
+        self.assertEqual(store.satellites(), [])
+
+    def test_ephemeris_store_rollover(self):
+        store = ephemeris.EphemerisStore(max_per_sat=3)
+
+        # GLONASS t_b wraps at the end of the day
+        glonass = [{"System":ephemeris.GLONASS, "PRN":5, "t_b":t_b*1000.0}
+                   for t_b in [81000, 82800, 84600, 900]]
+        for eph in glonass:
+            self.assertTrue(store.add(eph))
+        self.assertEqual(len(store), 3)
+        self.assertIs(store.get(ephemeris.GLONASS, 5, 2700), glonass[3])
+        self.assertIs(store.get(ephemeris.GLONASS, 5, 84000), glonass[2])
+        self.assertIs(store.get(ephemeris.GLONASS, 5, 81000), glonass[1]) # First set evicted
+
+        # A late set older than all the stored ones is not kept
+        late = {"System":ephemeris.GLONASS, "PRN":5, "t_b":79200000.0}
+        self.assertFalse(store.add(late))
+        self.assertIs(store.get(ephemeris.GLONASS, 5, 2700), glonass[3])
+
+        # GPS t_0e wraps at the end of the week
+        gps = [{"System":ephemeris.GPS, "PRN":1, "IODE":iode, "t_0e":t_0e*1000.0}
+               for iode, t_0e in enumerate([590400, 597600, 0, 7200])]
+        for eph in gps:
+            self.assertTrue(store.add(eph))
+        self.assertIs(store.get(ephemeris.GPS, 1, 7000), gps[3])
+        self.assertIs(store.get(ephemeris.GPS, 1, 604000), gps[2])
+        self.assertIs(store.get(ephemeris.GPS, 1, 590400), gps[1]) # First set evicted
+
+    def test_gps_orbit(self):
+        # Create test data
+        eph = {"System":1,"PRN":1,"C_rs":-96.59375,
+               "C_us":5.757436156272888e-06,
+               "dn":4.394468729879142e-12,
+               "M_0":0.9302223777587179,
+               "C_uc":-4.811212420463562e-06,
+               "e":0.00794832909014076,
+               "sqrtA":5153.671276092529,
+               "t_0e":64800000.0,
+               "C_ic":-3.725290298461914e-09,
+               "Omega_0":2.910170226716813,
+               "C_is":8.568167686462402e-08,
+               "I_0":0.9720403650400273,
+               "C_rc": 274.09375,
+               "w":0.652247015654833,
+               "Omega_dot":-8.148910863417868e-12,
+               "IDOT":-3.3679974334690787e-13,
+               "T_GD":5.587935447692871e-06 ,
+               "t_0c":64800000.0,"a_f2": 0.0,
+               "a_f1":-3.637978807091713e-12,
+               "a_f0":-0.061552971601486206 ,
+               "URA":0,"IODE":68}
+        t = 58374000.14730411/1000 + 18
+
+        # Check derived constants
+        orbit = ephemeris.GpsOrbit(eph)
+        self.assertEqual(orbit.prn, 1)
+        self.assertEqual(orbit.iode, 68)
+        self.assertEqual(orbit.t_0e, 64800.0)
+        self.assertAlmostEqual(orbit.A, 5153.671276092529**2)
+        self.assertAlmostEqual(orbit.T_GD, 5.587935447692871e-09)
+        with self.assertRaises(AttributeError):
+            orbit.extra = 1
+
+        # Check against a direct evaluation of the IS-GPS-200 equations
+        pos, sat_clk_bias, dt_r = orbit.position(t + np.array([0, 3600]))
+        np.testing.assert_allclose(pos, [[13385961.902648877, -18510030.0029075,
+                                          13132981.772602744],
+                                         [13343722.058191765, -10561969.623994654,
+                                          20153270.882425647]], rtol=0, atol=1e-3)
+        np.testing.assert_allclose(sat_clk_bias, [-6.152965943382626e-05,
+                                                  -6.154275615753179e-05], rtol=0, atol=1e-15)
+        np.testing.assert_allclose(dt_r, [8.143513401481322e-11,
+                                          -9.115847023341096e-09], rtol=0, atol=1e-18)
+
+        # Compiled orbits are served by the store
+        store = ephemeris.EphemerisStore()
+        store.add(eph)
+        self.assertIsInstance(store.get_orbit(ephemeris.GPS, 1, t), ephemeris.GpsOrbit)
+
+    def test_glonass_orbit(self):
+        # GLONASS extended ephemeris (message F7h)
+        eph = {"System":2, "PRN":12, "H_n^A":-1,
+               "x_n":11308469.7265625, "y_n":-21233672.36328125, 
+               "z_n":8571060.05859375, "x_nv":0.5774717330932617, 
+               "y_nv":-1.0365982055664062, "z_nv":-3.320493698120117,
+               "x_na":3.725290298461914e-12, "y_na":-1.862645149230957e-12,
+               "z_na":9.313225746154785e-13, "t_b":69300000.0, "gamma_n":0,
+               "tau_n":0.033291056752204895, "E_n":0}
+        t = 69300.0 + 900
+
+        # Check against a fine step integration
+        orbit = ephemeris.GlonassOrbit(eph)
+        pos, sat_clk_bias, dt_r = orbit.position(t)
+        self.assertEqual(pos.shape, (1, 3))
+        ref = ephemeris.glonass_integrate(orbit.state_b, orbit.acc, np.array([900.0]), 
+                                          max_step=1.0)
+        self.assertTrue(np.abs(pos - ref[:, :3]).max() < 1e-2)
+        self.assertAlmostEqual(sat_clk_bias[0], -0.033291056752204895/1000)
+        radius = np.linalg.norm(pos)
+        self.assertTrue(radius > 2.54e7 and radius < 2.57e7)
+
+        # Successive epochs advance from the last state
+        pos_next = orbit.position(t + 0.1)[0]
+        self.assertTrue(np.all(orbit.t_cache == t + 0.1))
+        fresh = ephemeris.GlonassOrbit(eph).position(t + 0.1)[0]
+        self.assertTrue(np.abs(pos_next - fresh).max() < 1e-3)
+
+        # Many satellites at once
+        ephs = ephemeris.stack_ephemerides([eph, eph], ephemeris.GLONASS_ORBIT_FIELDS)
+        pos, sat_clk_bias, dt_r = ephemeris.GlonassOrbit(ephs).position(np.array([t, t - 600]))
+        ref = ephemeris.GlonassOrbit(eph).position(t)[0]
+        self.assertTrue(np.abs(pos[0] - ref[0]).max() < 1e-2)
+        ref = ephemeris.GlonassOrbit(eph).position(t - 600)[0]
+        self.assertTrue(np.abs(pos[1] - ref[0]).max() < 1e-2)
+
+        # Many times of one satellite through the store
+        store = ephemeris.EphemerisStore()
+        store.add(eph)
+        orbit = store.get_orbit(ephemeris.GLONASS, 12, t)
+        self.assertIsInstance(orbit, ephemeris.GlonassOrbit)
+        times = t + np.arange(0, 600, 60.0)
+        pos = orbit.position(times)[0]
+        self.assertEqual(pos.shape, (len(times), 3))
+        for i in range(len(times)):
+            ref = ephemeris.GlonassOrbit(eph).position(times[i])[0]
+            self.assertTrue(np.abs(pos[i] - ref[0]).max() < 1e-2)
+
+    def test_glonass_orbit_icd(self):
+        # Example of the GLONASS ICD (edition 5.1, appendix J), km in the
+        # ICD are m/ms in BINR units
+        eph = {"System":2, "PRN":1, "x_n":7003008.789, "y_n":-12206626.953,
+               "z_n":21280765.625, "x_nv":0.7835417, "y_nv":2.8042530,
+               "z_nv":1.3525150, "x_na":0.0, "y_na":1.7e-12, "z_na":-5.41e-12,
+               "t_b":11700000.0, "gamma_n":0, "tau_n":0}
+        state = ephemeris.GlonassOrbit(eph).state(12300.0)[0]
+        np.testing.assert_allclose(state[:3], [7523174.819, -10506961.965, 21999239.413],
+                                   rtol=0, atol=1.0)
+        np.testing.assert_allclose(state[3:], [950.126007, 2855.687825, 1040.679862],
+                                   rtol=0, atol=5e-3)
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import time
+import unittest
+import ingest
+
+class FakeSerial:
+    """
+    Serial port stand-in that releases a recording in small chunks.
+    """
+    def __init__(self, data, chunk=100):
+        self.data = data
+        self.chunk = chunk
+        self.pos = 0
+        self.lock = threading.Lock()
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk, len(self.data) - self.pos)
+
+    def read(self, size=1):
+        with self.lock:
+            if self.pos >= len(self.data):
+                time.sleep(0.01) # Serial timeout
+                return b''
+            chunk = self.data[self.pos:self.pos+size]
+            self.pos += len(chunk)
+            return chunk
+
+class Tests(unittest.TestCase):
+    def test_ingest(self):
+        with open("pelham_shed_1_July_2018.dat", 'rb') as f:
+            data = f.read()
+        streams = {"rover":FakeSerial(data), "base":FakeSerial(data, 37)}
+
+        counts = {}
+        times = {"rover":[], "base":[]}
+        def handler(name, message_id, message):
+            counts[(name, message_id)] = counts.get((name, message_id), 0) + 1
+            if message_id == 0xF5:
+                times[name].append(message["Time"])
+            if len(times["rover"]) == 1154 and len(times["base"]) == 1154:
+                receivers.stop()
+
+        receivers = ingest.Ingest(streams, handler)
+        asyncio.run(asyncio.wait_for(receivers.run(), 60))
+
+        # Every message of both receivers arrives in order
+        for name in streams:
+            self.assertEqual(counts[(name, 0xF5)], 1154)
+            self.assertEqual(counts[(name, 0xF7)], 23)
+            self.assertEqual(times[name], sorted(times[name]))
+        self.assertEqual(receivers.readers[0].bytes_read, len(data))
+
+if __name__ == '__main__':
+    unittest.main()
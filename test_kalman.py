@@ -0,0 +1,86 @@
+import unittest
+import numpy as np
+import ambiguity
+import differencing
+import ephemeris
+import kalman
+
+BASE = np.array([3915010.0, 7525.0, 5018407.0])
+BASELINE = np.array([12.3, -4.5, 7.8])
+
+def satellites(t):
+    """
+    Eight GPS satellites above the base, moving slowly across the sky.
+    """
+    sat_pos = np.zeros((differencing.NUM_SATS, 3))
+    up = BASE/np.linalg.norm(BASE)
+    east = np.cross([0, 0, 1], up)
+    east /= np.linalg.norm(east)
+    north = np.cross(up, east)
+    for i in range(8):
+        az = 2*np.pi*i/8 + 2E-4*t
+        el = np.radians(20 + 8*i) + 1E-4*t
+        los = np.cos(el)*(np.sin(az)*east + np.cos(az)*north) + np.sin(el)*up
+        sat_pos[i] = BASE + 2.2E7*los
+    return sat_pos
+
+def observe(pos, sat_pos, ambiguities, clock, rng):
+    obs = differencing.SatelliteObservations()
+    lam = ephemeris.C/differencing.F_GPS_L1
+    rng_true = np.linalg.norm(sat_pos[:8] - pos, axis=1)
+    obs.valid[:8] = True
+    obs.wavelength[:8] = lam
+    obs.snr[:8] = 40 + np.arange(8)
+    obs.code[:8] = rng_true + clock + rng.normal(0, 0.3, 8)
+    obs.phase[:8] = rng_true + 2*clock + lam*ambiguities + rng.normal(0, 0.003, 8)
+    return obs
+
+class Tests(unittest.TestCase):
+    def test_float_rtk(self):
+        rng = np.random.default_rng(3)
+        rover_amb = rng.integers(-100000, 100000, 8).astype(np.float64)
+        base_amb = rng.integers(-100000, 100000, 8).astype(np.float64)
+        rtk = kalman.FloatRtkFilter(BASE, position_noise=0.0)
+        rtk.initialize(BASE + BASELINE + [1.0, -2.0, 1.5])
+        for epoch in range(120):
+            t = 30.0*epoch
+            sat_pos = satellites(t)
+            rover = observe(BASE + BASELINE, sat_pos, rover_amb, 100.0*epoch, rng)
+            base = observe(BASE, sat_pos, base_amb, -50.0*epoch, rng)
+
+            # Satellite 3 sets for a while and satellite 5 slips
+            if 40 <= epoch < 50:
+                rover.valid[3] = False
+            slips = None
+            if epoch == 80:
+                rover_amb[5] += 7
+                rover.phase[5] += 7*rover.wavelength[5]
+                slips = [5]
+            dd = differencing.double_differences(rover, base)
+            residuals = rtk.update(t, dd, sat_pos, slips)
+            self.assertEqual(len(rtk.x), 3 + np.count_nonzero(dd["Common"]))
+        self.assertLess(np.max(np.abs(residuals)), 0.05)
+        np.testing.assert_allclose(rtk.baseline, BASELINE, atol=0.1)
+
+        # The float ambiguities resolve to the true integers
+        a, Q, Q_ba = rtk.dd_ambiguities()
+        sd = rover_amb - base_amb
+        true = sd[dd["Satellites"]] - sd[dd["Reference"]]
+        result = ambiguity.resolve(a, Q)
+        np.testing.assert_array_equal(result["Fixed"], true)
+        np.testing.assert_allclose(rtk.fixed_baseline(result["Fixed"]), BASELINE, atol=0.01)
+
+    def test_week_rollover(self):
+        rtk = kalman.FloatRtkFilter(BASE)
+        rtk._predict(604799.0)
+        P = rtk.P.copy()
+        rtk._predict(1.0)
+        np.testing.assert_allclose(np.diag(rtk.P - P), np.full(3, 2*kalman.POSITION_NOISE**2))
+
+    def test_needs_initial_position(self):
+        rtk = kalman.FloatRtkFilter(BASE)
+        with self.assertRaises(ValueError):
+            rtk.update(0.0, None, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+import binr
+import ephemeris
+import positioning
+import synthetic
+
+class Tests(unittest.TestCase):
+    def test_spp_solver(self):
+        # Replay the recording through the solver
+        with open("pelham_shed_1_July_2018.dat", 'rb') as f:
+            frames = binr.BinrFramer().feed(f.read())
+        store = ephemeris.EphemerisStore()
+        solver = positioning.SppSolver(store)
+        solutions = []
+        for frame in frames:
+            if frame["ID"] == 0xF7:
+                store.add(binr.process_extended_ephemeris_of_satellites(frame["data"]))
+            elif frame["ID"] == 0xF5:
+                raw = binr.process_raw_data_arrays(frame["data"])
+                try:
+                    solutions.append(solver.solve(raw))
+                except ValueError:
+                    pass # Not enough ephemerides yet
+
+        # Position of the shed
+        last = solutions[-1]
+        np.testing.assert_allclose(last["Position"], [3915010, 7525, 5018407], atol=30)
+        self.assertLess(np.max(np.abs(last["Residuals"])), 20)
+        self.assertEqual(len(last["Residuals"]), len(last["Satellites"]))
+        self.assertIn(ephemeris.GLONASS, last["Satellites"][:, 0])
+
+        # Warm started epochs converge quickly
+        iterations = [s["Iterations"] for s in solutions[10:]]
+        self.assertLessEqual(max(iterations), 2)
+
+    def test_solve_recording(self):
+        recording = binr.load_recording("pelham_shed_1_July_2018.dat")
+        serial = positioning.solve_recording(recording, workers=1, chunk_size=300)
+        self.assertEqual(len(serial), len(recording["Epochs"]))
+        self.assertEqual(serial.dtype, positioning.SOLUTION_DTYPE)
+        np.testing.assert_array_equal(serial["Time"], recording["Epochs"]["Time"])
+        solved = ~np.isnan(serial["X"])
+        self.assertGreater(np.sum(solved), 1100)
+        np.testing.assert_allclose(np.nanmedian(serial["X"]), 3915010, atol=30)
+
+        # The process pool gives the same results in the same order
+        pooled = positioning.solve_recording(recording, workers=2, chunk_size=300)
+        np.testing.assert_array_equal(pooled, serial)
+
+    def test_satellite_clock(self):
+        # GPS satellites with clock offsets up to 1 ms
+        rx_pos = np.array([3915010.0, 7525.0, 5018407.0])
+        t_rx = 58374.0 # GPS time of week [s]
+        bias = 2E-4 # Receiver clock [s]
+        store = ephemeris.EphemerisStore()
+        raw = {"Time":(t_rx + bias)*1000 - 18000, "GPS time shift":18000.0,
+               "GLO time shift":10800000.0, "Signal Type":[], "Sat Number":[],
+               "Pseudo Range":[], "Flags":[]}
+        for prn in range(1, 33):
+            eph = synthetic.gps_ephemeris(prn, 57600)
+            eph["a_f0"] = (-1)**prn*(0.3 + prn/50) # [ms]
+            orbit = ephemeris.GpsOrbit(eph)
+
+            # Light time from the orbit at the true transmission time
+            tau = 0.07
+            for i in range(5):
+                pos = positioning.sagnac_rotate(orbit.position(t_rx - tau)[0], np.array([tau]))
+                tau = np.linalg.norm(pos[0] - rx_pos)/ephemeris.C
+            if positioning.elevation(rx_pos, pos)[0] < np.radians(10):
+                continue
+            store.add(eph)
+            clk, dt_r = [value[0] for value in orbit.position(t_rx - tau)[1:]]
+            pseudorange = tau + bias - (clk + dt_r - orbit.T_GD) # [s]
+            raw["Signal Type"].append(binr.SIGNAL_GPS)
+            raw["Sat Number"].append(prn)
+            raw["Pseudo Range"].append(pseudorange*1000)
+            raw["Flags"].append(0x1B)
+        self.assertGreater(len(raw["Sat Number"]), 5)
+
+        solution = positioning.SppSolver(store).solve(raw)
+        np.testing.assert_allclose(solution["Position"], rx_pos, rtol=0, atol=1E-3)
+        self.assertAlmostEqual(solution["Clock Bias"], bias, delta=1E-11)
+
+    def test_sagnac_rotate(self):
+        pos = np.array([[26000000.0, 0, 1000]])
+        rotated = positioning.sagnac_rotate(pos, np.array([0.07]))
+        self.assertAlmostEqual(np.linalg.norm(rotated), np.linalg.norm(pos))
+        self.assertAlmostEqual(rotated[0, 1], -26000000*np.sin(ephemeris.OMGE*0.07))
+        self.assertEqual(rotated[0, 2], 1000)
+
+if __name__ == '__main__':
+    unittest.main()
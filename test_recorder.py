@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+import binr
+import recorder
+
+class FakeSerial:
+    """
+    Serial port stand-in that releases data in small chunks.
+    """
+    def __init__(self, data, chunk=1000):
+        self.data = data
+        self.chunk = chunk
+        self.pos = 0
+        self.done = threading.Event()
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk, len(self.data) - self.pos)
+
+    def read(self, size=1):
+        if self.pos >= len(self.data):
+            self.done.set()
+            time.sleep(0.01) # Serial timeout
+            return b''
+        chunk = self.data[self.pos:self.pos+size]
+        self.pos += len(chunk)
+        return chunk
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_recorder(self):
+        with open("pelham_shed_1_July_2018.dat", 'rb') as f:
+            data = f.read()
+        streams = {"rover":FakeSerial(data), "base":FakeSerial(data, 777)}
+        capture = recorder.Recorder(streams, self.tmp_dir, max_bytes=100000)
+        capture.start()
+        for stream in streams.values():
+            self.assertTrue(stream.done.wait(30))
+        capture.stop()
+
+        frames = len(binr.scan_frames(data)[0])
+        for name, expected in [("rover", data), ("base", data)]:
+            writer = capture.writers[name]
+            self.assertEqual(writer.total, len(data))
+            self.assertEqual(len(writer.filenames), int(np.ceil(len(data)/100000)))
+
+            # Every byte in order across the rotated files, which split between frames
+            recorded = b''
+            recorded_frames = 0
+            for filename in writer.filenames:
+                self.assertTrue(os.path.basename(filename).startswith(name+"_"))
+                with open(filename, 'rb') as f:
+                    part = f.read()
+                timestamps = recorder.load_timestamps(filename)
+                self.assertEqual(np.sum(timestamps["Length"]), len(part))
+                np.testing.assert_array_equal(timestamps["Offset"][1:],
+                                              np.cumsum(timestamps["Length"])[:-1])
+                self.assertTrue(np.all(np.diff(timestamps["Host Time"]) >= 0))
+                recorded += part
+                recorded_frames += len(binr.scan_frames(part)[0])
+            self.assertEqual(recorded, expected)
+            self.assertEqual(recorded_frames, frames)
+
+    def test_writer_failure(self):
+        with open("pelham_shed_1_July_2018.dat", 'rb') as f:
+            data = f.read()
+        stream = FakeSerial(data)
+        capture = recorder.Recorder({"rover":stream}, os.path.join(self.tmp_dir, "missing"),
+                                    queue_chunks=4)
+        capture.start()
+        time.sleep(0.5)
+        errors = []
+        def stop():
+            try:
+                capture.stop()
+            except IOError as e:
+                errors.append(e)
+        stopping = threading.Thread(target=stop, daemon=True)
+        stopping.start()
+        stopping.join(10)
+        self.assertFalse(stopping.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertIs(errors[0], capture.errors["rover"])
+        self.assertLess(stream.pos, len(data))
+
+if __name__ == '__main__':
+    unittest.main()
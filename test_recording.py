@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import binr
+import recording
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        # Work on a copy so the sidecar does not land in the repository
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, "recording.dat")
+        shutil.copy("pelham_shed_1_July_2018.dat", self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_recording_index(self):
+        # Build the index
+        index = recording.RecordingIndex(self.filename)
+        self.assertEqual(len(index), 1314)
+        self.assertTrue(os.path.exists(recording.index_filename(self.filename)))
+
+        # Select frames by message ID
+        rows = index.select(0xF7)
+        self.assertEqual(len(rows), 23)
+        frames = index.read(rows[:1])
+        ephemeris = binr.process_extended_ephemeris_of_satellites(frames[0]["data"])
+        self.assertEqual(ephemeris["IODE"], 68)
+
+        # Select raw data by time window
+        rows = index.select(0xF5, 58374000, 58374000+10000)
+        frames = index.read(rows)
+        self.assertEqual(len(frames), 10)
+        raw = binr.process_raw_data(frames[0]["data"])
+        self.assertEqual(raw["Time"], 58374000.14730411)
+
+        # Reload from the sidecar
+        reloaded = recording.RecordingIndex(self.filename)
+        self.assertEqual(reloaded.frames["Offset"].tolist(), index.frames["Offset"].tolist())
+        self.assertTrue(np.array_equal(reloaded.frames["Time"], index.frames["Time"], equal_nan=True))
+
+    def test_recording_index_append(self):
+        # Index half the recording, then let it grow
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        with open(self.filename, 'wb') as f:
+            f.write(data[:len(data)//2])
+        partial = recording.RecordingIndex(self.filename)
+        with open(self.filename, 'wb') as f:
+            f.write(data)
+        index = recording.RecordingIndex(self.filename)
+
+        # Check that extending matches a full rebuild
+        self.assertTrue(len(partial) < len(index))
+        rebuilt = recording.RecordingIndex(self.filename, rebuild=True)
+        self.assertEqual(rebuilt.frames["Offset"].tolist(), index.frames["Offset"].tolist())
+        self.assertEqual(rebuilt.frames["ID"].tolist(), index.frames["ID"].tolist())
+        self.assertTrue(np.array_equal(rebuilt.frames["Time"], index.frames["Time"], equal_nan=True))
+
+    def test_recording_index_replaced(self):
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        recording.RecordingIndex(self.filename)
+        half = len(data)//2
+
+        # Replaced by a recording of the same size, then by a larger one
+        # that starts like the indexed part
+        for replacement in [data[half:] + data[:half], data[:100] + data[half:] + data[:half]]:
+            with open(self.filename, 'wb') as f:
+                f.write(replacement)
+            index = recording.RecordingIndex(self.filename)
+            rebuilt = recording.RecordingIndex(self.filename, rebuild=True)
+            self.assertEqual(rebuilt.frames["Offset"].tolist(), index.frames["Offset"].tolist())
+            self.assertTrue(np.array_equal(rebuilt.frames["Time"], index.frames["Time"],
+                                           equal_nan=True))
+
+    def test_select(self):
+        index = recording.RecordingIndex(self.filename)
+        times = index.frames["Time"]
+        for message_id, start, stop in [(None, 58374000, 58384000), (0xF5, None, 58380000),
+                                        ([0xF5, 0xF7], 58390000, None), (None, 0, 1),
+                                        (0xF7, None, None)]:
+            mask = np.ones(len(index), dtype=bool)
+            if message_id is not None:
+                mask &= np.isin(index.frames["ID"], message_id)
+            if start is not None:
+                mask &= times >= start
+            if stop is not None:
+                mask &= times < stop
+            np.testing.assert_array_equal(index.select(message_id, start, stop),
+                                          np.flatnonzero(mask))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+import binr
+import ingest
+import recorder
+import replay
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open("pelham_shed_1_July_2018.dat", 'rb') as f:
+            self.data = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_fast(self):
+        with replay.ReplaySerial("pelham_shed_1_July_2018.dat", replay.FAST, timeout=0.01) as ser:
+            self.assertEqual(ser.in_waiting, len(self.data))
+            frame = ser.read_until(b'\x10\x03')
+            self.assertEqual(frame, self.data[:len(frame)])
+            self.assertTrue(frame.endswith(b'\x10\x03'))
+            self.assertEqual(ser.read_until(b'\x10\x03', size=5), self.data[len(frame):len(frame)+5])
+            data = frame + self.data[len(frame):len(frame)+5]
+            while not ser.finished:
+                data += ser.read(1000)
+            self.assertEqual(data, self.data)
+            self.assertEqual(ser.read(10), b'')
+            self.assertEqual(ser.write(b'\x10\x0E\x10\x03'), 4)
+
+    def test_week_rollover(self):
+        # Raw data times wrap at the end of the week
+        data = b''
+        for t in [604797000.0, 604798000.0, 604799000.0, 0.0, 1000.0, 2000.0]:
+            header = np.array((t, 984, 18000.0, 10800000.0, 0), dtype=binr.RAW_HEADER_DTYPE)
+            data += binr.build_frame(0xF5, header.tobytes())
+        ends, times = replay.receiver_schedule(data)
+        self.assertEqual(ends[-1], len(data))
+        np.testing.assert_allclose(times - times[0], [0, 1, 2, 3, 4, 5, 5])
+
+    def test_paced(self):
+        # The recording covers 1153 s of receiver time
+        speed = 4000.0
+        with replay.ReplaySerial("pelham_shed_1_July_2018.dat", speed) as ser:
+            self.assertLess(ser.in_waiting, 2000)
+            start = time.monotonic()
+            half = ser.read(len(self.data)//2)
+            elapsed = time.monotonic() - start
+            self.assertEqual(half, self.data[:len(half)])
+            self.assertGreater(elapsed, 0.3*1153/speed)
+            self.assertLess(elapsed, 0.5)
+
+    def test_host_timing(self):
+        # Chunks released at their recorder host times
+        filename = os.path.join(self.tmp_dir, "rover.dat")
+        with open(filename, 'wb') as f:
+            f.write(self.data[:3000])
+        stamps = np.zeros(3, dtype=recorder.TIMESTAMP_DTYPE)
+        stamps["Host Time"] = [0, 100000000, 200000000]
+        stamps["Offset"] = [0, 1000, 2000]
+        stamps["Length"] = 1000
+        stamps.tofile(recorder.timestamp_filename(filename))
+        with replay.ReplaySerial(filename, speed=1.0, timing="host") as ser:
+            self.assertEqual(ser.in_waiting, 1000)
+            self.assertEqual(ser.read(2000), self.data[:2000])
+            time.sleep(0.15)
+            self.assertEqual(ser.in_waiting, 1000)
+
+    def test_in_step(self):
+        # Base and rover replayed together through ingest stay in step
+        streams = replay.open_replays({"rover":"pelham_shed_1_July_2018.dat",
+                                       "base":"pelham_shed_1_July_2018.dat"}, speed=1000)
+        times = {"rover":[], "base":[]}
+        lag = []
+        def handler(name, message_id, message):
+            if message_id == 0xF5:
+                times[name].append(message["Time"])
+                if len(times["rover"]) > 0 and len(times["base"]) > 0:
+                    lag.append(abs(times["rover"][-1] - times["base"][-1]))
+            if len(times["rover"]) == 1154 and len(times["base"]) == 1154:
+                receivers.stop()
+
+        receivers = ingest.Ingest(streams, handler)
+        asyncio.run(asyncio.wait_for(receivers.run(), 60))
+        self.assertTrue(all([stream.finished for stream in streams.values()]))
+        self.assertLess(np.median(lag), 1001)
+        self.assertLess(np.percentile(lag, 90), 3001)
+        for stream in streams.values():
+            stream.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+import binr
+import differencing
+import slips
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        with open("pelham_shed_1_July_2018.dat", 'rb') as f:
+            frames = binr.BinrFramer().feed(f.read())
+        self.epochs = [binr.process_raw_data_arrays(frame["data"]) for frame in frames
+                       if frame["ID"] == 0xF5][:300]
+
+    def run_detector(self, changes):
+        """
+        Run the detector over the epochs, applying every change(raw) of
+        changes[(first, last)] to the epochs from first to last.
+        """
+        detector = slips.CycleSlipDetector()
+        events = {}
+        for i, raw in enumerate(self.epochs):
+            raw = dict((name, np.array(value) if isinstance(value, np.ndarray) else value)
+                       for name, value in raw.items())
+            for (first, last), change in changes.items():
+                if first <= i <= last:
+                    change(raw)
+            sats, reasons = detector.update(raw)
+            events[i] = dict(zip(sats.tolist(), reasons.tolist()))
+        return events
+
+    def test_no_slips(self):
+        events = self.run_detector({})
+        for epoch in events.values():
+            for reason in epoch.values():
+                self.assertEqual(reason, slips.SLIP_LOCK)
+
+    def test_week_rollover(self):
+        # GPS time of week wraps halfway through, the slips stay the same
+        raw = self.epochs[150]
+        offset = 604800000 - (raw["Time"] + raw["GPS time shift"]) + 500
+        def wrap(raw):
+            raw["Time"] = (raw["Time"] + raw["GPS time shift"] + offset) % 604800000 - \
+                raw["GPS time shift"]
+        self.assertEqual(self.run_detector({(0, len(self.epochs)): wrap}),
+                         self.run_detector({}))
+
+    def test_injected_slips(self):
+        # Channel with a continuous phase arc in the test window
+        raw = self.epochs[150]
+        channel = np.flatnonzero((raw["Signal Type"] == 2) & ((raw["Flags"] & 0x0B) == 0x0B))[0]
+        sat_number = raw["Sat Number"][channel]
+        sat = int(differencing.sat_index(2, sat_number))
+        def find(raw):
+            return (raw["Signal Type"] == 2) & (raw["Sat Number"] == sat_number)
+
+        def small_slip(raw):
+            raw["Carrier Phase"][find(raw)] += 3
+        def large_slip(raw):
+            raw["Carrier Phase"][find(raw)] -= 200
+        def preamble(raw):
+            raw["Flags"][find(raw)] ^= slips.FLAG_PREAMBLE
+        def lost(raw):
+            raw["Flags"][find(raw)] &= 0xFF ^ slips.FLAG_PHASE
+        events = self.run_detector({(150, 299):small_slip, (200, 299):large_slip,
+                                    (250, 250):preamble, (280, 280):lost})
+
+        self.assertEqual(events[150][sat], slips.SLIP_DOPPLER)
+        self.assertNotIn(sat, events[151]) # The slipped phase continues smoothly
+        self.assertEqual(events[200][sat], slips.SLIP_DOPPLER | slips.SLIP_PHASE_CODE)
+        self.assertEqual(events[250][sat], slips.SLIP_HALF_CYCLE)
+        self.assertEqual(events[251][sat], slips.SLIP_HALF_CYCLE)
+        self.assertNotIn(sat, events[280])
+        self.assertEqual(events[281][sat], slips.SLIP_LOCK)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import binr
+import differencing
+import ephemeris
+import positioning
+import slips
+import synthetic
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_recording(self):
+        receivers = {"rover": synthetic.SyntheticReceiver(seed=1, code_noise=0, phase_noise=0,
+                                                          doppler_noise=0),
+                     "base": synthetic.SyntheticReceiver(synthetic.PELHAM + 10, seed=2)}
+        filenames = synthetic.write_recordings(receivers, 60, self.tmp_dir, interval=1.0)
+        self.assertEqual(sorted(filenames.keys()), ["base", "rover"])
+
+        recording = binr.load_recording(filenames["rover"])
+        self.assertEqual(len(recording["Epochs"]), 60)
+        self.assertTrue(np.all(np.diff(recording["Epochs"]["Time"]) == 1000))
+        self.assertGreater(len(recording["GPS Ephemeris"]), 0)
+        self.assertGreater(len(recording["GLONASS Ephemeris"]), 0)
+
+        # Noiseless observations put the receiver where it was placed
+        store = ephemeris.EphemerisStore()
+        for name in ["GPS Ephemeris", "GLONASS Ephemeris"]:
+            for eph in recording[name]:
+                store.add(dict(zip(eph.dtype.names, eph.tolist())))
+        solver = positioning.SppSolver(store)
+        obs = recording["Observations"]
+        for k in [0, 59]:
+            epoch = recording["Epochs"][k]
+            channels = obs[recording["Epoch Index"] == k]
+            raw = dict([(name, epoch[name]) for name in epoch.dtype.names])
+            raw.update(dict([(name, channels[name]) for name in channels.dtype.names]))
+            solution = solver.solve(raw)
+            self.assertLess(np.linalg.norm(solution["Position"] - synthetic.PELHAM), 0.01)
+
+    def test_slips(self):
+        receiver = synthetic.SyntheticReceiver(seed=3, slip_rate=0.002, max_slip=20)
+        detector = slips.CycleSlipDetector()
+        found = set()
+        for utc, frames in synthetic.generate({"a": receiver}, 300):
+            for frame in binr.BinrFramer().feed(frames["a"]):
+                if frame["ID"] == 0xF5:
+                    sats, reasons = detector.update(binr.process_raw_data_arrays(frame["data"]))
+                    found.update([(utc, int(sat)) for sat in np.atleast_1d(sats)])
+        injected = set([(utc, int(differencing.sat_index(signal, sat)))
+                        for utc, signal, sat, cycles in receiver.slips])
+        self.assertGreater(len(injected), 0)
+        self.assertEqual(found, injected)
+
+    def test_interval(self):
+        with self.assertRaises(ValueError):
+            list(synthetic.generate({"a": synthetic.SyntheticReceiver()}, 1, interval=0.15))
+
+
+if __name__ == '__main__':
+    unittest.main()